@@ -0,0 +1,135 @@
+"""
+Control de admisión para los endpoints que llaman al LLM.
+
+Sin límites, cada /chat esperaba indefinidamente un hilo libre y una llamada a
+OpenAI: en talleres con muchos usuarios la latencia crecía hasta que el cliente
+abandonaba, y el servidor seguía trabajando para nadie.
+
+AdmissionController limita las solicitudes en curso y las que pueden esperar:
+- cola llena -> 429 inmediato
+- demasiado tiempo en cola -> 503
+- cliente desconectado (en cola o en curso) -> se cancela sin llamar al LLM
+"""
+import asyncio
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "8"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "32"))
+CHAT_QUEUE_TIMEOUT_S = float(os.getenv("CHAT_QUEUE_TIMEOUT_S", "15"))
+# Cada cuánto se revisa si el cliente sigue conectado
+DISCONNECT_POLL_S = 0.25
+
+
+class Overloaded(Exception):
+    """El servidor no puede admitir la solicitud ahora (429 o 503)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int = 5):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    """El cliente cerró la conexión antes de recibir la respuesta"""
+
+
+class AdmissionController:
+    """Semáforo de solicitudes en curso con cola acotada y cancelación por desconexión"""
+
+    def __init__(self, name: str, max_concurrency: int = CHAT_MAX_CONCURRENCY,
+                 max_queue: int = CHAT_MAX_QUEUE, queue_timeout_s: float = CHAT_QUEUE_TIMEOUT_S):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout_s = queue_timeout_s
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.counters = {"admitidas": 0, "rechazadas_429": 0, "rechazadas_503": 0, "canceladas": 0}
+
+    def _sem(self) -> asyncio.Semaphore:
+        # Se crea dentro del event loop (uno por worker de serve.py)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _wait_for_slot(self, request: Request):
+        semaphore = self._sem()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout_s
+        acquire = asyncio.ensure_future(semaphore.acquire())
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    self.counters["rechazadas_503"] += 1
+                    raise Overloaded(503, "El servidor está saturado. Intente de nuevo en unos segundos.")
+                done, _ = await asyncio.wait({acquire}, timeout=min(DISCONNECT_POLL_S, remaining))
+                if done:
+                    return
+                if await request.is_disconnected():
+                    self.counters["canceladas"] += 1
+                    raise ClientDisconnected()
+        except BaseException:
+            if acquire.done() and not acquire.cancelled():
+                semaphore.release()
+            else:
+                acquire.cancel()
+            raise
+
+    async def run(self, request: Request, func: Callable, *args, **kwargs):
+        """
+        Ejecuta func(*args, cancelled=threading.Event, **kwargs) en el threadpool
+        cuando haya lugar. func debe revisar `cancelled` entre etapas costosas.
+        """
+        semaphore = self._sem()
+        if semaphore.locked() and self.waiting >= self.max_queue:
+            self.counters["rechazadas_429"] += 1
+            raise Overloaded(429, "Demasiadas consultas en espera. Intente de nuevo en unos segundos.")
+
+        self.waiting += 1
+        try:
+            await self._wait_for_slot(request)
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self.counters["admitidas"] += 1
+        cancelled = threading.Event()
+        task = asyncio.ensure_future(run_in_threadpool(func, *args, cancelled=cancelled, **kwargs))
+
+        def _release(done_task):
+            # El lugar se libera cuando el hilo termina, aunque el cliente ya se haya ido
+            self.active -= 1
+            semaphore.release()
+            if not done_task.cancelled():
+                done_task.exception()  # marcar como leída si nadie espera ya el resultado
+
+        task.add_done_callback(_release)
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+                if done:
+                    return task.result()
+                if await request.is_disconnected():
+                    self.counters["canceladas"] += 1
+                    raise ClientDisconnected()
+        except BaseException:
+            # Desconexión o cancelación del handler: el hilo se detiene en su próxima revisión
+            cancelled.set()
+            raise
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrencia": self.max_concurrency,
+            "max_cola": self.max_queue,
+            "en_curso": self.active,
+            "en_cola": self.waiting,
+            **self.counters,
+        }
@@ -0,0 +1,90 @@
+"""
+Chat RAG por lotes desde la línea de comandos.
+
+Lee preguntas en JSONL ({"organizacion": ..., "mensaje": ...} por línea) o un
+arreglo JSON y escribe las respuestas como NDJSON a medida que terminan.
+
+Uso:
+    python batch_chat.py preguntas.jsonl -o respuestas.ndjson
+    python batch_chat.py preguntas.jsonl --concurrencia 8
+    python batch_chat.py preguntas.jsonl --url http://localhost:8001   # contra un servidor
+"""
+import argparse
+import json
+import sys
+import time
+
+
+def load_items(path):
+    """Carga los pares (organizacion, mensaje) desde JSONL o un arreglo JSON"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+
+    if content.startswith('['):
+        records = json.loads(content)
+    else:
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    return [(r["organizacion"], r["mensaje"]) for r in records]
+
+
+def run_local(items, concurrency):
+    """Ejecuta el lote en este proceso (sin servidor)"""
+    from chat_service import answer_batch
+    yield from answer_batch(items, concurrency=concurrency)
+
+
+def run_remote(items, concurrency, url):
+    """Envía el lote a /chat/batch de un servidor y lee el NDJSON en streaming"""
+    import requests
+
+    payload = {
+        "items": [{"organizacion": o, "mensaje": m} for o, m in items],
+        "concurrencia": concurrency,
+    }
+    with requests.post(f"{url.rstrip('/')}/chat/batch", json=payload, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat RAG por lotes (NDJSON)")
+    parser.add_argument("entrada", help="Archivo JSONL o JSON con organizacion/mensaje")
+    parser.add_argument("-o", "--salida", help="Archivo NDJSON de salida (por defecto stdout)")
+    parser.add_argument("--concurrencia", type=int, default=None,
+                        help="Llamadas simultáneas al LLM (por defecto BATCH_LLM_CONCURRENCY)")
+    parser.add_argument("--url", help="URL base de la API; si se omite se ejecuta en proceso")
+    args = parser.parse_args()
+
+    items = load_items(args.entrada)
+    print(f"📦 {len(items)} preguntas cargadas de {args.entrada}", file=sys.stderr)
+
+    if args.url:
+        results = run_remote(items, args.concurrencia, args.url)
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        results = run_local(items, args.concurrencia)
+
+    out = open(args.salida, 'w', encoding='utf-8') if args.salida else sys.stdout
+    start = time.time()
+    done = errors = 0
+    try:
+        for result in results:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            if "error" in result:
+                errors += 1
+    finally:
+        if args.salida:
+            out.close()
+
+    elapsed = time.time() - start
+    print(f"✅ {done} respuestas ({errors} errores) en {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark de arranque y escalado de serve.py con distintos números de workers.
+
+Para cada configuración arranca el servidor, mide el tiempo hasta servir,
+lanza peticiones /chat concurrentes y reporta throughput, latencias y la
+memoria (RSS/PSS) por worker.
+
+Uso:
+    python bench_workers.py --workers 1,2,4 --requests 200 --concurrency 16
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from process_stats import memory_stats, child_pids
+
+PREGUNTAS = [
+    ("Tierra Viva", "¿Cuál es la misión de la organización?"),
+    ("Tierra Viva", "¿Qué metas tiene para 2028?"),
+    ("FONCET", "¿Cómo financian la conservación?"),
+    ("CECROPIA", "¿Qué proyectos de restauración desarrollan?"),
+    ("Fundación PUCA", "¿Qué amenazas enfrenta el parque?"),
+]
+
+
+def _post_chat(base_url, organizacion, mensaje, timeout=120):
+    body = json.dumps({"organizacion": organizacion, "mensaje": mensaje}).encode("utf-8")
+    req = urllib.request.Request(f"{base_url}/chat", data=body,
+                                 headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def _wait_ready(base_url, proc, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("El servidor terminó durante el arranque")
+        try:
+            with urllib.request.urlopen(f"{base_url}/", timeout=2):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError("El servidor no respondió a tiempo")
+
+
+def run_config(workers, args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ)
+    if args.sin_llm:
+        env.pop("OPENAI_API_KEY", None)
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py"),
+           "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(workers),
+           "--memory-report-after", "0", "--log-level", "warning"]
+
+    start = time.time()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_ready(base_url, proc, args.startup_timeout)
+        startup = time.time() - start
+
+        # Calentamiento: cada worker abre Chroma y compila sus kernels
+        for i in range(workers * 2):
+            _post_chat(base_url, *PREGUNTAS[i % len(PREGUNTAS)])
+
+        latencies, errors = [], 0
+        bench_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(_post_chat, base_url, *PREGUNTAS[i % len(PREGUNTAS)])
+                       for i in range(args.requests)]
+            for future in futures:
+                try:
+                    latencies.append(future.result())
+                except Exception:
+                    errors += 1
+        elapsed = time.perf_counter() - bench_start
+
+        worker_mem = [memory_stats(pid) for pid in child_pids(proc.pid)]
+        return {
+            "workers": workers,
+            "startup_s": round(startup, 2),
+            "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "errors": errors,
+            "rss_mb_per_worker": round(sum(m.get("rss_kb", 0) for m in worker_mem) / max(1, len(worker_mem)) / 1024, 1),
+            "pss_mb_per_worker": round(sum(m.get("pss_kb", 0) for m in worker_mem) / max(1, len(worker_mem)) / 1024, 1),
+            "pss_mb_total": round((sum(m.get("pss_kb", 0) for m in worker_mem)
+                                   + memory_stats(proc.pid).get("pss_kb", 0)) / 1024, 1),
+        }
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de workers de serve.py")
+    parser.add_argument("--workers", default="1,2,4", help="Lista de números de workers")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--startup-timeout", type=int, default=300)
+    parser.add_argument("--sin-llm", action="store_true",
+                        help="Quitar OPENAI_API_KEY para medir solo recuperación")
+    args = parser.parse_args()
+
+    results = []
+    for workers in [int(w) for w in args.workers.split(",")]:
+        print(f"▶️ {workers} workers...", flush=True)
+        results.append(run_config(workers, args))
+
+    header = f"{'workers':>8}{'arranque s':>12}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'errores':>9}{'RSS/w MB':>10}{'PSS/w MB':>10}{'PSS tot MB':>12}"
+    print(header)
+    for r in results:
+        print(f"{r['workers']:>8}{r['startup_s']:>12}{r['rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['errors']:>9}{r['rss_mb_per_worker']:>10}{r['pss_mb_per_worker']:>10}{r['pss_mb_total']:>12}")
+
+
+if __name__ == "__main__":
+    main()
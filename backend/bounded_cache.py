@@ -0,0 +1,116 @@
+"""
+Cachés en memoria con tope duro.
+
+Un dict usado como caché crece con cada clave distinta (filtros, consultas,
+sesiones...) hasta que el proceso se queda sin memoria. BoundedCache es un LRU
+con límite de entradas y, opcionalmente, de bytes y de antigüedad; al superar
+el límite descarta las entradas menos usadas. Todas las cachés quedan
+registradas para el reporte de /debug/memory.
+"""
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+_MISSING = object()
+_registry: "weakref.WeakSet[BoundedCache]" = weakref.WeakSet()
+
+
+def approx_sizeof(value: Any) -> int:
+    """Tamaño aproximado en bytes (arrays de numpy por su buffer, el resto con sys.getsizeof)"""
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(approx_sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_sizeof(k) + approx_sizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class BoundedCache:
+    """LRU seguro entre hilos con máximo de entradas, de bytes y de antigüedad"""
+
+    def __init__(self, name: str, max_items: int, max_bytes: Optional[int] = None,
+                 ttl_s: Optional[float] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        self.name = name
+        self.max_items = max(0, max_items)
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.sizeof = sizeof or approx_sizeof
+        # clave -> (valor, bytes, momento de inserción)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _registry.add(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and self.ttl_s is not None and time.monotonic() - entry[2] > self.ttl_s:
+                self._remove(key)
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_items == 0:
+            return
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # nunca cabría: no vaciar la caché por una sola entrada
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, time.monotonic())
+            self.nbytes += size
+            while len(self._data) > self.max_items or (
+                    self.max_bytes is not None and self.nbytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def _remove(self, key: Hashable) -> Any:
+        value, size, _ = self._data.pop(key)
+        self.nbytes -= size
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "nombre": self.name,
+            "entradas": len(self._data),
+            "max_entradas": self.max_items,
+            "kb": round(self.nbytes / 1024, 1),
+            "max_kb": None if self.max_bytes is None else round(self.max_bytes / 1024, 1),
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "descartes": self.evictions,
+        }
+
+
+def all_caches() -> List[BoundedCache]:
+    """Cachés vivas del proceso (para /debug/memory)"""
+    return sorted(_registry, key=lambda cache: cache.name)
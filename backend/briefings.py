@@ -0,0 +1,254 @@
+"""
+Informes por organización en lote: markdown y .docx para cada socio en un comando.
+
+1. Cada sección del informe (BRIEFING_SECTIONS) es una pregunta; las de todas las
+   organizaciones se responden con answer_batch (embeddings y recuperación por
+   lotes, LLM con paralelismo acotado).
+2. Apenas una organización tiene todas sus secciones se escribe <salida>/<slug>.md.
+3. Ese .md pasa a .docx en un pool de procesos (convert_md_to_docx.py: cada proceso
+   parsea la plantilla de estilos una vez) mientras se siguen generando los demás.
+
+Reanudable: <salida>/informes.json guarda por organización la generación del
+índice, el hash del markdown y el estado. Los informes listos para la generación
+activa se omiten, un .md sin su .docx (corte durante la conversión) solo se
+convierte y los que fallaron se vuelven a generar. --forzar regenera todo.
+Un informe con secciones que no respondió el LLM (caído, sin configurar o
+saturado: respuesta extractiva de respaldo) se escribe igual, pero queda como
+"parcial" y se vuelve a generar en la próxima ejecución.
+
+Uso:
+    python briefings.py                                # todas las organizaciones
+    python briefings.py --pais Honduras --procesos 4
+    python briefings.py --organizaciones FONCET CECROPIA --plantilla plantilla.docx
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from convert_md_to_docx import load_template, markdown_to_docx
+
+BRIEFING_DIR = os.getenv("BRIEFING_DIR") or os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "informes"))
+BRIEFING_PROCESSES = int(os.getenv("BRIEFING_PROCESSES", str(min(4, os.cpu_count() or 1))))
+MANIFEST_NAME = "informes.json"
+# Respuestas de respaldo (ver chat_service.generate_answer): la sección se vuelve a generar
+FALLBACK_ANSWERS = ("error_llm", "sin_llm", "degradada")
+
+# (título de la sección, pregunta)
+BRIEFING_SECTIONS = [
+    ("Misión y enfoque", "¿Cuál es la misión de la organización y cuál es su enfoque de trabajo?"),
+    ("Proyectos y líneas de acción", "¿Qué proyectos y líneas de acción desarrolla la organización?"),
+    ("Territorio y comunidades", "¿En qué territorios trabaja la organización y con qué comunidades?"),
+    ("Metas y resultados", "¿Qué metas y resultados esperados tiene la organización?"),
+    ("Financiamiento y alianzas", "¿Cómo se financia la organización y con qué aliados trabaja?"),
+]
+
+
+def _write_atomic(path: str, text: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def slugify(nombre: str) -> str:
+    from rag_processor import fold_accents
+    return re.sub(r"[^a-z0-9]+", "-", fold_accents(nombre)).strip("-")
+
+
+def select_organizations(organizaciones: Dict[str, List[Dict[str, Any]]], nombres: Optional[List[str]] = None,
+                         pais: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Organizaciones de ORGANIZACIONES (con su país) pedidas por nombre y/o país; todas si no se pide nada"""
+    todas = [{**org, "pais": p} for p, orgs in organizaciones.items() for org in orgs]
+    if not nombres and not pais:
+        return todas
+    if pais and pais not in organizaciones:
+        raise ValueError(f"País desconocido: {pais}")
+    por_nombre = {org["nombre"]: org for org in todas}
+    desconocidas = [n for n in nombres or [] if n not in por_nombre]
+    if desconocidas:
+        raise ValueError(f"Organizaciones desconocidas: {', '.join(desconocidas)}")
+    elegidas = [por_nombre[n] for n in nombres or []] + [org for org in todas if org["pais"] == pais]
+    return list({org["nombre"]: org for org in elegidas}.values())
+
+
+def render_markdown(org: Dict[str, Any], respuestas: List[str], generacion: str) -> str:
+    partes = [f"# Informe: {org['nombre']}", "",
+              f"**País:** {org.get('pais', '-')} · **Área:** {org.get('area', '-')} · "
+              f"**Contacto:** {org.get('contacto', '-')}", ""]
+    if org.get("descripcion"):
+        partes += [org["descripcion"], ""]
+    partes += [f"Generado el {datetime.now():%Y-%m-%d %H:%M} con la generación {generacion} del índice.", ""]
+    for (titulo, _), respuesta in zip(BRIEFING_SECTIONS, respuestas):
+        partes += [f"## {titulo}", "", respuesta.strip(), ""]
+    return "\n".join(partes)
+
+
+class BriefingManifest:
+    """Estado por organización en <salida>/informes.json (escritura atómica tras cada cambio)"""
+
+    def __init__(self, output_dir: str):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries: Dict[str, Dict[str, Any]] = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def update(self, nombre: str, **fields):
+        self.entries[nombre] = {**self.entries.get(nombre, {}), **fields, "actualizado": time.time()}
+        _write_atomic(self.path, json.dumps(self.entries, indent=2, ensure_ascii=False))
+
+    def pending_step(self, nombre: str, md_path: str, docx_path: str, generacion: str) -> str:
+        """"listo", "docx" (solo falta convertir) o "markdown" (hay que generarlo)"""
+        entry = self.entries.get(nombre)
+        if not entry or entry.get("generacion") != generacion or not os.path.exists(md_path):
+            return "markdown"
+        if entry.get("secciones_respaldo"):
+            # Respondidas sin LLM: se vuelven a pedir
+            return "markdown"
+        with open(md_path, "r", encoding="utf-8") as f:
+            if _sha256(f.read()) != entry.get("md_sha256"):
+                return "markdown"
+        if entry.get("estado") == "listo" and os.path.exists(docx_path):
+            return "listo"
+        return "docx" if entry.get("estado") in ("markdown", "listo") else "markdown"
+
+
+def generate_briefings(orgs: List[Dict[str, Any]], output_dir: str = BRIEFING_DIR,
+                       processes: int = BRIEFING_PROCESSES, concurrency: Optional[int] = None,
+                       template: Optional[str] = None, force: bool = False) -> Dict[str, int]:
+    """Genera (o retoma) los informes; devuelve cuántos quedaron listos, parciales, omitidos y con errores"""
+    from chat_service import answer_batch, get_rag
+
+    os.makedirs(output_dir, exist_ok=True)
+    rag = get_rag()
+    if not rag.db:
+        raise RuntimeError("El índice no está disponible. Ejecute ingest.py primero.")
+    generacion = rag.generation or "original"
+    manifest = BriefingManifest(output_dir)
+    paths = {org["nombre"]: (os.path.join(output_dir, f"{slugify(org['nombre'])}.md"),
+                             os.path.join(output_dir, f"{slugify(org['nombre'])}.docx")) for org in orgs}
+
+    to_generate, to_convert = [], []
+    for org in orgs:
+        md_path, docx_path = paths[org["nombre"]]
+        step = "markdown" if force else manifest.pending_step(org["nombre"], md_path, docx_path, generacion)
+        if step == "markdown":
+            to_generate.append(org)
+        elif step == "docx":
+            to_convert.append(org)
+    counts = {"listos": 0, "parciales": 0, "omitidos": len(orgs) - len(to_generate) - len(to_convert),
+              "errores": 0}
+    print(f"📑 {len(orgs)} informes: {len(to_generate)} por generar, {len(to_convert)} por convertir, "
+          f"{counts['omitidos']} ya listos (generación {generacion})")
+
+    start = time.perf_counter()
+    # spawn: este proceso ya tiene hilos, torch y Chroma; los procesos del pool solo necesitan python-docx
+    pool = ProcessPoolExecutor(max_workers=max(1, processes), mp_context=multiprocessing.get_context("spawn"),
+                               initializer=load_template, initargs=(template,))
+    conversions = {}
+
+    def convert(nombre: str, content: str):
+        conversions[pool.submit(markdown_to_docx, content, paths[nombre][1], template, True)] = nombre
+
+    def collect(futures):
+        for future in futures:
+            nombre = conversions.pop(future)
+            try:
+                future.result()
+                parcial = bool(manifest.entries[nombre].get("secciones_respaldo"))
+                manifest.update(nombre, estado="parcial" if parcial else "listo",
+                                docx=os.path.basename(paths[nombre][1]))
+                if parcial:
+                    counts["parciales"] += 1
+                    print(f"   ⚠️ {nombre}: secciones sin LLM, se regenerará ({time.perf_counter() - start:.1f}s)")
+                else:
+                    counts["listos"] += 1
+                    print(f"   ✅ {nombre} ({time.perf_counter() - start:.1f}s)")
+            except Exception as e:
+                manifest.update(nombre, estado="error", error=f"docx: {e}")
+                counts["errores"] += 1
+                print(f"   ❌ {nombre}: {e}")
+
+    try:
+        for org in to_convert:
+            with open(paths[org["nombre"]][0], "r", encoding="utf-8") as f:
+                convert(org["nombre"], f.read())
+
+        items = [(org["nombre"], pregunta) for org in to_generate for _, pregunta in BRIEFING_SECTIONS]
+        respuestas: Dict[str, Dict[int, str]] = {org["nombre"]: {} for org in to_generate}
+        errores: Dict[str, str] = {}
+        respaldo: Dict[str, List[str]] = {org["nombre"]: [] for org in to_generate}
+        for result in answer_batch(items, concurrency=concurrency):
+            org = to_generate[result["index"] // len(BRIEFING_SECTIONS)]
+            nombre = org["nombre"]
+            section = result["index"] % len(BRIEFING_SECTIONS)
+            if "error" in result:
+                errores[nombre] = result["error"]
+            elif result.get("traza", {}).get("respuesta") in FALLBACK_ANSWERS:
+                respaldo[nombre].append(BRIEFING_SECTIONS[section][0])
+            respuestas[nombre][section] = result.get("respuesta", "")
+            if len(respuestas[nombre]) == len(BRIEFING_SECTIONS):
+                if nombre in errores:
+                    manifest.update(nombre, estado="error", generacion=generacion, error=errores[nombre])
+                    counts["errores"] += 1
+                    print(f"   ❌ {nombre}: {errores[nombre]}")
+                else:
+                    content = render_markdown(org, [respuestas[nombre][i] for i in range(len(BRIEFING_SECTIONS))],
+                                              generacion)
+                    _write_atomic(paths[nombre][0], content)
+                    manifest.update(nombre, estado="markdown", generacion=generacion, md_sha256=_sha256(content),
+                                    markdown=os.path.basename(paths[nombre][0]),
+                                    secciones_respaldo=[titulo for titulo, _ in BRIEFING_SECTIONS
+                                                        if titulo in respaldo[nombre]])
+                    convert(nombre, content)
+                del respuestas[nombre]
+            collect([f for f in list(conversions) if f.done()])
+
+        while conversions:
+            done, _ = wait(list(conversions), return_when=FIRST_COMPLETED)
+            collect(done)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    print(f"✅ {counts['listos']} informes listos, {counts['parciales']} parciales, {counts['omitidos']} omitidos, "
+          f"{counts['errores']} con errores en {time.perf_counter() - start:.1f}s -> {output_dir}")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Informes por organización (markdown + .docx) en lote")
+    parser.add_argument("--organizaciones", nargs="+", help="Nombres como en ORGANIZACIONES (default: todas)")
+    parser.add_argument("--pais", help="Todas las organizaciones de un país")
+    parser.add_argument("-o", "--salida", default=BRIEFING_DIR)
+    parser.add_argument("--procesos", type=int, default=BRIEFING_PROCESSES, help="Procesos para la conversión a .docx")
+    parser.add_argument("--concurrencia", type=int, default=None,
+                        help="Llamadas simultáneas al LLM (por defecto BATCH_LLM_CONCURRENCY)")
+    parser.add_argument("--plantilla", help=".docx con los estilos a usar")
+    parser.add_argument("--forzar", action="store_true", help="Regenerar aunque ya estén listos")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from main import ORGANIZACIONES
+
+    try:
+        orgs = select_organizations(ORGANIZACIONES, args.organizaciones, args.pais)
+        counts = generate_briefings(orgs, args.salida, args.procesos, args.concurrencia, args.plantilla, args.forzar)
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    sys.exit(1 if counts["errores"] or counts["parciales"] else 0)
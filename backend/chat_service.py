@@ -0,0 +1,607 @@
+"""
+Servicio de chat RAG compartido por la API y las herramientas de línea de comandos.
+Resuelve la organización, recupera el contexto por niveles y genera la respuesta
+(LLM si hay OPENAI_API_KEY, oraciones extraídas de los documentos si no; ver
+extractive.py).
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import traceback
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+# rag_processor importa LangChain/torch/Chroma solo al usarse
+from bounded_cache import BoundedCache
+from comparison import budget_context
+from extractive import extractive_answer
+from generations import current_generation
+from query_log import hash_session, protect_text, query_log
+from rag_processor import RAGProcessor
+from sessions import SessionStore, Turn, rewrite_followup
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Paralelismo máximo de llamadas al LLM en /chat/batch y batch_chat.py
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+# Número de consultas que se recuperan juntas antes de pasarlas al LLM
+BATCH_RETRIEVAL_SLICE = int(os.getenv("BATCH_RETRIEVAL_SLICE", "32"))
+# Llamadas simultáneas al LLM por proceso (presupuesto compartido por /chat y /chat/batch)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# /chat: si el presupuesto está lleno más de estos segundos, responder con extractos
+LLM_SATURATION_WAIT_S = float(os.getenv("LLM_SATURATION_WAIT_S", "2"))
+LLM_DEGRADE_WHEN_SATURATED = os.getenv("LLM_DEGRADE_WHEN_SATURATED", "1").lower() not in ("0", "false", "no")
+# "llm" (extractiva si no hay LLM o está saturado) o "extractiva" (nunca llama al LLM)
+ANSWER_MODES = ("llm", "extractiva")
+ANSWER_MODE = os.getenv("ANSWER_MODE", "llm").lower()
+if ANSWER_MODE not in ANSWER_MODES:
+    ANSWER_MODE = "llm"
+# Cada cuántos segundos se comprueba si generations.py activó otra generación del índice
+INDEX_RELOAD_INTERVAL_S = float(os.getenv("INDEX_RELOAD_INTERVAL_S", "5"))
+# Respuestas a primeras preguntas de una conversación (por generación, organización,
+# pregunta y modo); 0 entradas la desactiva
+ANSWER_CACHE_ITEMS = int(os.getenv("ANSWER_CACHE_ITEMS", "1000"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "86400"))
+# Solo se guardan respuestas completas (no las degradadas por saturación ni tras un error del LLM)
+_CACHEABLE_ANSWERS = ("llm", "extractiva", "sin_llm")
+
+# Mapeo de nombres de organizaciones a IDs de carpetas
+# El frontend envía nombres como "Corporación Biocomercio", "Tierra Viva", etc.
+# Las carpetas en backend/documents/orgs/ tienen nombres exactos
+ORG_NAME_TO_FOLDER = {
+    # Colombia
+    "Corporación Biocomercio": "Corporación Biocomercio",
+    # Ecuador
+    "Tierra Viva": "TIERRA VIVA",
+    "Corporación Toisán": "Corporación Toisán",
+    # Mexico
+    "CECROPIA": "CECROPIA",
+    "FONCET": "FONCET",
+    # Honduras
+    "Fundación PUCA": "Fundación PUCA",
+    "CODDEFFAGOLF": "CODDEFFAGOLF",
+    "FENAPROCACAHO": "FENAPROCACAHO",
+    # El Salvador
+    "Asociación ADEL LA Unión": "Asociación ADEL LA Unión",
+    # Guatemala
+    "Defensores de la Naturaleza": "Defensores de la Naturaleza",
+    "ASOVERDE": "ASOVERDE",
+    "ECO": "ECO"
+}
+
+NOT_INITIALIZED_MESSAGE = "El sistema de conocimiento aún no está inicializado. Por favor ingesta documentos primero."
+
+NO_LLM_NOTE = "⚠️ *Nota: Configure OPENAI_API_KEY para obtener respuestas sintetizadas por IA*"
+EXTRACTIVE_NOTE = "⚡ *Respuesta rápida: oraciones textuales de los documentos, sin síntesis por IA.*"
+DEGRADED_NOTE = ("⚠️ *Nota: Por la alta demanda en este momento se muestran extractos de los documentos "
+                 "en lugar de una respuesta sintetizada. Intente de nuevo en unos minutos.*")
+
+_rag: Optional[RAGProcessor] = None
+_rag_lock = threading.Lock()
+_generation_checked_at = 0.0
+_reloading = False
+_llm = None
+_llm_slots = threading.BoundedSemaphore(max(1, LLM_MAX_CONCURRENCY))
+_llm_stats_lock = threading.Lock()
+_llm_stats = {"en_curso": 0, "degradadas": 0}
+_sessions = SessionStore()
+_answers = BoundedCache("respuestas", max_items=ANSWER_CACHE_ITEMS, ttl_s=ANSWER_CACHE_TTL_S or None)
+
+
+class RequestCancelled(Exception):
+    """El cliente se desconectó: no vale la pena seguir (ver admission.py)"""
+
+
+def _check_cancelled(cancelled: Optional[threading.Event]):
+    if cancelled is not None and cancelled.is_set():
+        raise RequestCancelled()
+
+
+def llm_stats() -> Dict:
+    with _llm_stats_lock:
+        return {"max_concurrencia_llm": max(1, LLM_MAX_CONCURRENCY), **_llm_stats}
+
+
+def get_rag() -> RAGProcessor:
+    """
+    Devuelve el procesador RAG compartido por el proceso.
+    Cargar el modelo y el índice BM25 es costoso, así que se hace una sola vez;
+    si la base aún no existía se vuelve a intentar en la siguiente llamada.
+    """
+    global _rag
+    with _rag_lock:
+        if _rag is None:
+            _rag = RAGProcessor()
+        elif not _rag.db:
+            # Modelo ya cargado (p. ej. antes del fork en serve.py): solo abrir la base
+            _rag.connect()
+        _check_generation()
+        return _rag
+
+
+def _check_generation():
+    """
+    Si se activó otra generación del índice, la abre en segundo plano; las
+    consultas siguen usando la anterior hasta que la nueva está lista.
+    """
+    global _generation_checked_at, _reloading
+    now = time.monotonic()
+    if _reloading or now - _generation_checked_at < INDEX_RELOAD_INTERVAL_S:
+        return
+    _generation_checked_at = now
+    if current_generation(_rag.db_dir) == _rag.generation:
+        return
+    _reloading = True
+    threading.Thread(target=_reload_generation, args=(_rag,), name="index-reload", daemon=True).start()
+
+
+def _reload_generation(old: RAGProcessor):
+    global _rag, _reloading
+    try:
+        new = old.reopen()
+        if new.db:
+            import prewarm
+            # Las preguntas frecuentes ya recuperadas en el índice nuevo antes de usarlo
+            if prewarm.PREWARM_ON_START:
+                prewarm.prewarm(rag=new)
+            with _rag_lock:
+                _rag = new
+            print(f"🔀 Índice recargado: generación {new.generation or 'original'}")
+            prewarm.start_prewarm()
+        else:
+            print(f"⚠️ No se pudo abrir la generación {new.generation}; se mantiene {old.generation}")
+    except Exception as e:
+        print(f"❌ Error recargando el índice: {e}")
+    finally:
+        _reloading = False
+
+
+def memory_report() -> Dict:
+    """
+    Memoria residente del proceso desglosada por componente (ver /debug/memory).
+    No carga el procesador RAG si aún no se usó.
+    """
+    from bounded_cache import all_caches
+    from process_stats import memory_stats
+    from rag_processor import LOW_MEMORY_MODE
+
+    process = memory_stats()
+    components = _rag.memory_breakdown() if _rag is not None else {}
+    caches = [cache.stats() for cache in all_caches()]
+    # En memoria anónima: lo que no está mapeado desde un archivo (el estimado de Chroma es solo una cota)
+    in_heap_kb = sum(part.get("kb", 0) for part in components.values()
+                     if part.get("mapeado") is False and not part.get("estimado"))
+    in_heap_kb += sum(cache["kb"] for cache in caches)
+    return {
+        "modo_bajo_consumo": LOW_MEMORY_MODE,
+        "generacion": _rag.generation if _rag is not None else None,
+        "proceso": process,
+        "componentes": components,
+        "caches": caches,
+        # Intérprete, librerías, grafos HNSW de Chroma y objetos sin contabilizar
+        "anonima_sin_atribuir_kb": round(max(0.0, process.get("anonymous_kb", 0) - in_heap_kb), 1),
+    }
+
+
+def set_rag(rag: RAGProcessor):
+    """Instala un procesador ya cargado (serve.py lo precarga antes del fork)"""
+    global _rag
+    with _rag_lock:
+        _rag = rag
+
+
+def resolve_org_folder(organizacion: str) -> Optional[str]:
+    """Obtiene org_id (nombre de carpeta) a partir del nombre de la organización"""
+    return ORG_NAME_TO_FOLDER.get(organizacion)
+
+
+def tier1_org_id(organizacion: str) -> str:
+    """org_id usado en Tier 1; si no hay carpeta solo contará Tier 2"""
+    org_folder = resolve_org_folder(organizacion)
+    print(f"DEBUG: Request Org='{organizacion}' -> Folder/ID='{org_folder}'")
+    # Esto retornará solo Tier 2 si Tier 1 falla o es vacío
+    return org_folder or "GLOBAL_ONLY"
+
+
+def build_context(docs: List[Document]) -> Tuple[str, str]:
+    """Construye el contexto etiquetado para el LLM y la lista Markdown de fuentes"""
+    # Construir contexto ESTRUCTURADO con etiquetas
+    contexto_parts = []
+    for doc in docs:
+        source = os.path.basename(doc.metadata.get('source', 'unknown'))
+        tier = doc.metadata.get('retrieval_tier', 'Support')
+        # Etiquetado claro para el LLM
+        tag = "ORGANIZATION_DOC (PRIORITY)" if "Tier 1" in tier else "GLOBAL_DOC (SUPPORT)"
+        if "Tier 1" in tier and doc.metadata.get("organizacion"):
+            # Comparaciones: de qué organización es cada fragmento
+            tag = f"ORGANIZATION_DOC: {doc.metadata['organizacion']} (PRIORITY)"
+
+        contexto_parts.append(
+            f"--- SOURCE: {source} [{tag}] ---\n{doc.page_content}\n"
+        )
+
+    contexto = "\n".join(contexto_parts)
+
+    # Lista de fuentes para el frontend (Markdown)
+    fuentes_unicas = {}
+    for doc in docs:
+        name = os.path.basename(doc.metadata.get('source', 'unknown'))
+        tier = doc.metadata.get('retrieval_tier', 'Unknown')
+        icon = "🏢" if "Tier 1" in tier else "🌍"
+        page = doc.metadata.get('page', '?')
+        fuentes_unicas[name] = f"* {icon} {name} (Pág. {page})"
+
+    markdown_sources = "\n".join(fuentes_unicas.values())
+    return contexto, markdown_sources
+
+
+def get_llm():
+    """Cliente OpenAI compartido (None si no hay OPENAI_API_KEY)"""
+    global _llm
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    if _llm is None:
+        from langchain_openai import ChatOpenAI
+        _llm = ChatOpenAI(
+            model="gpt-4o-mini",
+            temperature=0.0, # Rigor máximo
+            openai_api_key=api_key,
+            # Servidor compatible alternativo (p. ej. fake_llm.py en pruebas de carga)
+            base_url=os.getenv("OPENAI_BASE_URL") or None
+        )
+    return _llm
+
+
+def _llm_answer(organizacion: str, mensaje: str, contexto: str, markdown_sources: str,
+                historial: Optional[List[str]] = None, comparar: Optional[List[str]] = None) -> Optional[str]:
+    """Respuesta sintetizada por el LLM, o None si no está disponible o falla"""
+    try:
+        from langchain_core.messages import HumanMessage
+
+        llm = get_llm()
+        if not llm:
+            return None
+
+        # Preguntas anteriores de la sesión: resuelven referencias como "sus metas"
+        conversacion = ""
+        if historial:
+            previas = "\n".join(f"- {pregunta}" for pregunta in historial)
+            conversacion = f"\nPREVIOUS USER QUESTIONS IN THIS CONVERSATION (oldest first):\n{previas}\n"
+
+        # Comparaciones (/chat/comparar): cada organización solo con sus propios documentos
+        comparacion = ""
+        if comparar:
+            comparacion = (f"\n- This is a COMPARISON between: {', '.join(comparar)}. Answer for each organization "
+                           "separately using only the ORGANIZATION_DOC sources tagged with its name, then summarize "
+                           "similarities and differences. If an organization has no sources, say so explicitly.")
+
+        # Prompt con "Methodological Backbone" y Thinking Block
+        prompt = f"""You are an Expert Consultant for the PARES Project (Conservation & Sustainable Development).
+
+ROLE & METHODOLOGY:
+1. **Understand**: Analyze the User's question and the context.
+2. **Define**: Identify key concepts (e.g., specific Org goals vs. global NbS definitions).
+3. **Check Evidence**: Compare [ORGANIZATION_DOC] vs [GLOBAL_DOC].
+   - RULE: [ORGANIZATION_DOC] is the TRUTH for this specific organization.
+   - RULE: Use [GLOBAL_DOC] only to fill gaps or explain technical concepts.
+4. **Synthesize**: Answer the user.
+
+CONTEXT:
+{contexto}
+{conversacion}
+USER QUESTION: {mensaje}
+TARGET ORGANIZATION: {organizacion}
+
+INSTRUCTIONS:
+- You MUST write a <thinking> block first. Inside, explain your Phase analysis and evidence check.
+- Then, write your final response in Spanish (Professional tone).
+- Do NOT write a "Sources" list. I will append it manually.{comparacion}
+
+RESPONSE:"""
+
+        messages = [HumanMessage(content=prompt)]
+        response = llm.invoke(messages)
+        full_response = response.content
+
+        # Post-processing: Strip <thinking> block for the user
+        clean_response = re.sub(r'<thinking>.*?</thinking>', '', full_response, flags=re.DOTALL).strip()
+
+        # Append Real Sources (Markdown)
+        return f"{clean_response}\n\n**Fuentes Consultadas:**\n{markdown_sources}"
+
+    except Exception as llm_error:
+        print(f"Error usando LLM: {llm_error}")
+        traceback.print_exc()
+        # Continuar con fallback
+        return None
+
+
+def _fallback_answer(organizacion: str, mensaje: str, docs: List[Document], nota: str = NO_LLM_NOTE,
+                     query_embedding: Optional[List[float]] = None) -> str:
+    """Respuesta con las oraciones de los documentos más relevantes (sin LLM, ver extractive.py)"""
+    rag = get_rag()
+    if query_embedding is None:
+        query_embedding = rag.embed_query(mensaje)
+    return extractive_answer(organizacion, mensaje, query_embedding, docs,
+                             rag.query_embedder.embed_many, nota=nota)
+
+
+def generate_answer(organizacion: str, mensaje: str, docs: List[Document],
+                    degrade: bool = False, cancelled: Optional[threading.Event] = None,
+                    historial: Optional[List[str]] = None, modo: Optional[str] = None,
+                    query_embedding: Optional[List[float]] = None, trace: Optional[Dict] = None,
+                    comparar: Optional[List[str]] = None) -> str:
+    """
+    Genera la respuesta final a partir de los fragmentos recuperados.
+    degrade=True (solo /chat): si el presupuesto del LLM sigue lleno tras
+    LLM_SATURATION_WAIT_S, responde con extractos en lugar de esperar.
+    historial: preguntas anteriores de la sesión, para el LLM.
+    modo: "llm" o "extractiva" (por defecto ANSWER_MODE).
+    query_embedding: el de la búsqueda, para no recalcularlo en la respuesta extractiva.
+    trace: si se pasa, recibe cómo se respondió (ver query_log.py).
+    comparar: organizaciones de una consulta comparativa (ver answer_comparison).
+    """
+    trace = trace if trace is not None else {}
+    if not docs:
+        trace["respuesta"] = "sin_fragmentos"
+        return f"No encontré información específica sobre '{mensaje}' en los documentos."
+
+    if (modo or ANSWER_MODE) == "extractiva":
+        trace["respuesta"] = "extractiva"
+        return _fallback_answer(organizacion, mensaje, docs, nota=EXTRACTIVE_NOTE,
+                                query_embedding=query_embedding)
+
+    contexto, markdown_sources = build_context(docs)
+    try:
+        llm_available = get_llm() is not None
+    except Exception as e:
+        print(f"Error usando LLM: {e}")
+        llm_available = False
+    if llm_available:
+        if not _llm_slots.acquire(timeout=LLM_SATURATION_WAIT_S if degrade else None):
+            with _llm_stats_lock:
+                _llm_stats["degradadas"] += 1
+            trace["respuesta"] = "degradada"
+            return _fallback_answer(organizacion, mensaje, docs, nota=DEGRADED_NOTE,
+                                    query_embedding=query_embedding)
+        try:
+            _check_cancelled(cancelled)
+            with _llm_stats_lock:
+                _llm_stats["en_curso"] += 1
+            start = time.perf_counter()
+            try:
+                respuesta = _llm_answer(organizacion, mensaje, contexto, markdown_sources, historial, comparar)
+            finally:
+                trace["llm_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                with _llm_stats_lock:
+                    _llm_stats["en_curso"] -= 1
+        finally:
+            _llm_slots.release()
+        if respuesta:
+            trace["respuesta"] = "llm"
+            return respuesta
+
+    # FALLBACK: Si no hay LLM disponible (o falló), respuesta extractiva
+    trace["respuesta"] = "error_llm" if llm_available else "sin_llm"
+    return _fallback_answer(organizacion, mensaje, docs, query_embedding=query_embedding)
+
+
+def answer_question(organizacion: str, mensaje: str, cancelled: Optional[threading.Event] = None,
+                    degrade: bool = False, session_id: Optional[str] = None,
+                    modo: Optional[str] = None, trace: Optional[Dict] = None) -> str:
+    """
+    Camino completo de /chat: recuperación por niveles + respuesta.
+    Si `cancelled` se activa (cliente desconectado) se aborta antes del LLM.
+    Con session_id la pregunta se interpreta en el contexto de los turnos
+    anteriores (ver sessions.py). modo: ver generate_answer.
+    trace: si se pasa, recibe fragmentos, tiempos por etapa y caches (el mismo
+    registro que escribe query_log.py) y la consulta no se registra; lo usan
+    replay_queries.py y prewarm.py.
+    Las primeras preguntas de una conversación salen de una caché de respuestas
+    (ver ANSWER_CACHE_ITEMS y prewarm.py).
+    """
+    start = time.perf_counter()
+    rag = get_rag()
+    org_id = tier1_org_id(organizacion)
+
+    if not rag.db:
+        return NOT_INITIALIZED_MESSAGE
+
+    sampled = trace is None and query_log.sampled()
+    logged = sampled or trace is not None
+    trace = trace if trace is not None else {}
+    timings = trace.setdefault("tiempos_ms", {})
+    caches = trace.setdefault("caches", {})
+
+    def lap(stage: str, since: float) -> float:
+        now = time.perf_counter()
+        timings[stage] = round((now - since) * 1000, 1)
+        return now
+
+    session = _sessions.get(session_id, organizacion) if session_id else None
+    consulta = rewrite_followup(mensaje, session.turns) if session else mensaje
+    if consulta != mensaje:
+        print(f"💬 Seguimiento reescrito: '{consulta}'")
+
+    # Usar búsqueda híbrida por niveles
+    _check_cancelled(cancelled)
+    stage = time.perf_counter()
+    query_embedding = rag.embed_query(consulta, caches=caches)
+    stage = lap("embedding", stage)
+
+    # Sin turnos anteriores la respuesta solo depende de la pregunta
+    answer_key = None
+    if ANSWER_CACHE_ITEMS > 0 and not (session and session.turns):
+        answer_key = (rag.generation, organizacion, " ".join(mensaje.split()), modo or ANSWER_MODE)
+    cached = _answers.get(answer_key) if answer_key else None
+    previous = None
+    if cached:
+        respuesta, chunk_ids, trace["respuesta"] = cached
+        caches["respuesta"] = "acierto"
+        lap("respuesta", stage)
+    else:
+        previous = session.reusable_turn(query_embedding, followup=consulta != mensaje) if session else None
+        docs = []
+        if previous:
+            print("♻️ Mismo tema que el turno anterior: se reutilizan sus fragmentos + BM25")
+            docs = rag.refine_tiered(consulta, org_id, previous.chunk_ids)
+        if not docs:
+            previous = None
+            docs = rag.search_tiered(consulta, org_id=org_id, query_embedding=query_embedding, caches=caches)
+        stage = lap("recuperacion", stage)
+        _check_cancelled(cancelled)
+
+        historial = [turn.mensaje for turn in session.turns] if session else None
+        respuesta = generate_answer(organizacion, mensaje, docs, degrade=degrade, cancelled=cancelled,
+                                    historial=historial, modo=modo, query_embedding=query_embedding, trace=trace)
+        lap("respuesta", stage)
+        if "llm_ms" in trace:
+            timings["llm"] = trace.pop("llm_ms")
+
+        chunk_ids: Dict[str, List[str]] = {}
+        for doc in docs:
+            if doc.metadata.get("chunk_id"):
+                chunk_ids.setdefault(doc.metadata.get("retrieval_tier"), []).append(doc.metadata["chunk_id"])
+        if answer_key:
+            caches["respuesta"] = "fallo"
+            if trace.get("respuesta") in _CACHEABLE_ANSWERS:
+                _answers.put(answer_key, (respuesta, chunk_ids, trace["respuesta"]))
+    caches["sesion"] = "sin_sesion" if not session else ("reutilizada" if previous else "nueva_busqueda")
+    lap("total", start)
+    if logged:
+        trace.update({
+            "ts": round(time.time(), 3), "generacion": rag.generation, "organizacion": organizacion,
+            "org_id": org_id, "mensaje": protect_text(mensaje), "consulta": protect_text(consulta),
+            "modo": modo, "sesion": hash_session(session_id) if session_id else None,
+            "turno": len(session.turns) if session else 0, "fragmentos": chunk_ids,
+        })
+        if sampled:
+            query_log.record(dict(trace))
+
+    if session:
+        session.add_turn(Turn(mensaje=mensaje, consulta=consulta, chunk_ids=chunk_ids,
+                              embedding=array("f", query_embedding), reutilizado=previous is not None))
+        _sessions.save(session)
+    return respuesta
+
+
+def answer_comparison(organizaciones: List[str], mensaje: str, cancelled: Optional[threading.Event] = None,
+                      degrade: bool = False, modo: Optional[str] = None) -> str:
+    """
+    Camino de /chat/comparar: la misma pregunta para varias organizaciones con
+    una sola recuperación (Tier 1 en paralelo, Tier 2 compartido) y un contexto
+    con presupuesto de tokens (ver comparison.py).
+    """
+    rag = get_rag()
+    if not rag.db:
+        return NOT_INITIALIZED_MESSAGE
+
+    org_ids = [tier1_org_id(organizacion) for organizacion in organizaciones]
+    _check_cancelled(cancelled)
+    query_embedding = rag.embed_query(mensaje)
+    per_org, global_docs = rag.search_comparative(mensaje, org_ids, query_embedding=query_embedding)
+    names = {}
+    for organizacion, org_id in zip(organizaciones, org_ids):
+        names.setdefault(org_id, organizacion)
+    for org_id, docs in per_org.items():
+        for doc in docs:
+            doc.metadata["organizacion"] = names[org_id]
+    docs = budget_context(per_org, global_docs)
+    _check_cancelled(cancelled)
+
+    respuesta = generate_answer(" vs. ".join(organizaciones), mensaje, docs, degrade=degrade, cancelled=cancelled,
+                                modo=modo, query_embedding=query_embedding, comparar=organizaciones)
+    sin_documentos = [organizacion for organizacion, org_id in zip(organizaciones, org_ids) if not per_org.get(org_id)]
+    if sin_documentos:
+        respuesta += f"\n\n⚠️ *Sin documentos propios de: {', '.join(sin_documentos)}*"
+    return respuesta
+
+
+def new_session_id() -> str:
+    return SessionStore.new_id()
+
+
+def answer_batch(items: List[Tuple[str, str]], concurrency: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Responde un lote de (organizacion, mensaje).
+    Todas las consultas se embeben en una sola llamada al modelo, la recuperación
+    se hace por lotes y las llamadas al LLM corren con paralelismo acotado.
+    Los resultados se entregan a medida que terminan (no en orden de entrada).
+    Cada uno trae "traza" con cómo se respondió ("respuesta": llm, extractiva,
+    degradada, sin_llm, error_llm o sin_fragmentos; ver generate_answer).
+    Si el generador se cierra antes de terminar (cliente desconectado), no se
+    recuperan más tramos, se descartan las respuestas pendientes y las que
+    esperan el LLM abortan (RequestCancelled).
+    """
+    if not items:
+        return
+
+    workers = max(1, min(concurrency or BATCH_LLM_CONCURRENCY, BATCH_LLM_CONCURRENCY))
+    rag = get_rag()
+
+    if not rag.db:
+        for index, (organizacion, mensaje) in enumerate(items):
+            yield {"index": index, "organizacion": organizacion, "mensaje": mensaje,
+                   "respuesta": NOT_INITIALIZED_MESSAGE}
+        return
+
+    mensajes = [mensaje for _, mensaje in items]
+    org_ids = [tier1_org_id(organizacion) for organizacion, _ in items]
+    embeddings = rag.embed_queries(mensajes)
+    cancelled = threading.Event()
+
+    def _answer(index: int, docs: List[Document]) -> Dict:
+        organizacion, mensaje = items[index]
+        result = {"index": index, "organizacion": organizacion, "mensaje": mensaje}
+        trace: Dict = {}
+        try:
+            result["respuesta"] = generate_answer(organizacion, mensaje, docs, cancelled=cancelled,
+                                                  query_embedding=embeddings[index], trace=trace)
+            result["traza"] = trace
+        except RequestCancelled:
+            result["error"] = "Lote cancelado"
+        except Exception as e:
+            print(f"Error en chat por lotes [{index}]: {e}")
+            result["error"] = str(e)
+        return result
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    finished = False
+    try:
+        futures = []
+        # Recuperamos por tramos para que el LLM empiece antes de terminar todo el lote
+        for start in range(0, len(items), BATCH_RETRIEVAL_SLICE):
+            end = start + BATCH_RETRIEVAL_SLICE
+            try:
+                batch_docs = rag.search_tiered_batch(
+                    mensajes[start:end], org_ids[start:end], embeddings[start:end]
+                )
+            except Exception as e:
+                print(f"Error en recuperación por lotes [{start}:{end}]: {e}")
+                for index in range(start, min(end, len(items))):
+                    organizacion, mensaje = items[index]
+                    yield {"index": index, "organizacion": organizacion, "mensaje": mensaje,
+                           "error": str(e)}
+                continue
+            for offset, docs in enumerate(batch_docs):
+                futures.append(pool.submit(_answer, start + offset, docs))
+
+            # Entregar lo que ya terminó mientras seguimos recuperando
+            for future in [f for f in futures if f.done()]:
+                futures.remove(future)
+                yield future.result()
+
+        for future in as_completed(futures):
+            yield future.result()
+        finished = True
+    finally:
+        if not finished:
+            # GeneratorExit o error: no esperar a las llamadas al LLM que nadie va a leer
+            cancelled.set()
+        pool.shutdown(wait=finished, cancel_futures=not finished)
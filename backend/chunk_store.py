@@ -0,0 +1,193 @@
+"""
+Almacén compacto de fragmentos para el índice de palabras clave.
+
+Guardar el corpus como listas de str y dicts de metadatos cuesta cientos de
+bytes de objetos Python por fragmento, además del texto. ChunkStore guarda los
+textos e ids como un único buffer UTF-8 con offsets, y cada metadato como una
+columna de códigos int32 sobre sus valores distintos (org_id, scope, source...
+se repiten en miles de fragmentos). Los arrays se guardan como .npy y pueden
+abrirse con mmap: las páginas las comparte el sistema operativo entre workers y
+no cuentan como memoria anónima del proceso.
+"""
+import bisect
+import json
+import os
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+# Código de "metadato ausente" en las columnas
+MISSING = -1
+
+
+def _load_array(path: str, mmap: bool) -> np.ndarray:
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def is_mapped(array: Optional[np.ndarray]) -> bool:
+    """True si el array lee de un archivo mapeado en memoria (np.load con mmap)"""
+    base = array
+    while base is not None:
+        if isinstance(base, np.memmap):
+            return True
+        base = getattr(base, "base", None)
+    return False
+
+
+class StringArray(Sequence):
+    """Lista inmutable de str sobre un buffer UTF-8 y un array de offsets"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: Sequence[str]) -> "StringArray":
+        encoded = [(s or "").encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.data[start:end]).decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + self.offsets.nbytes)
+
+    @property
+    def mapped(self) -> bool:
+        return is_mapped(self.data)
+
+    def save(self, prefix: str):
+        np.save(f"{prefix}.data.npy", self.data)
+        np.save(f"{prefix}.offsets.npy", self.offsets)
+
+    @classmethod
+    def load(cls, prefix: str, mmap: bool = False) -> "StringArray":
+        return cls(_load_array(f"{prefix}.data.npy", mmap), _load_array(f"{prefix}.offsets.npy", mmap))
+
+
+class TermIndex(Mapping):
+    """
+    Vocabulario término -> fila sobre un StringArray ordenado.
+    Búsqueda binaria en lugar de un dict con un objeto str por término.
+    """
+
+    def __init__(self, terms: StringArray):
+        self.terms = terms
+
+    def __getitem__(self, term: str) -> int:
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        raise KeyError(term)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+
+class ChunkStore:
+    """Ids, textos y metadatos de los fragmentos en arrays (ver SparseBM25)"""
+
+    def __init__(self, ids: StringArray, texts: StringArray,
+                 columns: Dict[str, np.ndarray], values: Dict[str, List[Any]]):
+        self.ids = ids
+        self.texts = texts
+        # metadato -> códigos int32 (uno por fragmento) y sus valores distintos
+        self.columns = columns
+        self.values = values
+
+    @classmethod
+    def from_corpus(cls, corpus: Dict[str, Any]) -> "ChunkStore":
+        """corpus: {"ids", "documents", "metadatas"} como lo devuelve Chroma"""
+        texts = corpus["documents"]
+        ids = list(corpus.get("ids") or []) or [str(i) for i in range(len(texts))]
+        metadatas = corpus.get("metadatas") or [None] * len(texts)
+
+        codes: Dict[str, np.ndarray] = {}
+        lookup: Dict[str, Dict[Any, int]] = {}
+        for doc_idx, meta in enumerate(metadatas):
+            for key, value in (meta or {}).items():
+                if key not in codes:
+                    codes[key] = np.full(len(texts), MISSING, dtype=np.int32)
+                    lookup[key] = {}
+                # (tipo, valor): True y 1 son claves distintas
+                codes[key][doc_idx] = lookup[key].setdefault((type(value), value), len(lookup[key]))
+        values = {key: [value for _, value in seen] for key, seen in lookup.items()}
+        return cls(StringArray.from_strings(ids), StringArray.from_strings(texts), codes, values)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def text(self, i: int) -> str:
+        return self.texts[i]
+
+    def chunk_id(self, i: int) -> str:
+        return self.ids[i]
+
+    def metadata(self, i: int) -> Dict[str, Any]:
+        meta = {}
+        for key, codes in self.columns.items():
+            code = int(codes[i])
+            if code != MISSING:
+                meta[key] = self.values[key][code]
+        return meta
+
+    def mask(self, filter_dict: Dict[str, Any]) -> np.ndarray:
+        """
+        Fragmentos cuyos metadatos cumplen todo el filtro: igualdad, o
+        {"$in": [...]} como en los filtros de Chroma
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for key, wanted in filter_dict.items():
+            if key not in self.columns:
+                return np.zeros(len(self), dtype=bool)
+            accepted = wanted["$in"] if isinstance(wanted, dict) else [wanted]
+            matching = [code for code, value in enumerate(self.values[key]) if value in accepted]
+            mask &= np.isin(self.columns[key], matching)
+        return mask
+
+    def nbytes(self) -> Dict[str, int]:
+        return {
+            "ids": self.ids.nbytes,
+            "textos": self.texts.nbytes,
+            "metadatos": sum(int(c.nbytes) for c in self.columns.values()),
+        }
+
+    @property
+    def mapped(self) -> bool:
+        return self.texts.mapped
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.ids.save(os.path.join(path, "ids"))
+        self.texts.save(os.path.join(path, "texts"))
+        keys = list(self.columns)
+        for n, key in enumerate(keys):
+            np.save(os.path.join(path, f"meta_{n}.npy"), self.columns[key])
+        with open(os.path.join(path, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump({"keys": keys, "values": [self.values[key] for key in keys]}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "ChunkStore":
+        with open(os.path.join(path, "metadata.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        columns = {key: _load_array(os.path.join(path, f"meta_{n}.npy"), mmap)
+                   for n, key in enumerate(meta["keys"])}
+        values = dict(zip(meta["keys"], meta["values"]))
+        return cls(StringArray.load(os.path.join(path, "ids"), mmap),
+                   StringArray.load(os.path.join(path, "texts"), mmap), columns, values)
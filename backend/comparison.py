@@ -0,0 +1,49 @@
+"""
+Consultas comparativas entre organizaciones (/chat/comparar).
+
+Comparar FONCET y CECROPIA con /chat eran dos consultas seguidas, cada una con su
+embedding y su búsqueda global. Aquí la consulta se embebe una vez, el Tier 1 de
+cada organización se busca en paralelo junto con un único Tier 2 compartido
+(RAGProcessor.search_comparative) y el contexto para el LLM se arma con un
+presupuesto de tokens: los mejores fragmentos de cada organización por turnos
+(el 1.º de cada una, luego el de Tier 2, luego el 2.º de cada una...) hasta
+COMPARE_CONTEXT_TOKENS, así ninguna organización acapara el contexto.
+"""
+import os
+from typing import Any, Dict, List
+
+COMPARE_MAX_ORGS = int(os.getenv("COMPARE_MAX_ORGS", "8"))
+COMPARE_CONTEXT_TOKENS = int(os.getenv("COMPARE_CONTEXT_TOKENS", "6000"))
+# Aproximación para español con el tokenizador de OpenAI
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def budget_context(per_org: Dict[str, List[Any]], global_docs: List[Any],
+                   max_tokens: int = COMPARE_CONTEXT_TOKENS) -> List[Any]:
+    """
+    Fragmentos que entran en el presupuesto, por turnos entre organizaciones;
+    devueltos agrupados por organización y al final los de Tier 2.
+    """
+    order = []
+    rounds = max([len(docs) for docs in per_org.values()] + [len(global_docs)])
+    for rank in range(rounds):
+        order.extend((org, docs[rank]) for org, docs in per_org.items() if rank < len(docs))
+        if rank < len(global_docs):
+            order.append((None, global_docs[rank]))
+
+    chosen = {org: [] for org in per_org}
+    chosen[None] = []
+    used = 0
+    for org, doc in order:
+        tokens = estimate_tokens(doc.page_content)
+        # Uno que no entra no corta la selección: puede entrar uno más corto
+        if used + tokens > max_tokens:
+            continue
+        chosen[org].append(doc)
+        used += tokens
+    print(f"🧩 Contexto comparativo: {sum(len(d) for d in chosen.values())} fragmentos, ~{used} tokens")
+    return [doc for docs in chosen.values() for doc in docs]
@@ -1,38 +1,76 @@
 """
 Script to convert markdown to Word (.docx) document
+
+The style template (python-docx default or a custom .docx) is parsed once per
+process and each document starts from a copy of it. Style ids are resolved once
+per template and written directly: assigning a style through python-docx scans
+every style in the template for each paragraph, which was most of the time.
+briefings.py converts many reports in a process pool on top of this.
+
+Usage:
+    python convert_md_to_docx.py informe.md
+    python convert_md_to_docx.py informe.md -o informe.docx --template plantilla.docx
 """
+import argparse
+import copy
 import os
 import re
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 
-def parse_markdown_to_docx(md_file, output_file):
-    """Convert markdown to Word document"""
-    
-    # Read markdown file
-    with open(md_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Create Word document
-    doc = Document()
-    
+# Styles used by the converter (should exist in a custom template)
+STYLE_NAMES = ['Heading 1', 'Heading 2', 'Heading 3', 'Heading 4',
+               'Quote', 'List Bullet', 'List Number', 'Light Grid Accent 1']
+
+# template path (None = python-docx default) -> (parsed document, {style name: style id})
+_templates = {}
+
+
+def load_template(template_path=None):
+    """Parsed template and its style ids (cached per process)"""
+    if template_path not in _templates:
+        template = Document(template_path)
+        styles = {}
+        for name in STYLE_NAMES:
+            try:
+                styles[name] = template.styles[name].style_id
+            except KeyError:
+                # Missing in a custom template: the default style is used
+                styles[name] = None
+        _templates[template_path] = (template, styles)
+    return _templates[template_path]
+
+
+def add_paragraph(doc, text, style_id=None):
+    """doc.add_paragraph with an already resolved style id"""
+    p = doc.add_paragraph(text)
+    if style_id:
+        p._p.get_or_add_pPr().style = style_id
+    return p
+
+
+def markdown_to_docx(content, output_file, template_path=None, skip_rules=False):
+    """Convert markdown text to a Word document (written atomically)"""
+    template, styles = load_template(template_path)
+    # A copy of the parsed template is about twice as fast as parsing it again
+    doc = copy.deepcopy(template)
+
     # Split by lines
     lines = content.split('\n')
-    
+
     in_code_block = False
     code_block_lines = []
     in_table = False
     table_lines = []
-    
+
     for line in lines:
         # Handle code blocks
         if line.strip().startswith('```'):
             if in_code_block:
                 # End of code block
                 code_text = '\n'.join(code_block_lines)
-                p = doc.add_paragraph(code_text)
-                p.style = 'Quote'
+                p = add_paragraph(doc, code_text, styles['Quote'])
                 for run in p.runs:
                     run.font.name = 'Courier New'
                     run.font.size = Pt(9)
@@ -42,21 +80,21 @@ def parse_markdown_to_docx(md_file, output_file):
                 # Start of code block
                 in_code_block = True
             continue
-        
+
         if in_code_block:
             code_block_lines.append(line)
             continue
-        
+
         # Handle headers
         if line.startswith('# '):
-            doc.add_heading(line[2:], level=1)
+            add_paragraph(doc, line[2:], styles['Heading 1'])
         elif line.startswith('## '):
-            doc.add_heading(line[3:], level=2)
+            add_paragraph(doc, line[3:], styles['Heading 2'])
         elif line.startswith('### '):
-            doc.add_heading(line[4:], level=3)
+            add_paragraph(doc, line[4:], styles['Heading 3'])
         elif line.startswith('#### '):
-            doc.add_heading(line[5:], level=4)
-        
+            add_paragraph(doc, line[5:], styles['Heading 4'])
+
         # Handle tables
         elif line.strip().startswith('|') and line.strip().endswith('|'):
             if not in_table:
@@ -66,68 +104,88 @@ def parse_markdown_to_docx(md_file, output_file):
         else:
             # Process accumulated table
             if in_table:
-                process_table(doc, table_lines)
+                process_table(doc, table_lines, styles['Light Grid Accent 1'])
                 in_table = False
                 table_lines = []
-            
+
+            # Horizontal rules only separate sections in markdown (kept as text unless skip_rules)
+            if skip_rules and line.strip() == '---':
+                continue
+
             # Handle regular paragraphs
             if line.strip():
                 # Check for bold
                 line = re.sub(r'\*\*(.*?)\*\*', r'\1', line)
-                
-                p = doc.add_paragraph(line)
-                
+
                 # Handle bullet points
-                if line.strip().startswith('- '):
-                    p.style = 'List Bullet'
-                elif line.strip().startswith('* '):
-                    p.style = 'List Bullet'
+                style = None
+                if line.strip().startswith('- ') or line.strip().startswith('* '):
+                    style = styles['List Bullet']
                 elif re.match(r'^\d+\.', line.strip()):
-                    p.style = 'List Number'
-    
-    # Save document
-    doc.save(output_file)
+                    style = styles['List Number']
+                add_paragraph(doc, line, style)
+
+    # A table at the end of the file
+    if in_table:
+        process_table(doc, table_lines, styles['Light Grid Accent 1'])
+
+    # Save document (a half-written .docx never replaces a good one)
+    tmp_file = f"{output_file}.tmp"
+    doc.save(tmp_file)
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+def parse_markdown_to_docx(md_file, output_file, template_path=None, skip_rules=False):
+    """Convert markdown to Word document"""
+
+    # Read markdown file
+    with open(md_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    markdown_to_docx(content, output_file, template_path, skip_rules)
     print(f"Document saved to: {output_file}")
 
-def process_table(doc, table_lines):
-    """Process table lines and add to document"""
+
+def process_table(doc, table_lines, style_id=None):
+    """Process table lines and add to document (style_id: see load_template)"""
     if len(table_lines) < 2:
         return
-    
+
     # Parse header
     headers = [cell.strip() for cell in table_lines[0].split('|')[1:-1]]
-    
+
     # Skip separator line
     if len(table_lines) < 3:
         return
-    
+
     # Parse rows
     rows = []
     for line in table_lines[2:]:
         cells = [cell.strip() for cell in line.split('|')[1:-1]]
         rows.append(cells)
-    
+
     # Create table
     table = doc.add_table(rows=len(rows) + 1, cols=len(headers))
-    table.style = 'Light Grid Accent 1'
-    
+    if style_id:
+        table._tbl.tblStyle_val = style_id
+
     # Add headers
     for i, header in enumerate(headers):
         table.rows[0].cells[i].text = header
-    
+
     # Add rows
     for i, row in enumerate(rows):
-        for j, cell in enumerate(row):
+        for j, cell in enumerate(row[:len(headers)]):
             table.rows[i + 1].cells[j].text = cell
 
 if __name__ == "__main__":
-    md_file = r"C:\Users\narva\.gemini\antigravity\brain\4ec852d4-662f-4133-b498-f3ed12041555\especificaciones_tecnicas_rag.md"
-    output_file = r"C:\Users\narva\.gemini\antigravity\brain\4ec852d4-662f-4133-b498-f3ed12041555\especificaciones_tecnicas_rag.docx"
-    
-    try:
-        parse_markdown_to_docx(md_file, output_file)
-    except ImportError:
-        print("python-docx is not installed. Installing...")
-        import subprocess
-        subprocess.run(["pip", "install", "python-docx"])
-        parse_markdown_to_docx(md_file, output_file)
+    parser = argparse.ArgumentParser(description="Convert markdown to Word (.docx)")
+    parser.add_argument("md_file")
+    parser.add_argument("-o", "--output", help="Default: same name with .docx")
+    parser.add_argument("--template", help="Custom .docx with the styles to use")
+    parser.add_argument("--skip-rules", action="store_true", help="Drop '---' horizontal rule lines")
+    args = parser.parse_args()
+    output_file = args.output or os.path.splitext(args.md_file)[0] + ".docx"
+
+    parse_markdown_to_docx(args.md_file, output_file, args.template, args.skip_rules)
@@ -0,0 +1,216 @@
+"""
+Vectores resumen por documento para la recuperación en dos etapas.
+
+Cada documento fuente (un PDF de una organización o de global) se resume en un
+vector: el centroide de los embeddings normalizados de sus fragmentos. Al
+consultar, RAGProcessor:
+1. elige dentro del nivel los N documentos cuyo resumen más se parece a la
+   consulta (un producto matriz-vector con una fila por documento);
+2. busca los fragmentos más cercanos solo entre los de esos documentos, con
+   búsqueda exacta sobre sus embeddings, que aquí se guardan contiguos por
+   documento.
+Así el costo por consulta crece con los documentos del nivel y los fragmentos
+de los N elegidos, no con todos los fragmentos del nivel.
+
+El índice se construye al final de la ingesta a partir de los embeddings ya
+guardados en Chroma (no se vuelve a embeber nada) y vive junto a las colecciones
+en doc_index/. Los embeddings de fragmentos se guardan en float16 (la mitad que
+en Chroma); documentos e ids van en ChunkStore/StringArray (ver chunk_store.py),
+así que todo puede abrirse con mmap.
+"""
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from bounded_cache import BoundedCache
+from chunk_store import ChunkStore, StringArray, is_mapped
+
+FORMAT_VERSION = 1
+DOCUMENT_INDEX_SUBDIR = "doc_index"
+# Metadatos del documento que se conservan (los filtros de los niveles usan org_id y scope)
+_DOCUMENT_METADATA = ("source", "org_id", "scope")
+# Precisión de los embeddings de fragmentos guardados (solo ordenan candidatos)
+CHUNK_VECTOR_DTYPE = np.float16
+
+
+def document_index_path(index_dir: str) -> str:
+    return os.path.join(index_dir, DOCUMENT_INDEX_SUBDIR)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class DocumentSummaryIndex:
+    """
+    Un vector unitario por documento fuente, con sus metadatos en un ChunkStore,
+    y los embeddings e ids de sus fragmentos en las filas offsets[d]:offsets[d + 1]
+    """
+
+    def __init__(self, vectors: np.ndarray, documents: ChunkStore, offsets: np.ndarray,
+                 chunk_ids: StringArray, chunk_vectors: np.ndarray):
+        self.vectors = vectors
+        self.documents = documents
+        self.offsets = offsets
+        self.chunk_ids = chunk_ids
+        self.chunk_vectors = chunk_vectors
+        self._masks = BoundedCache("resumenes_mascaras", max_items=256)
+
+    @classmethod
+    def from_collections(cls, collections: List[Any], page_size: int = 5000) -> "DocumentSummaryIndex":
+        """Centroides por (organización, fuente) leyendo los embeddings de las colecciones Chroma"""
+        from hnsw_params import current_params
+
+        chunks: Dict[tuple, List[tuple]] = {}
+        metadata: Dict[tuple, Dict[str, Any]] = {}
+        for collection in collections:
+            # Métrica de la colección: la segunda etapa ordena igual que su índice HNSW
+            space = current_params(collection).get("space") or "l2"
+            offset = 0
+            while True:
+                batch = collection.get(include=["embeddings", "metadatas"], limit=page_size, offset=offset)
+                if not batch["ids"]:
+                    break
+                offset += len(batch["ids"])
+                vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+                for chunk_id, vector, meta in zip(batch["ids"], vectors, batch["metadatas"]):
+                    meta = meta or {}
+                    key = (meta.get("org_id"), meta.get("scope"), meta.get("source"))
+                    if key not in chunks:
+                        chunks[key] = []
+                        metadata[key] = {name: meta[name] for name in _DOCUMENT_METADATA if name in meta}
+                        metadata[key]["space"] = space
+                    chunks[key].append((chunk_id, vector))
+
+        keys = list(chunks)
+        dim = len(chunks[keys[0]][0][1]) if keys else 0
+        chunk_vectors = np.zeros((sum(len(c) for c in chunks.values()), dim), dtype=CHUNK_VECTOR_DTYPE)
+        vectors = np.zeros((len(keys), dim), dtype=np.float32)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        chunk_ids: List[str] = []
+        for d, key in enumerate(keys):
+            block = np.vstack([vector for _, vector in chunks[key]])
+            offsets[d + 1] = offsets[d] + len(block)
+            chunk_vectors[offsets[d]:offsets[d + 1]] = block
+            chunk_ids.extend(chunk_id for chunk_id, _ in chunks[key])
+            vectors[d] = _normalize(_normalize(block).sum(axis=0))
+        documents = ChunkStore.from_corpus({
+            "ids": [f"{org_id}/{source}" for org_id, _, source in keys],
+            "documents": [metadata[key].get("source") or "" for key in keys],
+            "metadatas": [metadata[key] for key in keys],
+        })
+        return cls(vectors, documents, offsets, StringArray.from_strings(chunk_ids), chunk_vectors)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @property
+    def chunks(self) -> int:
+        return len(self.chunk_ids)
+
+    def _mask(self, filter_dict: Dict[str, Any]) -> np.ndarray:
+        key = tuple(sorted(filter_dict.items()))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self.documents.mask(filter_dict)
+            self._masks.put(key, mask)
+        return mask
+
+    def top_documents(self, query_embedding: List[float], filter_dict: Dict[str, Any], n: int,
+                      min_documents: int = 0) -> Optional[np.ndarray]:
+        """
+        Primera etapa: filas de los n documentos del nivel más parecidos a la consulta.
+        None si el nivel tiene min_documents documentos o menos (no vale la pena acotar).
+        """
+        rows = np.flatnonzero(self._mask(filter_dict))
+        if len(rows) <= max(n, min_documents):
+            return None
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        similarities = self.vectors[rows] @ query
+        return rows[np.argpartition(-similarities, n - 1)[:n]]
+
+    def search_chunks(self, query_embedding: List[float], filter_dict: Dict[str, Any], fetch_k: int,
+                      n: int, min_documents: int = 0, extra_sources: Sequence[str] = ()):
+        """
+        Segunda etapa: (ids, embeddings) de los fetch_k fragmentos más cercanos, en
+        orden, entre los de los n documentos elegidos y los de extra_sources (p. ej.
+        los que encontró BM25). None si el nivel no se acota (ver top_documents).
+        """
+        documents = self.top_documents(query_embedding, filter_dict, n, min_documents)
+        if documents is None:
+            return None
+        if extra_sources:
+            extra = self._mask(filter_dict) & self.documents.mask({"source": {"$in": list(extra_sources)}})
+            documents = np.union1d(documents, np.flatnonzero(extra))
+        rows = np.concatenate([np.arange(self.offsets[d], self.offsets[d + 1]) for d in documents])
+        vectors = np.asarray(self.chunk_vectors[rows], dtype=np.float32)
+        query = np.asarray(query_embedding, dtype=np.float32)
+
+        space = self.documents.metadata(int(documents[0])).get("space", "l2")
+        if space == "l2":
+            distances = (vectors * vectors).sum(axis=1) - 2.0 * (vectors @ query)
+        elif space == "cosine":
+            distances = -(_normalize(vectors) @ _normalize(query))
+        else:  # ip
+            distances = -(vectors @ query)
+        top = np.argsort(distances, kind="stable")[:fetch_k]
+        return [self.chunk_ids[int(rows[i])] for i in top], vectors[top]
+
+    def memory_breakdown(self) -> Dict[str, Dict[str, Any]]:
+        documents = sum(self.documents.nbytes().values()) + self.vectors.nbytes + self.offsets.nbytes
+        return {
+            "resumenes_documentos": {"kb": round(documents / 1024, 1), "mapeado": self.documents.mapped},
+            "resumenes_fragmentos": {"kb": round((self.chunk_vectors.nbytes + self.chunk_ids.nbytes) / 1024, 1),
+                                     "mapeado": is_mapped(self.chunk_vectors)},
+        }
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "chunk_vectors.npy"), self.chunk_vectors)
+        self.chunk_ids.save(os.path.join(path, "chunk_ids"))
+        self.documents.save(path)
+        with open(os.path.join(path, "format.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "documents": len(self), "chunks": self.chunks}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "DocumentSummaryIndex":
+        with open(os.path.join(path, "format.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Formato de doc_index no soportado: {info.get('version')}")
+        mode = "r" if mmap else None
+        return cls(np.load(os.path.join(path, "vectors.npy"), mmap_mode=mode),
+                   ChunkStore.load(path, mmap),
+                   np.load(os.path.join(path, "offsets.npy")),
+                   StringArray.load(os.path.join(path, "chunk_ids"), mmap),
+                   np.load(os.path.join(path, "chunk_vectors.npy"), mmap_mode=mode))
+
+
+def build_document_index(index_dir: str) -> int:
+    """Construye y guarda los vectores resumen de un índice; devuelve el número de documentos"""
+    import chromadb
+    from shards import LEGACY_COLLECTION, has_legacy_collection, list_shards
+
+    start = time.perf_counter()
+    client = chromadb.PersistentClient(path=index_dir)
+    names = list(list_shards(client).values())
+    if not names and has_legacy_collection(client):
+        names = [LEGACY_COLLECTION]
+    index = DocumentSummaryIndex.from_collections([client.get_collection(name) for name in names])
+    path = document_index_path(index_dir)
+    # Se escribe aparte y se reemplaza al terminar: una ingesta interrumpida no deja uno a medias
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    index.save(tmp_path)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f"🗂️ Vectores resumen: {len(index)} documentos ({index.chunks} fragmentos) "
+          f"en {time.perf_counter() - start:.1f}s")
+    return len(index)
@@ -0,0 +1,117 @@
+"""
+Micro-batching de embeddings de consultas.
+
+Cada /chat concurrente embebía su consulta por separado (una oración por
+llamada al modelo), lo que aprovecha mal los kernels de matrices en CPU.
+EmbeddingBatcher junta las consultas que llegan dentro de una ventana corta
+(o hasta un tamaño máximo de lote), las codifica en una sola pasada del modelo
+y devuelve a cada llamador su vector.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+# Espera máxima para completar un lote (milisegundos)
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+# Tamaño máximo del lote; 1 desactiva el micro-batching
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+
+
+class EmbeddingBatcher:
+    """Agrupa llamadas concurrentes a embed() en lotes para el modelo"""
+
+    def __init__(self,
+                 embed_batch: Callable[[List[str]], List[List[float]]],
+                 max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS,
+                 max_batch_size: int = EMBED_BATCH_MAX_SIZE):
+        self.embed_batch = embed_batch
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        # Estadísticas
+        self.batches = 0
+        self.items = 0
+
+    def embed(self, text: str) -> List[float]:
+        """Embebe una consulta; bloquea hasta que su lote se procese"""
+        if self.max_batch_size == 1:
+            return self.embed_batch([text])[0]
+
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Embebe varios textos compartiendo los lotes con las consultas concurrentes"""
+        if self.max_batch_size == 1:
+            return self.embed_batch(list(texts))
+
+        self._ensure_worker()
+        futures = []
+        for text in texts:
+            future: Future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_batch_size": self.max_batch_size,
+        }
+
+    def _ensure_worker(self):
+        # Los hilos no sobreviven a un fork: se arranca (o re-arranca) por proceso
+        pid = os.getpid()
+        if self._worker is not None and self._pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._pid == pid and self._worker.is_alive():
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue()
+            self._pid = pid
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker.start()
+
+    def _collect(self) -> list:
+        """Espera la primera consulta y junta las que lleguen dentro de la ventana"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Ventana cerrada: solo tomamos lo que ya está en cola
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.embed_batch(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
@@ -0,0 +1,179 @@
+"""
+Respuestas extractivas sin LLM.
+
+En lugar de los primeros caracteres de cada fragmento, arma la respuesta con las
+oraciones de los fragmentos recuperados que mejor responden la pregunta:
+1. parte los fragmentos en oraciones y preselecciona las EXTRACTIVE_CANDIDATES
+   que comparten más raíces con la consulta (tokenize_es, como BM25), con una
+   ventaja para los fragmentos mejor ubicados en la recuperación;
+2. embebe solo esas con el EmbeddingBatcher del índice (comparten lotes con las
+   consultas concurrentes; las ya vistas salen de una caché acotada) y las compara
+   con el embedding de la consulta que ya se calculó para buscar;
+3. elige EXTRACTIVE_MAX_SENTENCES con MMR (relevantes y distintas entre sí) y las
+   cita con [n] -> archivo y página.
+
+Con las oraciones en caché cuesta unos milisegundos; en frío se suma una pasada
+del modelo por hasta EXTRACTIVE_CANDIDATES oraciones (decenas a cientos de ms en
+CPU, según el largo). Aun así es mucho menos que el LLM, así que sirve como modo
+de baja latencia (ANSWER_MODE=extractiva o "modo" en /chat), cuando no hay LLM o
+falla, y cuando el presupuesto del LLM está lleno.
+"""
+from __future__ import annotations
+
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence
+
+from bounded_cache import BoundedCache
+
+if TYPE_CHECKING:
+    import numpy as np
+
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "5"))
+# Oraciones que se embeben por respuesta (las de más coincidencias con la consulta)
+EXTRACTIVE_CANDIDATES = int(os.getenv("EXTRACTIVE_CANDIDATES", "40"))
+# 1 = solo relevancia, 0 = solo diversidad
+EXTRACTIVE_LAMBDA = float(os.getenv("EXTRACTIVE_LAMBDA", "0.7"))
+EXTRACTIVE_MIN_WORDS = int(os.getenv("EXTRACTIVE_MIN_WORDS", "6"))
+EXTRACTIVE_MAX_CHARS = int(os.getenv("EXTRACTIVE_MAX_CHARS", "400"))
+EXTRACTIVE_CACHE_MB = int(os.getenv("EXTRACTIVE_CACHE_MB", "32"))
+# Oraciones con similitud menor a esta fracción de la mejor no se incluyen
+_RELATIVE_MIN_SCORE = 0.6
+
+# Fin de oración (., !, ?, ;) seguido de espacio (salvo abreviaturas como "p. 12"),
+# párrafo en blanco o salto de línea antes de una viñeta
+_BULLETS = "-–•*▪●○◦■□➢✓®"
+_SENTENCE_END_RE = re.compile(
+    r"(?<!\bp\.)(?<!\bpp\.)(?<!\bpág\.)(?<!\bPág\.)(?<!\bej\.)(?<!\bNo\.)(?<!\bart\.)(?<!\bArt\.)"
+    r"(?<=[.!?;])\s+|\s*\n\s*\n\s*|\n(?=\s*(?:[" + _BULLETS + r"]|\d+[.)])\s)")
+_BULLET_RE = re.compile(r"^\s*(?:[" + _BULLETS + r"]|\d+[.)])\s+")
+# Espacios de ancho cero que deja la extracción de algunos PDF
+_INVISIBLE_RE = re.compile("[\u200b\u200c\u200d\ufeff]")
+
+_sentence_vectors = BoundedCache("oraciones_extractivas", max_items=200_000,
+                                 max_bytes=EXTRACTIVE_CACHE_MB * 1024 * 1024)
+
+
+def split_sentences(text: str) -> List[str]:
+    """Oraciones de un fragmento (sin viñetas ni saltos de línea internos)"""
+    sentences = []
+    for part in _SENTENCE_END_RE.split(_INVISIBLE_RE.sub("", text or "")):
+        sentence = " ".join(_BULLET_RE.sub("", part).split())
+        letters = [c for c in sentence if c.isalpha()]
+        # Títulos en mayúsculas, índices, encabezados de tabla...
+        if not letters or sum(c.isupper() for c in letters) > 0.6 * len(letters):
+            continue
+        if len(sentence.split()) >= EXTRACTIVE_MIN_WORDS:
+            if len(sentence) > EXTRACTIVE_MAX_CHARS:
+                sentence = sentence[:EXTRACTIVE_MAX_CHARS].rsplit(" ", 1)[0] + "..."
+            sentences.append(sentence)
+    return sentences
+
+
+def _embed_sentences(sentences: List[str], embed: Callable[[List[str]], List[List[float]]]) -> np.ndarray:
+    """Embeddings normalizados; solo se calculan los que no están en caché"""
+    import numpy as np
+
+    vectors: List[Optional[np.ndarray]] = [_sentence_vectors.get(s) for s in sentences]
+    missing = list(dict.fromkeys(s for s, v in zip(sentences, vectors) if v is None))
+    if missing:
+        computed = np.asarray(embed(missing), dtype=np.float32)
+        computed /= np.maximum(np.linalg.norm(computed, axis=1, keepdims=True), 1e-12)
+        fresh = dict(zip(missing, computed))
+        for sentence, vector in fresh.items():
+            _sentence_vectors.put(sentence, vector)
+        vectors = [v if v is not None else fresh[s] for s, v in zip(sentences, vectors)]
+    return np.vstack(vectors)
+
+
+def _mmr(similarities: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """MMR sobre vectores normalizados; índices en orden de selección"""
+    import numpy as np
+
+    selected: List[int] = []
+    redundancy = np.full(len(similarities), -np.inf)
+    for _ in range(min(k, len(similarities))):
+        scores = lambda_mult * similarities - (1 - lambda_mult) * np.maximum(redundancy, 0.0)
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return selected
+
+
+def select_sentences(query: str, query_embedding: Sequence[float], docs: List[Any],
+                     embed: Callable[[List[str]], List[List[float]]],
+                     max_sentences: int = EXTRACTIVE_MAX_SENTENCES) -> List[Dict[str, Any]]:
+    """
+    Oraciones elegidas, en orden de relevancia:
+    [{"texto", "doc" (posición en docs), "posicion" (en el fragmento), "similitud"}]
+    """
+    import numpy as np
+    from rag_processor import tokenize_es
+
+    query_terms = set(tokenize_es(query))
+    candidates = []
+    for d, doc in enumerate(docs):
+        # Los fragmentos llegan ordenados por la recuperación: los primeros pesan más
+        prior = 1.0 - d / max(len(docs), 1)
+        for position, sentence in enumerate(split_sentences(doc.page_content)):
+            terms = tokenize_es(sentence)
+            overlap = len(query_terms.intersection(terms)) / max(len(query_terms), 1)
+            candidates.append((overlap + 0.25 * prior, sentence, d, position))
+    if not candidates:
+        return []
+    candidates.sort(key=lambda c: -c[0])
+    candidates = candidates[:EXTRACTIVE_CANDIDATES]
+
+    vectors = _embed_sentences([c[1] for c in candidates], embed)
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+    similarities = vectors @ query_vector
+
+    floor = _RELATIVE_MIN_SCORE * max(float(similarities.max()), 0.0)
+    chosen = []
+    for i in _mmr(similarities, vectors, max_sentences, EXTRACTIVE_LAMBDA):
+        if similarities[i] < floor:
+            continue
+        _, sentence, d, position = candidates[i]
+        chosen.append({"texto": sentence, "doc": d, "posicion": position, "similitud": float(similarities[i])})
+    return chosen
+
+
+def extractive_answer(organizacion: str, mensaje: str, query_embedding: Sequence[float], docs: List[Any],
+                      embed: Callable[[List[str]], List[List[float]]], nota: str = "") -> str:
+    """Respuesta Markdown con las oraciones elegidas y sus citas [n] (archivo, página)"""
+    start = time.perf_counter()
+    chosen = select_sentences(mensaje, query_embedding, docs, embed)
+
+    citations: Dict[tuple, int] = {}
+    lines = []
+    # Agrupadas por fragmento (el de la oración más relevante primero) y en el orden del texto
+    first = {}
+    for rank, item in enumerate(chosen):
+        first.setdefault(item["doc"], rank)
+    for item in sorted(chosen, key=lambda c: (first[c["doc"]], c["posicion"])):
+        doc = docs[item["doc"]]
+        source = os.path.basename(doc.metadata.get("source", "unknown"))
+        key = (source, doc.metadata.get("page", "?"), "Tier 1" in doc.metadata.get("retrieval_tier", ""))
+        number = citations.setdefault(key, len(citations) + 1)
+        lines.append(f"- {item['texto']} [{number}]")
+
+    if not lines:
+        # Sin oraciones completas (tablas, listas cortas): el inicio del mejor fragmento
+        doc = docs[0]
+        texto = " ".join(doc.page_content.split())[:EXTRACTIVE_MAX_CHARS]
+        key = (os.path.basename(doc.metadata.get("source", "unknown")), doc.metadata.get("page", "?"),
+               "Tier 1" in doc.metadata.get("retrieval_tier", ""))
+        citations[key] = 1
+        lines.append(f"- {texto}... [1]")
+
+    fuentes = [f"[{n}] {'🏢' if tier1 else '🌍'} {source} (Pág. {page})"
+               for (source, page, tier1), n in citations.items()]
+    print(f"🧾 Respuesta extractiva: {len(chosen)} oraciones en {(time.perf_counter() - start) * 1000:.1f}ms")
+    partes = [f"📄 **Información de {organizacion}**\n", f"*Pregunta: {mensaje}*\n", "---\n",
+              "\n".join(lines), "\n---\n**Fuentes:**", "\n".join(fuentes)]
+    if nota:
+        partes.append(f"\n{nota}")
+    return "\n".join(partes)
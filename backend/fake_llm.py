@@ -0,0 +1,82 @@
+"""
+Servidor falso compatible con la API de OpenAI (/v1/chat/completions) para pruebas de carga.
+
+Responde con un texto fijo (incluye el bloque <thinking> que espera el prompt)
+tras una latencia configurable, sin consumir cuota ni depender de la red.
+El backend lo usa con OPENAI_BASE_URL=http://127.0.0.1:<puerto>/v1.
+
+Uso:
+    python fake_llm.py --port 8300 --latency-ms 1500 --jitter-ms 500
+    python fake_llm.py --error-rate 0.02    # 2% de respuestas 500
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+RESPUESTA = (
+    "<thinking>Respuesta simulada por fake_llm.py para pruebas de carga.</thinking>\n"
+    "Según los documentos de la organización, la información solicitada se resume en "
+    "los extractos consultados. Esta es una respuesta simulada para pruebas de carga."
+)
+
+
+def create_app(latency_ms: float = 1500.0, jitter_ms: float = 500.0, error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="LLM falso (OpenAI compatible)")
+    stats = {"solicitudes": 0, "errores": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["solicitudes"] += 1
+        delay = max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000.0
+        await asyncio.sleep(delay)
+
+        if error_rate and random.random() < error_rate:
+            stats["errores"] += 1
+            return JSONResponse(status_code=500, content={
+                "error": {"message": "Error simulado", "type": "server_error"}
+            })
+
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+        prompt_tokens = prompt_chars // 4
+        completion_tokens = len(RESPUESTA) // 4
+        return {
+            "id": f"chatcmpl-fake-{stats['solicitudes']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": RESPUESTA},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    @app.get("/stats")
+    def obtener_stats():
+        return stats
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM falso compatible con OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--latency-ms", type=float, default=1500.0, help="Latencia media por respuesta")
+    parser.add_argument("--jitter-ms", type=float, default=500.0, help="Desviación estándar de la latencia")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas 500")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(args.latency_ms, args.jitter_ms, args.error_rate),
+                host=args.host, port=args.port, log_level="warning")
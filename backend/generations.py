@@ -0,0 +1,355 @@
+"""
+Generaciones del índice (builds blue/green de chroma_db).
+
+Cada build escribe una generación completa (colecciones Chroma, índice de
+palabras clave y manifest) en chroma_db/generations/<id>/, la valida y solo
+entonces la activa reemplazando atómicamente el archivo chroma_db/CURRENT.
+La API sigue leyendo la generación anterior hasta que la nueva está lista y
+la recarga sin reiniciar (ver chat_service.get_rag). PREVIOUS guarda la
+generación anterior para volver a ella al instante.
+
+Sin CURRENT se usa el formato original: Chroma directamente en chroma_db/.
+
+Uso:
+    python generations.py build            # incremental sobre la generación activa
+    python generations.py build --full     # desde cero
+    python generations.py list
+    python generations.py validate <id>
+    python generations.py swap <id>
+    python generations.py rollback
+    python generations.py prune --keep 2
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+DB_DIR = os.getenv("CHROMA_DB_DIR")
+if not DB_DIR:
+    DB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db"))
+
+GENERATIONS_SUBDIR = "generations"
+CURRENT_FILE = "CURRENT"
+PREVIOUS_FILE = "PREVIOUS"
+# Generación "raíz": el formato original, Chroma directamente en chroma_db/
+ROOT_GENERATION = "."
+# Id de una generación (fecha y hora del build): nombre de carpeta sin separadores
+GENERATION_ID_RE = re.compile(r"^\d{8}-\d{6}$")
+KEYWORD_INDEX_SUBDIR = "keyword_index"
+MANIFEST_NAME = "manifest.json"
+# En una generación en construcción: {"full": ..., "base_ready": ...} para retomarla
+BUILD_STATE_FILE = "BUILDING.json"
+
+# Lo que hay en chroma_db/ y no forma parte del índice
+_NOT_INDEX = {GENERATIONS_SUBDIR, CURRENT_FILE, PREVIOUS_FILE, "pdf_cache", "territorial_cache.json",
+              "hnsw_params.json", "snapshots", BUILD_STATE_FILE}
+
+
+def _read_pointer(db_dir: str, name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(db_dir, name), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_pointer(db_dir: str, name: str, value: str):
+    """Escritura atómica: los lectores ven el valor anterior o el nuevo, nunca uno a medias"""
+    path = os.path.join(db_dir, name)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(value + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def current_generation(db_dir: str = DB_DIR) -> Optional[str]:
+    """Id de la generación activa, o None si se usa el formato original"""
+    generation = _read_pointer(db_dir, CURRENT_FILE)
+    return None if generation == ROOT_GENERATION else generation
+
+
+def generation_path(db_dir: str, generation: Optional[str]) -> str:
+    if not generation or generation == ROOT_GENERATION:
+        return db_dir
+    return os.path.join(db_dir, GENERATIONS_SUBDIR, generation)
+
+
+def resolve_index_dir(db_dir: str = DB_DIR) -> str:
+    """Carpeta del índice activo"""
+    return generation_path(db_dir, current_generation(db_dir))
+
+
+def keyword_index_path(index_dir: str) -> str:
+    return os.path.join(index_dir, KEYWORD_INDEX_SUBDIR)
+
+
+def list_generations(db_dir: str = DB_DIR) -> List[str]:
+    """Generaciones completas (sin builds en curso ni fallidos), de la más antigua a la más nueva"""
+    root = os.path.join(db_dir, GENERATIONS_SUBDIR)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if "." not in name and os.path.isdir(os.path.join(root, name)))
+
+
+def _has_index(path: str) -> bool:
+    return os.path.exists(os.path.join(path, "chroma.sqlite3"))
+
+
+def index_entries(index_dir: str) -> List[str]:
+    """Archivos y carpetas de una generación que forman parte del índice"""
+    return sorted(name for name in os.listdir(index_dir)
+                  if name not in _NOT_INDEX and not name.endswith(".tmp"))
+
+
+def _copy_index(src: str, dst: str):
+    """Copia las colecciones Chroma (y el manifest) de una generación a otra"""
+    os.makedirs(dst, exist_ok=True)
+    for name in index_entries(src):
+        if name == KEYWORD_INDEX_SUBDIR:
+            continue
+        src_path, dst_path = os.path.join(src, name), os.path.join(dst, name)
+        if os.path.isdir(src_path):
+            shutil.copytree(src_path, dst_path)
+        else:
+            shutil.copy2(src_path, dst_path)
+
+
+def build_keyword_index(index_dir: str) -> int:
+    """Construye y guarda el índice BM25 de una generación; devuelve el número de fragmentos"""
+    from rag_processor import SparseBM25, load_corpus
+
+    corpus = load_corpus(index_dir)
+    if not corpus["documents"]:
+        return 0
+    index = SparseBM25(corpus)
+    index.save(keyword_index_path(index_dir))
+    return len(index)
+
+
+def validate_generation(index_dir: str, probes_per_collection: int = 5) -> Dict:
+    """
+    Comprueba que una generación se puede servir: colecciones no vacías, cada
+    fragmento de prueba se recupera a sí mismo con su embedding (HNSW sano) e
+    índice de palabras clave (y vectores resumen, si hay) con el mismo número
+    de fragmentos.
+    """
+    import chromadb
+    from rag_processor import SparseBM25
+    from shards import list_shards
+
+    errors: List[str] = []
+    counts: Dict[str, int] = {}
+    client = chromadb.PersistentClient(path=index_dir)
+    collections = {org_id: client.get_collection(name) for org_id, name in list_shards(client).items()}
+    if not collections:
+        errors.append("no hay colecciones por organización")
+
+    for org_id, collection in collections.items():
+        count = collection.count()
+        counts[org_id] = count
+        if count == 0:
+            errors.append(f"colección vacía: {org_id}")
+            continue
+        offsets = random.sample(range(count), min(probes_per_collection, count))
+        for offset in offsets:
+            probe = collection.get(limit=1, offset=offset, include=["embeddings"])
+            result = collection.query(query_embeddings=[probe["embeddings"][0]], n_results=3,
+                                      include=["distances"])
+            # Un fragmento duplicado puede empatar a distancia 0 con el de prueba
+            found = probe["ids"][0] in result["ids"][0] or (
+                result["distances"][0] and result["distances"][0][0] < 1e-6)
+            if not found:
+                errors.append(f"{org_id}: el fragmento {probe['ids'][0]} no se recupera a sí mismo")
+
+    total = sum(counts.values())
+    keyword_path = keyword_index_path(index_dir)
+    if not os.path.isdir(keyword_path):
+        errors.append("falta el índice de palabras clave")
+    else:
+        keyword_chunks = len(SparseBM25.load(keyword_path))
+        if keyword_chunks != total:
+            errors.append(f"índice de palabras clave con {keyword_chunks} fragmentos, Chroma con {total}")
+
+    from doc_summaries import DocumentSummaryIndex, document_index_path
+    summaries_path = document_index_path(index_dir)
+    if os.path.isdir(summaries_path):
+        summarized = DocumentSummaryIndex.load(summaries_path).chunks
+        if summarized != total:
+            errors.append(f"vectores resumen de {summarized} fragmentos, Chroma con {total}")
+
+    return {"ok": not errors, "errors": errors, "chunks": total, "collections": counts}
+
+
+def swap(generation: str, db_dir: str = DB_DIR):
+    """Activa una generación; la activa hasta ahora queda en PREVIOUS"""
+    if generation != ROOT_GENERATION and generation not in list_generations(db_dir):
+        raise ValueError(f"No existe la generación {generation}")
+    previous = _read_pointer(db_dir, CURRENT_FILE) or ROOT_GENERATION
+    if previous != generation:
+        _write_pointer(db_dir, PREVIOUS_FILE, previous)
+    _write_pointer(db_dir, CURRENT_FILE, generation)
+    print(f"🔀 Generación activa: {generation} (anterior: {previous})")
+
+
+def rollback(db_dir: str = DB_DIR):
+    """Vuelve a la generación anterior"""
+    previous = _read_pointer(db_dir, PREVIOUS_FILE)
+    if not previous:
+        raise ValueError("No hay generación anterior registrada")
+    swap(previous, db_dir)
+
+
+def _read_build_state(build_dir: str) -> Dict:
+    try:
+        with open(os.path.join(build_dir, BUILD_STATE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_build_state(build_dir: str, state: Dict):
+    path = os.path.join(build_dir, BUILD_STATE_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def interrupted_build(full: bool = False, db_dir: str = DB_DIR) -> Optional[str]:
+    """
+    Build del mismo tipo que quedó a medias (proceso terminado durante la ingesta)
+    con la copia de la generación activa completa: se puede retomar
+    """
+    root = os.path.join(db_dir, GENERATIONS_SUBDIR)
+    if not os.path.isdir(root):
+        return None
+    for name in sorted(os.listdir(root), reverse=True):
+        if not name.endswith(".building"):
+            continue
+        state = _read_build_state(os.path.join(root, name))
+        if state.get("base_ready") and state.get("full") == full:
+            return name[:-len(".building")]
+    return None
+
+
+def build_generation(full: bool = False, db_dir: str = DB_DIR, retry_failed: bool = False) -> str:
+    """
+    Construye, valida y activa una generación nueva.
+    Incremental por defecto: parte de una copia de la generación activa y su
+    manifest, así que solo se embeben los archivos nuevos o modificados.
+    Si un build anterior se interrumpió, lo retoma (ver ingest_journal.py).
+    """
+    import ingest
+
+    generation = interrupted_build(full, db_dir)
+    start = time.time()
+    if generation:
+        build_dir = os.path.join(db_dir, GENERATIONS_SUBDIR, f"{generation}.building")
+        print(f"♻️ Retomando la generación {generation} interrumpida en {build_dir}")
+    else:
+        generation = datetime.now().strftime("%Y%m%d-%H%M%S")
+        build_dir = os.path.join(db_dir, GENERATIONS_SUBDIR, f"{generation}.building")
+        os.makedirs(build_dir)
+        print(f"🏗️ Construyendo generación {generation} en {build_dir}")
+
+    manifest_file = os.path.join(build_dir, MANIFEST_NAME)
+    if not _read_build_state(build_dir).get("base_ready"):
+        base_dir = resolve_index_dir(db_dir)
+        if not full and _has_index(base_dir):
+            print(f"   Copiando la generación activa ({current_generation(db_dir) or 'formato original'})...")
+            _copy_index(base_dir, build_dir)
+            # En el formato original el manifest vive en documents/
+            if not os.path.exists(manifest_file) and os.path.exists(ingest.MANIFEST_FILE):
+                shutil.copy2(ingest.MANIFEST_FILE, manifest_file)
+        _write_build_state(build_dir, {"full": full, "base_ready": True})
+
+    ingest.ingest_documents(db_dir=build_dir, manifest_file=manifest_file, retry_failed=retry_failed)
+
+    print("🔤 Construyendo índice de palabras clave...")
+    chunks = build_keyword_index(build_dir)
+
+    print("🔎 Validando...")
+    report = validate_generation(build_dir)
+    if not report["ok"]:
+        failed_dir = build_dir.replace(".building", ".failed")
+        os.rename(build_dir, failed_dir)
+        for error in report["errors"]:
+            print(f"   ❌ {error}")
+        raise RuntimeError(f"La generación {generation} no pasó la validación ({failed_dir})")
+
+    final_dir = os.path.join(db_dir, GENERATIONS_SUBDIR, generation)
+    os.remove(os.path.join(build_dir, BUILD_STATE_FILE))
+    os.rename(build_dir, final_dir)
+    swap(generation, db_dir)
+    print(f"✅ Generación {generation}: {chunks} fragmentos en {len(report['collections'])} colecciones "
+          f"({time.time() - start:.1f}s)")
+    return generation
+
+
+def prune(keep: int = 2, db_dir: str = DB_DIR) -> List[str]:
+    """Elimina generaciones antiguas y builds fallidos; nunca la activa ni la anterior"""
+    protected = {_read_pointer(db_dir, CURRENT_FILE), _read_pointer(db_dir, PREVIOUS_FILE)}
+    generations = list_generations(db_dir)
+    removable = [g for g in generations[:max(0, len(generations) - keep)] if g not in protected]
+    root = os.path.join(db_dir, GENERATIONS_SUBDIR)
+    if os.path.isdir(root):
+        removable += [name for name in os.listdir(root) if name.endswith(".failed")]
+    for name in removable:
+        shutil.rmtree(os.path.join(root, name))
+        print(f"🧹 Eliminada {name}")
+    return removable
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generaciones del índice (builds blue/green)")
+    parser.add_argument("--db-dir", default=DB_DIR)
+    sub = parser.add_subparsers(dest="comando", required=True)
+    build_parser = sub.add_parser("build", help="Construir, validar y activar una generación nueva")
+    build_parser.add_argument("--full", action="store_true", help="Desde cero, sin copiar la generación activa")
+    build_parser.add_argument("--retry-failed", action="store_true",
+                              help="Reintentar ya los archivos que fallaron (ver ingest_journal.py)")
+    sub.add_parser("list", help="Listar generaciones")
+    validate_parser = sub.add_parser("validate", help="Validar una generación")
+    validate_parser.add_argument("generacion")
+    swap_parser = sub.add_parser("swap", help="Activar una generación")
+    swap_parser.add_argument("generacion")
+    sub.add_parser("rollback", help="Volver a la generación anterior")
+    prune_parser = sub.add_parser("prune", help="Eliminar generaciones antiguas")
+    prune_parser.add_argument("--keep", type=int, default=2)
+    args = parser.parse_args()
+
+    try:
+        if args.comando == "build":
+            build_generation(full=args.full, db_dir=args.db_dir, retry_failed=args.retry_failed)
+        elif args.comando == "list":
+            current = _read_pointer(args.db_dir, CURRENT_FILE) or ROOT_GENERATION
+            previous = _read_pointer(args.db_dir, PREVIOUS_FILE)
+            for generation in [ROOT_GENERATION] + list_generations(args.db_dir):
+                if generation == ROOT_GENERATION and not _has_index(args.db_dir):
+                    continue
+                mark = "* " if generation == current else ("↩ " if generation == previous else "  ")
+                print(f"{mark}{generation}")
+        elif args.comando == "validate":
+            report = validate_generation(generation_path(args.db_dir, args.generacion))
+            print(f"{'✅' if report['ok'] else '❌'} {report['chunks']} fragmentos, "
+                  f"{len(report['collections'])} colecciones")
+            for error in report["errors"]:
+                print(f"   ❌ {error}")
+            sys.exit(0 if report["ok"] else 1)
+        elif args.comando == "swap":
+            swap(args.generacion, args.db_dir)
+        elif args.comando == "rollback":
+            rollback(args.db_dir)
+        elif args.comando == "prune":
+            prune(args.keep, args.db_dir)
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
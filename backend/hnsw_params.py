@@ -0,0 +1,104 @@
+"""
+Parámetros HNSW de las colecciones Chroma.
+
+Construcción (se fijan al crear la colección):
+- space: métrica de distancia (l2, cosine, ip)
+- M: vecinos por nodo del grafo; más = mejor recall y más memoria
+- ef_construction: candidatos al insertar; más = mejor grafo y build más lento
+Búsqueda (se puede cambiar en una colección existente; rige desde la próxima
+vez que un proceso carga el índice):
+- ef_search: candidatos al buscar; más = mejor recall y más latencia
+
+Los valores por defecto salen de variables de entorno y se pueden ajustar por
+colección en hnsw_params.json (lo escribe hnsw_sweep.py --apply). ingest.py los
+aplica: los de construcción al crear cada colección (build --full / --force
+para las existentes) y ef_search también sobre las colecciones ya creadas.
+"""
+import json
+import os
+from typing import Any, Dict
+
+DB_DIR = os.getenv("CHROMA_DB_DIR")
+if not DB_DIR:
+    DB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db"))
+
+# Junto a chroma_db, compartido por todas las generaciones del índice
+HNSW_PARAMS_FILE = os.getenv("HNSW_PARAMS_FILE") or os.path.join(DB_DIR, "hnsw_params.json")
+
+# Defaults de Chroma
+DEFAULT_PARAMS = {
+    "space": os.getenv("HNSW_SPACE", "l2"),
+    "M": int(os.getenv("HNSW_M", "16")),
+    "ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "100")),
+    "ef_search": int(os.getenv("HNSW_EF_SEARCH", "100")),
+}
+BUILD_PARAMS = ("space", "M", "ef_construction")
+
+# Nombre en los metadatos de Chroma de cada parámetro
+_METADATA_KEYS = {"space": "hnsw:space", "M": "hnsw:M",
+                  "ef_construction": "hnsw:construction_ef", "ef_search": "hnsw:search_ef"}
+# Nombre en la configuración de Chroma 1.x
+_CONFIGURATION_KEYS = {"space": "space", "M": "max_neighbors",
+                       "ef_construction": "ef_construction", "ef_search": "ef_search"}
+
+
+def load_params_file(path: str = HNSW_PARAMS_FILE) -> Dict[str, Any]:
+    """{"default": {...}, "collections": {nombre: {...}}} (vacío si no existe)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_params_file(data: Dict[str, Any], path: str = HNSW_PARAMS_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def params_for(collection_name: str, path: str = HNSW_PARAMS_FILE) -> Dict[str, Any]:
+    """Parámetros de una colección: variables de entorno < "default" < la colección"""
+    data = load_params_file(path)
+    return {**DEFAULT_PARAMS, **data.get("default", {}), **data.get("collections", {}).get(collection_name, {})}
+
+
+def hnsw_metadata(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Metadatos de colección con los que Chroma crea el índice HNSW"""
+    return {_METADATA_KEYS[key]: value for key, value in params.items() if key in _METADATA_KEYS}
+
+
+def current_params(collection) -> Dict[str, Any]:
+    """Parámetros con los que está construida una colección existente"""
+    configuration = getattr(collection, "configuration", None) or {}
+    hnsw = configuration.get("hnsw") if isinstance(configuration, dict) else None
+    if hnsw:
+        return {key: hnsw.get(name) for key, name in _CONFIGURATION_KEYS.items()}
+    # Chroma < 1.0: solo los metadatos (ausentes = defaults de Chroma)
+    metadata = collection.metadata or {}
+    chroma_defaults = {"space": "l2", "M": 16, "ef_construction": 100, "ef_search": 10}
+    return {key: metadata.get(name, chroma_defaults[key]) for key, name in _METADATA_KEYS.items()}
+
+
+def apply_search_params(collection, params: Dict[str, Any]) -> bool:
+    """
+    Actualiza ef_search de una colección existente si difiere. Avisa si los
+    parámetros de construcción no coinciden (solo cambian reconstruyéndola).
+    """
+    current = current_params(collection)
+    stale = [key for key in BUILD_PARAMS if current.get(key) is not None and current[key] != params[key]]
+    if stale:
+        print(f"   ⚠️ {collection.name}: {', '.join(f'{k}={current[k]}' for k in stale)} "
+              f"(configurado: {', '.join(f'{k}={params[k]}' for k in stale)}); "
+              f"se aplica al reconstruir (generations.py build --full)")
+    if current.get("ef_search") == params["ef_search"]:
+        return False
+    try:
+        collection.modify(configuration={"hnsw": {"ef_search": params["ef_search"]}})
+    except TypeError:
+        # Chroma < 1.0 no acepta configuration en modify()
+        collection.modify(metadata={**(collection.metadata or {}), _METADATA_KEYS["ef_search"]: params["ef_search"]})
+    print(f"   🔧 {collection.name}: ef_search {current.get('ef_search')} -> {params['ef_search']}")
+    return True
@@ -0,0 +1,292 @@
+"""
+Barrido de parámetros HNSW: recall@k frente a búsqueda exacta y latencia por consulta.
+
+Para cada colección de la generación activa lee sus embeddings, calcula los
+vecinos exactos por fuerza bruta (numpy) y mide:
+- la configuración actual, consultando la colección real de chroma_db;
+- cada combinación de M / ef_construction / ef_search, reconstruyendo la
+  colección en una carpeta temporal (chroma_db no se modifica).
+k es lo que pide la búsqueda vectorial: (10 en Tier 1, 3 en Tier 2) x MMR_FETCH_K_MULTIPLIER.
+Recomienda la configuración más rápida que alcanza --target-recall y con --apply
+la guarda en hnsw_params.json para la próxima ingesta (ver hnsw_params.py).
+
+Uso:
+    python hnsw_sweep.py
+    python hnsw_sweep.py --collections pares_global --queries 200
+    python hnsw_sweep.py --m 8,16,32 --ef-construction 100,200 --ef-search 20,40,80,160
+    python hnsw_sweep.py --target-recall 0.98 --apply
+    python hnsw_sweep.py --queries-file preguntas.txt   # consultas reales, embebidas con el modelo
+"""
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from generations import DB_DIR, resolve_index_dir
+from hnsw_params import (HNSW_PARAMS_FILE, current_params, hnsw_metadata, load_params_file,
+                         params_for, save_params_file)
+from latency_stats import percentile
+from rag_processor import MMR_FETCH_K_MULTIPLIER
+from shards import GLOBAL_COLLECTION, LEGACY_COLLECTION, has_legacy_collection, list_shards
+# k de cada nivel en RAGProcessor.search_tiered_batch (configurables por entorno)
+from tier_planner import TIER1_K, TIER2_K
+
+WARMUP_QUERIES = 5
+
+
+def read_embeddings(collection, page_size: int = 5000):
+    """(ids, matriz float32) de todos los fragmentos de una colección"""
+    ids, vectors = [], []
+    offset = 0
+    while True:
+        batch = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        vectors.append(np.asarray(batch["embeddings"], dtype=np.float32))
+        offset += len(batch["ids"])
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return ids, matrix
+
+
+def exact_neighbors(vectors: np.ndarray, queries: np.ndarray, k: int, space: str,
+                    exclude: Optional[List[int]] = None, block: int = 256) -> np.ndarray:
+    """Índices de los k vecinos exactos de cada consulta (sin el propio fragmento si se indica)"""
+    if space == "cosine":
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    squared_norms = (vectors * vectors).sum(axis=1)
+    k = min(k, len(vectors) - (1 if exclude is not None else 0))
+    result = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), block):
+        q = queries[start:start + block]
+        if space == "l2":
+            distances = squared_norms[None, :] - 2.0 * q @ vectors.T
+        else:  # cosine (ya normalizados) o ip
+            distances = -(q @ vectors.T)
+        if exclude is not None:
+            distances[np.arange(len(q)), exclude[start:start + block]] = np.inf
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        result[start:start + block] = top
+    return result
+
+
+def measure(collection, queries: np.ndarray, k: int, exact: np.ndarray, ids: List[str],
+            self_ids: Optional[List[str]]) -> Dict:
+    """Recall@k y latencia de consultas individuales contra una colección Chroma"""
+    extra = 1 if self_ids is not None else 0
+    for q in queries[:WARMUP_QUERIES]:
+        collection.query(query_embeddings=[q.tolist()], n_results=k + extra, include=[])
+    latencies, hits = [], 0
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        found = collection.query(query_embeddings=[q.tolist()], n_results=k + extra, include=[])["ids"][0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        if self_ids is not None:
+            found = [chunk_id for chunk_id in found if chunk_id != self_ids[i]]
+        hits += len(set(found[:k]) & {ids[j] for j in exact[i]})
+    return {
+        "recall": hits / float(exact.size or 1),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
+
+
+def _open_client(path: str):
+    import chromadb
+    return chromadb.PersistentClient(path=path)
+
+
+def _build(path: str, ids: List[str], vectors: np.ndarray, params: Dict, batch_size: int):
+    """Colección con los parámetros dados en una carpeta temporal; devuelve (nombre, segundos)"""
+    name = f"sweep_{params['M']}_{params['ef_construction']}"
+    collection = _open_client(path).create_collection(name, metadata=hnsw_metadata(params))
+    start = time.perf_counter()
+    for offset in range(0, len(ids), batch_size):
+        collection.add(ids=ids[offset:offset + batch_size],
+                       embeddings=vectors[offset:offset + batch_size].tolist())
+    return name, time.perf_counter() - start
+
+
+def _open_with_ef_search(path: str, name: str, ef_search: int):
+    """
+    Chroma toma ef_search al cargar el índice: un modify() no afecta a un índice
+    ya abierto. Se guarda el valor y se reabre el cliente sin la caché de sistemas.
+    """
+    from chromadb.api.client import SharedSystemClient
+
+    _open_client(path).get_collection(name).modify(configuration={"hnsw": {"ef_search": ef_search}})
+    SharedSystemClient.clear_system_cache()
+    return _open_client(path).get_collection(name)
+
+
+def sweep_collection(name: str, collection, args, query_vectors=None) -> Dict:
+    ids, vectors = read_embeddings(collection)
+    current = current_params(collection)
+    space = current.get("space") or "l2"
+    base_k = TIER2_K if name == GLOBAL_COLLECTION else TIER1_K
+    k = min(base_k * MMR_FETCH_K_MULTIPLIER, max(1, len(ids) - 1))
+    report = {"coleccion": name, "fragmentos": len(ids), "k": k, "space": space,
+              "actual": None, "configuraciones": [], "recomendada": None}
+    if len(ids) < 2:
+        return report
+
+    rng = random.Random(args.seed)
+    if query_vectors is None:
+        # Fragmentos de la colección como consultas, sin contarse a sí mismos
+        sample = rng.sample(range(len(ids)), min(args.queries, len(ids)))
+        queries, exclude, self_ids = vectors[sample], sample, [ids[i] for i in sample]
+    else:
+        queries, exclude, self_ids = query_vectors, None, None
+
+    # Configuración actual, sobre la colección real
+    exact = exact_neighbors(vectors, queries, k, space, exclude)
+    report["actual"] = {**current, **measure(collection, queries, k, exact, ids, self_ids)}
+
+    # Reconstrucciones (sobre una muestra si la colección es muy grande)
+    if len(ids) > args.max_vectors:
+        keep = sorted(rng.sample(range(len(ids)), args.max_vectors))
+        if query_vectors is None:
+            keep = sorted(set(keep) | set(sample))
+        ids, vectors = [ids[i] for i in keep], vectors[keep]
+        if query_vectors is None:
+            position = {j: n for n, j in enumerate(keep)}
+            exclude = [position[i] for i in sample]
+        exact = exact_neighbors(vectors, queries, k, space, exclude)
+        report["muestra"] = len(ids)
+
+    ef_values = args.ef_search or sorted({k, 2 * k, 4 * k, 8 * k, 100})
+    for m in args.m:
+        for ef_construction in args.ef_construction:
+            params = {"space": space, "M": m, "ef_construction": ef_construction, "ef_search": ef_values[0]}
+            build_dir = tempfile.mkdtemp(prefix="hnsw_sweep_")
+            try:
+                built_name, build_s = _build(build_dir, ids, vectors, params, args.batch_size)
+                for ef_search in ef_values:
+                    built = _open_with_ef_search(build_dir, built_name, ef_search)
+                    row = {**params, "ef_search": ef_search, "build_s": round(build_s, 2),
+                           **measure(built, queries, k, exact, ids, self_ids)}
+                    report["configuraciones"].append(row)
+                    print(f"   M={m:<3} ef_c={ef_construction:<4} ef_s={ef_search:<4} "
+                          f"recall={row['recall']:.3f}  p50={row['p50_ms']:.2f}ms  p95={row['p95_ms']:.2f}ms")
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+
+    report["recomendada"] = recommend(report["configuraciones"], args.target_recall)
+    return report
+
+
+def recommend(rows: List[Dict], target_recall: float) -> Optional[Dict]:
+    """
+    La más rápida que alcanza el recall objetivo; entre las que están a menos de
+    10% de esa latencia, la de grafo más chico (menos memoria y build más rápido).
+    Si ninguna lo alcanza, la de mayor recall.
+    """
+    if not rows:
+        return None
+    passing = [r for r in rows if r["recall"] >= target_recall]
+    if not passing:
+        return max(rows, key=lambda r: (r["recall"], -r["p50_ms"]))
+    fastest = min(r["p50_ms"] for r in passing)
+    close = [r for r in passing if r["p50_ms"] <= fastest * 1.1]
+    return min(close, key=lambda r: (r["M"], r["ef_construction"], r["ef_search"]))
+
+
+def _format_row(label: str, row: Dict) -> str:
+    return (f"   {label:<12} M={row.get('M')!s:<3} ef_c={row.get('ef_construction')!s:<4} "
+            f"ef_s={row.get('ef_search')!s:<4} recall={row['recall']:.3f}  "
+            f"p50={row['p50_ms']:.2f}ms  p95={row['p95_ms']:.2f}ms")
+
+
+def print_summary(reports: List[Dict], target_recall: float):
+    print(f"\n📋 Resumen (recall objetivo {target_recall:.2f})")
+    for report in reports:
+        print(f"\n🗂️ {report['coleccion']} ({report['fragmentos']} fragmentos, k={report['k']}, {report['space']})")
+        if report.get("muestra"):
+            print(f"   (reconstrucciones sobre una muestra de {report['muestra']} fragmentos)")
+        if report["actual"]:
+            print(_format_row("actual", report["actual"]))
+        if report["recomendada"]:
+            print(_format_row("recomendada", report["recomendada"]))
+
+
+def apply_recommendations(reports: List[Dict], path: str = HNSW_PARAMS_FILE):
+    data = load_params_file(path)
+    collections = data.setdefault("collections", {})
+    for report in reports:
+        best = report["recomendada"]
+        if best:
+            collections[report["coleccion"]] = {key: best[key] for key in ("space", "M", "ef_construction", "ef_search")}
+    save_params_file(data, path)
+    print(f"\n💾 Recomendaciones guardadas en {path}")
+    print("   ef_search se aplica en la próxima ingesta; M y ef_construction al reconstruir "
+          "(python generations.py build --full).")
+
+
+def _embed_queries_file(path: str) -> np.ndarray:
+    from rag_processor import RAGProcessor
+
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+    rag = RAGProcessor(connect=False)
+    return np.asarray(rag.embed_queries(questions), dtype=np.float32)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Barrido de parámetros HNSW (recall vs latencia)")
+    parser.add_argument("--db-dir", default=DB_DIR)
+    parser.add_argument("--collections", help="Nombres separados por coma (default: todas)")
+    parser.add_argument("--queries", type=int, default=200, help="Consultas por colección")
+    parser.add_argument("--queries-file", help="Preguntas reales, una por línea (se embeben con el modelo)")
+    parser.add_argument("--m", type=_int_list, default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=_int_list, default=[100, 200])
+    parser.add_argument("--ef-search", type=_int_list, default=None,
+                        help="Default: k, 2k, 4k, 8k y 100")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--max-vectors", type=int, default=50000,
+                        help="Fragmentos máximos de cada reconstrucción (muestra)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--apply", action="store_true", help="Guardar las recomendaciones en hnsw_params.json")
+    parser.add_argument("-o", "--output", help="Guardar el reporte completo en JSON")
+    args = parser.parse_args()
+
+    index_dir = resolve_index_dir(args.db_dir)
+    client = _open_client(index_dir)
+    names = list(list_shards(client).values())
+    if not names and has_legacy_collection(client):
+        names = [LEGACY_COLLECTION]
+    if args.collections:
+        wanted = set(args.collections.split(","))
+        names = [name for name in names if name in wanted]
+    if not names:
+        print(f"❌ No hay colecciones en {index_dir}")
+        sys.exit(1)
+
+    query_vectors = _embed_queries_file(args.queries_file) if args.queries_file else None
+    reports = []
+    for name in names:
+        print(f"\n🔬 {name}")
+        # Las reconstrucciones vacían la caché de clientes de Chroma: se reabre cada vez
+        collection = _open_client(index_dir).get_collection(name)
+        reports.append(sweep_collection(name, collection, args, query_vectors))
+
+    print_summary(reports, args.target_recall)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"index_dir": index_dir, "target_recall": args.target_recall,
+                       "configurado": {name: params_for(name) for name in names}, "reportes": reports},
+                      f, indent=2, ensure_ascii=False)
+        print(f"💾 Reporte guardado en {args.output}")
+    if args.apply:
+        apply_recommendations(reports)
@@ -1,13 +1,19 @@
 import os
 import json
 import time
-import hashlib
+import argparse
 from datetime import datetime
-from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import SentenceTransformerEmbeddings
 from langchain_community.vectorstores import Chroma
 from tqdm import tqdm
+from shards import collection_name_for, collection_metadata_for, list_shards, has_legacy_collection
+from pdf_cache import calculate_file_hash, load_pdf_pages
+from hnsw_params import apply_search_params, params_for
+from doc_summaries import build_document_index, document_index_path
+from near_dup import (NEAR_DUP_ENABLED, add_deduplicated_chunks, near_dup_path, open_near_dup_index,
+                      print_dedup_report, refresh_alias_metadata)
+from ingest_journal import INGEST_CHECKPOINT_FILES, IngestJournal, print_failures
 
 # Configuration
 DOCS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "documents"))
@@ -24,22 +30,14 @@ EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
 CHUNK_SIZE = 1800
 CHUNK_OVERLAP = 300
 
-def calculate_file_hash(file_path):
-    """Calculates MD5 hash of a file"""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-def load_manifest():
-    if os.path.exists(MANIFEST_FILE):
-        with open(MANIFEST_FILE, 'r') as f:
+def load_manifest(manifest_file=MANIFEST_FILE):
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
             return json.load(f)
     return {}
 
-def save_manifest(manifest):
-    with open(MANIFEST_FILE, 'w') as f:
+def save_manifest(manifest, manifest_file=MANIFEST_FILE):
+    with open(manifest_file, 'w') as f:
         json.dump(manifest, f, indent=2)
 
 def determine_scope_and_org(file_path):
@@ -65,11 +63,20 @@ def determine_scope_and_org(file_path):
         
     return "global", "UNKNOWN" # Fallback
 
-def ingest_documents():
+def ingest_documents(force=False, db_dir=DB_DIR, manifest_file=MANIFEST_FILE, retry_failed=False):
+    """
+    Ingesta incremental de documents/ en ChromaDB.
+    force=True reprocesa todos los archivos (p. ej. tras cambiar CHUNK_SIZE); el
+    texto sale de la caché de pdf_cache.py, así que no se vuelve a parsear ningún PDF.
+    generations.py pasa su propia carpeta y manifest para construir una generación aparte.
+    El progreso se anota por archivo y una ingesta interrumpida se retoma donde
+    quedó; los archivos con errores se reintentan con espera (ver ingest_journal.py).
+    retry_failed=True los reintenta ya, sin esperar.
+    """
     print(f"🚀 Starting Ingestion Pipeline")
     print(f"   - Embedding Model: {EMBEDDING_MODEL}")
     print(f"   - Chunk Size: {CHUNK_SIZE} / Overlap: {CHUNK_OVERLAP}")
-    print(f"   - DB Path: {DB_DIR}")
+    print(f"   - DB Path: {db_dir}")
     print("=" * 60)
 
     # 1. Setup Directories
@@ -102,22 +109,42 @@ def ingest_documents():
         return
 
     # 3. Incremental Logic
-    manifest = load_manifest()
+    manifest = load_manifest(manifest_file)
+    journal = IngestJournal(manifest_file)
+    recovered = journal.recover(manifest)
+    if journal.pending:
+        # Ingesta interrumpida: lo que ya quedó guardado no se vuelve a procesar
+        print(f"♻️ Retomando la ingesta interrumpida: {recovered} archivos ya estaban guardados")
+        journal.checkpoint(manifest)
+    journal.forget_missing(found_files)
+
     files_to_process = []
+    hashes = {}
+    waiting = 0
     
     print(f"🔍 Scanning {len(found_files)} files for changes...")
     
     for file_path in found_files:
         current_hash = calculate_file_hash(file_path)
+        hashes[file_path] = current_hash
         stored_hash = manifest.get(file_path)
         
-        if current_hash != stored_hash:
+        if force or current_hash != stored_hash:
+            # El manifest solo se actualiza cuando el archivo queda guardado
+            wait = journal.retry_wait(file_path, current_hash)
+            if wait and not retry_failed:
+                waiting += 1
+                continue
             files_to_process.append(file_path)
-            manifest[file_path] = current_hash # Update manifest (we'll save at end only if success?) 
-            # Ideally save incrementally or at end. For now, we update the dict and save after processing.
+
+    if waiting:
+        print(f"⏳ {waiting} archivos con errores esperan su próximo reintento (--retry-failed para forzarlo)")
 
     if not files_to_process:
         print("✅ All files are up to date. No new ingestion needed.")
+        if recovered or not os.path.isdir(document_index_path(db_dir)):
+            build_document_index(db_dir)
+        print_failures(journal)
         return
 
     print(f"📦 Processing {len(files_to_process)} new/modified files...")
@@ -134,19 +161,69 @@ def ingest_documents():
         separators=["\n\n", "\n", ".", " ", ""]
     )
     
-    # Connect to DB
-    db = Chroma(
-        persist_directory=DB_DIR, 
-        embedding_function=embedding_function
-    )
+    # Connect to DB (una colección por organización + una global, ver shards.py)
+    import chromadb
+    client = chromadb.PersistentClient(path=db_dir)
+    if has_legacy_collection(client):
+        if list_shards(client):
+            print("   ⚠️ Existe también la colección única original; ejecute migrate_shards.py para eliminarla.")
+        else:
+            from migrate_shards import migrate_legacy_collection
+            migrate_legacy_collection(db_dir)
+
+    # Las colecciones nuevas se crean con los parámetros HNSW configurados; en las
+    # existentes solo se puede actualizar ef_search (ver hnsw_params.py)
+    for name in list_shards(client).values():
+        apply_search_params(client.get_collection(name), params_for(name))
+
+    # Casi duplicados (ver near_dup.py). Reprocesar un archivo borra sus fragmentos:
+    # los archivos con alias hacia ellos también se reprocesan
+    near_dups = None
+    dedup_totals = {}
+    if NEAR_DUP_ENABLED:
+        near_dups = open_near_dup_index(db_dir, client)
+        requested = len(files_to_process)
+        queue = list(files_to_process)
+        while queue:
+            queued_path = queue.pop()
+            scope, org_id = determine_scope_and_org(queued_path)
+            name = collection_name_for(scope, org_id)
+            for dependent in near_dups.dependents(name, os.path.basename(queued_path)):
+                if dependent not in files_to_process and os.path.exists(dependent):
+                    files_to_process.append(dependent)
+                    queue.append(dependent)
+                    if dependent not in hashes:
+                        hashes[dependent] = calculate_file_hash(dependent)
+        if len(files_to_process) > requested:
+            print(f"   🧬 {len(files_to_process) - requested} archivos con alias hacia los modificados también se reprocesan")
+
+    stores = {}
+
+    def get_store(scope, org_id):
+        name = collection_name_for(scope, org_id)
+        if name not in stores:
+            stores[name] = Chroma(
+                collection_name=name,
+                client=client,
+                embedding_function=embedding_function,
+                collection_metadata=collection_metadata_for(scope, org_id)
+            )
+        return stores[name]
+
+    def checkpoint():
+        # Primero las firmas: el diario de la ingesta nunca va por delante de ellas
+        if near_dups is not None:
+            near_dups.save(near_dup_path(db_dir))
+        journal.checkpoint(manifest)
 
     # 5. Process Files
     for file_path in tqdm(files_to_process, desc="Ingesting"):
+        filename = os.path.basename(file_path)
+        scope, org_id = determine_scope_and_org(file_path)
+        db = None
         try:
-            filename = os.path.basename(file_path)
-            
             # Setup Metadata
-            scope, org_id = determine_scope_and_org(file_path)
+            db = get_store(scope, org_id)
             
             # Cleanup existing chunks for this file (to avoid duplicates on re-ingest)
             # Note: Chroma delete by where metadata is efficient
@@ -163,19 +240,19 @@ def ingest_documents():
                 existing = db.get(where={"source": filename})
                 if existing and existing['ids']:
                      db.delete(existing['ids'])
+
+                if near_dups is not None:
+                    changed = near_dups.remove_source(db._collection.name, filename)
+                    if changed:
+                        refresh_alias_metadata(db._collection, near_dups, changed)
                      
             except Exception as e:
                 print(f"   ⚠️ Warning cleaning up old chunks for {filename}: {e}")
 
-            # Load & Split
-            loader = PyMuPDFLoader(file_path)
-            docs = loader.load()
+            # Load (from the page-text cache when possible) & Split
+            docs = load_pdf_pages(file_path, hashes[file_path])
             
             chunks = text_splitter.split_documents(docs)
-            
-            if not chunks:
-                print(f"   ⚠️ Skipped {filename} (empty)")
-                continue
 
             # Enrich Metadata
             for chunk in chunks:
@@ -188,17 +265,67 @@ def ingest_documents():
                 })
 
             # Add to DB
-            db.add_documents(chunks)
+            if not chunks:
+                print(f"   ⚠️ Skipped {filename} (empty)")
+            elif near_dups is None:
+                db.add_documents(chunks)
+            else:
+                file_stats = add_deduplicated_chunks(db, db._collection.name, chunks, near_dups,
+                                                     embedding_function.embed_documents, client)
+                for key, value in file_stats.items():
+                    dedup_totals[key] = dedup_totals.get(key, 0) + value
             
         except Exception as e:
-            print(f"❌ Error processing {file_path}: {e}")
-            # Revert manifest change for this file so we try again next time?
-            # For simplicity, we won't resort complex revert logic here 
-            # but in production we should.
+            # Sin fragmentos a medias: el archivo queda fuera del índice hasta el reintento
+            try:
+                if db is not None:
+                    leftover = db.get(where={"source": filename})
+                    if leftover and leftover['ids']:
+                        db.delete(leftover['ids'])
+                    if near_dups is not None:
+                        changed = near_dups.remove_source(db._collection.name, filename)
+                        if changed:
+                            refresh_alias_metadata(db._collection, near_dups, changed)
+            except Exception as cleanup_error:
+                print(f"   ⚠️ Warning cleaning up {filename}: {cleanup_error}")
+            if near_dups is not None:
+                near_dups.flush_journal(near_dup_path(db_dir))
+            manifest.pop(file_path, None)
+            failure = journal.failed(file_path, hashes[file_path], e)
+            print(f"❌ Error processing {file_path} (intento {failure['attempts']}): {e}")
+        else:
+            # Las firmas del archivo se anotan antes que el archivo
+            if near_dups is not None:
+                near_dups.flush_journal(near_dup_path(db_dir))
+            manifest[file_path] = hashes[file_path]
+            journal.done(file_path, hashes[file_path])
+
+        if journal.pending >= INGEST_CHECKPOINT_FILES:
+            checkpoint()
             
     # 6. Save Manifest
-    save_manifest(manifest)
+    checkpoint()
+    if near_dups is not None:
+        print_dedup_report(dedup_totals)
+    print_failures(journal)
     print(f"\n✅ Ingestion Complete. Manifest updated.")
 
+    # 7. Vectores resumen por documento (recuperación en dos etapas, ver doc_summaries.py)
+    build_document_index(db_dir)
+
 if __name__ == "__main__":
-    ingest_documents()
+    parser = argparse.ArgumentParser(description="Ingesta de documentos en ChromaDB")
+    parser.add_argument("--force", action="store_true",
+                        help="Reprocesar todos los archivos (re-chunking / re-embedding) usando la caché de texto")
+    parser.add_argument("--build", action="store_true",
+                        help="Construir una generación nueva aparte y activarla al validarla (ver generations.py)")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Reintentar ya los archivos que fallaron, sin esperar (ver ingest_journal.py)")
+    args = parser.parse_args()
+
+    from generations import build_generation, current_generation
+    if args.build or current_generation(DB_DIR):
+        # Con generaciones activas nunca se escribe sobre el índice que está sirviendo la API
+        build_generation(full=args.force, retry_failed=args.retry_failed)
+    else:
+        ingest_documents(force=args.force, retry_failed=args.retry_failed)
@@ -0,0 +1,136 @@
+"""
+Diario de la ingesta: progreso durable por archivo y reintentos con espera.
+
+ingest.py anota cada archivo en <manifest>.journal.jsonl apenas queda guardado
+en Chroma (una línea JSON con fsync), y cada INGEST_CHECKPOINT_FILES archivos
+pasa lo anotado al manifest (escritura atómica) y vacía el diario. Si el proceso
+muere a mitad de camino, la siguiente ingesta aplica el diario al manifest y
+sigue con los archivos que faltaban: no se vuelve a embeber lo ya guardado.
+
+Un archivo que falla sale del manifest (y del índice): queda en <manifest>.failures.json
+con sus intentos y se reintenta en las ingestas siguientes con espera
+exponencial (INGEST_RETRY_BASE_S, 2x, ... hasta INGEST_RETRY_MAX_S). Tras
+INGEST_MAX_ATTEMPTS intentos se deja de reintentar hasta que el PDF cambie
+(o con ingest.py --retry-failed).
+"""
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+INGEST_CHECKPOINT_FILES = int(os.getenv("INGEST_CHECKPOINT_FILES", "25"))
+INGEST_RETRY_BASE_S = float(os.getenv("INGEST_RETRY_BASE_S", "300"))
+INGEST_RETRY_MAX_S = float(os.getenv("INGEST_RETRY_MAX_S", "86400"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+
+
+def _write_json(data: Any, path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IngestJournal:
+    """Archivos terminados desde el último checkpoint y archivos con errores"""
+
+    def __init__(self, manifest_file: str):
+        base = os.path.splitext(manifest_file)[0]
+        self.manifest_file = manifest_file
+        self.path = f"{base}.journal.jsonl"
+        self.failures_file = f"{base}.failures.json"
+        try:
+            with open(self.failures_file, "r", encoding="utf-8") as f:
+                self.failures: Dict[str, Dict[str, Any]] = json.load(f)
+        except FileNotFoundError:
+            self.failures = {}
+        self.pending = 0
+
+    def recover(self, manifest: Dict[str, str]) -> int:
+        """Aplica al manifest lo anotado por una ingesta interrumpida; devuelve cuántos archivos"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+        recovered = 0
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # Última línea a medio escribir
+            self.pending += 1
+            if entry["status"] == "done":
+                manifest[entry["file"]] = entry["hash"]
+                self.failures.pop(entry["file"], None)
+                recovered += 1
+            else:
+                # Sus fragmentos se borraron: tampoco está en el índice anterior
+                manifest.pop(entry["file"], None)
+                self.failures[entry["file"]] = entry["failure"]
+        return recovered
+
+    def _append(self, entry: Dict[str, Any]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending += 1
+
+    def done(self, file_path: str, file_hash: str):
+        self.failures.pop(file_path, None)
+        self._append({"status": "done", "file": file_path, "hash": file_hash})
+
+    def failed(self, file_path: str, file_hash: str, error: Exception) -> Dict[str, Any]:
+        """Registra el error y calcula el próximo reintento"""
+        previous = self.failures.get(file_path)
+        attempts = previous["attempts"] + 1 if previous and previous["hash"] == file_hash else 1
+        wait = min(INGEST_RETRY_BASE_S * 2 ** (attempts - 1), INGEST_RETRY_MAX_S)
+        failure = {"hash": file_hash, "attempts": attempts, "error": f"{type(error).__name__}: {error}",
+                   "last_attempt": time.time(), "next_retry": time.time() + wait,
+                   "abandoned": attempts >= INGEST_MAX_ATTEMPTS}
+        self.failures[file_path] = failure
+        self._append({"status": "failed", "file": file_path, "failure": failure})
+        return failure
+
+    def retry_wait(self, file_path: str, file_hash: str) -> Optional[float]:
+        """
+        Segundos que faltan para reintentar un archivo que falló (0 = ya se puede,
+        inf = abandonado). None si no tiene errores o el PDF cambió desde entonces.
+        """
+        failure = self.failures.get(file_path)
+        if not failure or failure["hash"] != file_hash:
+            return None
+        if failure.get("abandoned"):
+            return float("inf")
+        return max(0.0, failure["next_retry"] - time.time())
+
+    def forget_missing(self, existing):
+        """Descarta los errores de archivos que ya no están en documents/"""
+        for file_path in set(self.failures) - set(existing):
+            del self.failures[file_path]
+
+    def checkpoint(self, manifest: Dict[str, str]):
+        """Manifest y errores a disco (atómico) y diario vacío"""
+        _write_json(manifest, self.manifest_file)
+        if self.failures:
+            _write_json(self.failures, self.failures_file)
+        elif os.path.exists(self.failures_file):
+            os.remove(self.failures_file)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.pending = 0
+
+
+def print_failures(journal: IngestJournal):
+    if not journal.failures:
+        return
+    print(f"\n⚠️ {len(journal.failures)} archivos con errores (no se marcaron como procesados):")
+    for file_path, failure in sorted(journal.failures.items()):
+        if failure.get("abandoned"):
+            retry = "sin más reintentos hasta que cambie (--retry-failed)"
+        else:
+            retry = f"reintento desde {time.strftime('%Y-%m-%d %H:%M', time.localtime(failure['next_retry']))}"
+        print(f"   ❌ {os.path.basename(file_path)} (intento {failure['attempts']}): {failure['error']} — {retry}")
@@ -0,0 +1,14 @@
+"""
+Estadísticas de latencia compartidas por las herramientas de medición
+(bench_workers.py, loadtest.py, hnsw_sweep.py, replay_queries.py).
+"""
+from typing import Iterable
+
+
+def percentile(values: Iterable[float], p: float) -> float:
+    """Percentil p (0-100) por el valor más cercano; 0.0 sin valores"""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[idx]
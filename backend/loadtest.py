@@ -0,0 +1,366 @@
+"""
+Prueba de carga de extremo a extremo con tráfico mixto y reporte contra SLOs.
+
+Usuarios virtuales (lazo cerrado con tiempo de espera entre consultas) repiten
+una mezcla de /chat, /paises, /organizaciones/{pais} e /insight-territorial.
+Con --start levanta fake_llm.py y serve.py localmente, así que el resultado
+mide el backend sin la latencia ni la cuota de OpenAI.
+
+El reporte incluye throughput, p50/p95/p99 y tasa de errores por endpoint
+comparados con los SLOs declarados; --output lo guarda en JSON y --compare
+muestra la diferencia con un reporte anterior (p. ej. de otro build).
+
+Uso:
+    python loadtest.py --start --workers 2 --users 20 --duration 60
+    python loadtest.py --start --output antes.json
+    python loadtest.py --start --compare antes.json
+    python loadtest.py --url http://localhost:8000 --users 10 --mix chat=60,paises=20,insight=20
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from latency_stats import percentile
+from process_stats import child_pids, memory_stats
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCATIONS_FILE = os.path.join(BACKEND_DIR, "documents", "locations.json")
+
+# Proporción de cada endpoint en el tráfico (un taller típico: mapa + chat)
+DEFAULT_MIX = {"chat": 40, "paises": 20, "organizaciones": 25, "insight": 15}
+
+# Objetivos por endpoint; --slo archivo.json los reemplaza parcialmente
+DEFAULT_SLOS = {
+    "chat": {"p95_ms": 6000, "p99_ms": 10000, "error_rate": 0.01},
+    "paises": {"p95_ms": 50, "p99_ms": 150, "error_rate": 0.001},
+    "organizaciones": {"p95_ms": 50, "p99_ms": 150, "error_rate": 0.001},
+    "insight": {"p95_ms": 200, "p99_ms": 500, "error_rate": 0.001},
+}
+
+PREGUNTAS = [
+    "¿Cuál es la misión de la organización?",
+    "¿Qué metas tiene para 2028?",
+    "¿Cómo financian la conservación?",
+    "¿Qué proyectos de restauración desarrollan?",
+    "¿Qué amenazas enfrenta el territorio?",
+    "¿Cómo participan las comunidades locales?",
+    "¿Qué acciones de adaptación al cambio climático proponen?",
+    "¿Cuáles son sus principales aliados?",
+    "Resume los resultados del último informe.",
+    "¿Qué especies o ecosistemas protegen?",
+]
+
+
+class Target:
+    """Datos de la API que necesitan los usuarios virtuales (países, organizaciones, coordenadas)"""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.paises: List[str] = []
+        self.organizaciones: List[str] = []
+        self.coordenadas: List[tuple] = []
+
+    def discover(self):
+        self.paises = json.loads(self._get("/paises"))
+        for pais in self.paises:
+            orgs = json.loads(self._get(f"/organizaciones/{urllib.parse.quote(pais)}"))
+            self.organizaciones.extend(org["nombre"] for org in orgs)
+        if os.path.exists(LOCATIONS_FILE):
+            with open(LOCATIONS_FILE, "r", encoding="utf-8") as f:
+                locations = json.load(f).get("organizaciones", {})
+            self.coordenadas = [(loc["lat"], loc["lng"]) for loc in locations.values()]
+        if not self.coordenadas:
+            self.coordenadas = [(14.0, -87.0)]
+
+    def _get(self, path: str) -> bytes:
+        with urllib.request.urlopen(f"{self.base_url}{path}", timeout=self.timeout) as response:
+            return response.read()
+
+    def request(self, endpoint: str, rng: random.Random) -> int:
+        """Hace una solicitud del tipo indicado y devuelve el código HTTP"""
+        if endpoint == "paises":
+            url, body = "/paises", None
+        elif endpoint == "organizaciones":
+            url, body = f"/organizaciones/{urllib.parse.quote(rng.choice(self.paises))}", None
+        elif endpoint == "chat":
+            url, body = "/chat", {"organizacion": rng.choice(self.organizaciones),
+                                  "mensaje": rng.choice(PREGUNTAS)}
+        elif endpoint == "insight":
+            # Cerca del territorio de alguna organización, como los clics en el mapa
+            lat, lng = rng.choice(self.coordenadas)
+            url, body = "/insight-territorial", {"lat": lat + rng.uniform(-1, 1),
+                                                 "lng": lng + rng.uniform(-1, 1)}
+        else:
+            raise ValueError(f"Endpoint desconocido: {endpoint}")
+
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(f"{self.base_url}{url}", data=data,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def run_load(target: Target, mix: Dict[str, float], users: int, duration: float,
+             warmup: float, think_ms: float, seed: int) -> List[tuple]:
+    """Lanza los usuarios virtuales; devuelve (endpoint, status, latencia_s) tras el calentamiento"""
+    endpoints = list(mix)
+    weights = [mix[e] for e in endpoints]
+    samples: List[tuple] = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from = start + warmup
+    end = measure_from + duration
+
+    def user(index: int):
+        rng = random.Random(seed + index)
+        # Arranque escalonado para no sincronizar a todos los usuarios
+        time.sleep(rng.uniform(0, think_ms / 1000.0))
+        while time.monotonic() < end:
+            endpoint = rng.choices(endpoints, weights)[0]
+            t0 = time.monotonic()
+            try:
+                status = target.request(endpoint, rng)
+            except Exception:
+                status = 0  # timeout o conexión rechazada
+            elapsed = time.monotonic() - t0
+            if t0 >= measure_from:
+                with lock:
+                    samples.append((endpoint, status, elapsed))
+            if think_ms > 0:
+                time.sleep(rng.expovariate(1000.0 / think_ms))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def build_report(samples: List[tuple], duration: float, slos: Dict[str, Dict]) -> Dict:
+    by_endpoint: Dict[str, List[tuple]] = defaultdict(list)
+    for endpoint, status, elapsed in samples:
+        by_endpoint[endpoint].append((status, elapsed))
+
+    endpoints = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        # Latencias solo de respuestas exitosas: un 429 inmediato no debe mejorar el p95
+        latencies = [elapsed for status, elapsed in rows if 200 <= status < 400]
+        statuses = Counter(str(status) for status, _ in rows)
+        errors = len(rows) - len(latencies)
+        stats = {
+            "solicitudes": len(rows),
+            "rps": round(len(rows) / duration, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "error_rate": round(errors / len(rows), 4),
+            "status": dict(statuses),
+        }
+        slo = slos.get(endpoint, {})
+        failed = [key for key, limit in slo.items() if key in stats and stats[key] > limit]
+        stats["slo"] = slo
+        stats["slo_ok"] = not failed
+        stats["slo_fallidos"] = failed
+        endpoints[endpoint] = stats
+
+    return {
+        "total_rps": round(len(samples) / duration, 2) if duration else 0.0,
+        "endpoints": endpoints,
+        "slo_ok": all(e["slo_ok"] for e in endpoints.values()),
+    }
+
+
+def print_report(report: Dict):
+    print(f"\n{'endpoint':<16}{'n':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}  SLO")
+    for endpoint, stats in report["endpoints"].items():
+        slo = "✅" if stats["slo_ok"] else "❌ " + ", ".join(
+            f"{key}>{stats['slo'][key]}" for key in stats["slo_fallidos"])
+        print(f"{endpoint:<16}{stats['solicitudes']:>7}{stats['rps']:>9}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['error_rate'] * 100:>8.2f}%  {slo}")
+        non_ok = {code: n for code, n in stats["status"].items() if not code.startswith("2")}
+        if non_ok:
+            print(f"{'':<16}códigos: {non_ok}")
+    print(f"\nTotal: {report['total_rps']} req/s")
+    if "pss_mb_total" in report:
+        print(f"Memoria del servidor (PSS): {report['pss_mb_total']} MB")
+    print("✅ Todos los SLOs se cumplen" if report["slo_ok"] else "❌ Hay SLOs incumplidos")
+
+
+def print_comparison(report: Dict, baseline: Dict):
+    """Diferencias con un reporte anterior (positivo = peor en latencia/errores, mejor en req/s)"""
+    def delta(new, old):
+        if not old:
+            return "   n/a"
+        return f"{(new - old) / old * 100:+6.1f}%"
+
+    print(f"\nComparación con {baseline.get('etiqueta') or 'reporte anterior'}:")
+    print(f"{'endpoint':<16}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'errores':>14}")
+    for endpoint, stats in report["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(endpoint)
+        if not old:
+            print(f"{endpoint:<16}  (no está en el reporte anterior)")
+            continue
+        print(f"{endpoint:<16}{delta(stats['rps'], old['rps']):>10}{delta(stats['p50_ms'], old['p50_ms']):>10}"
+              f"{delta(stats['p95_ms'], old['p95_ms']):>10}{delta(stats['p99_ms'], old['p99_ms']):>10}"
+              f"{old['error_rate'] * 100:>6.2f}→{stats['error_rate'] * 100:.2f}%")
+    print(f"{'total':<16}{delta(report['total_rps'], baseline.get('total_rps')):>10}")
+
+
+def _wait_http(url: str, proc: subprocess.Popen, timeout: float, name: str):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{name} terminó durante el arranque")
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{name} no respondió a tiempo")
+
+
+def start_stack(args) -> List[subprocess.Popen]:
+    """Levanta fake_llm.py y serve.py; devuelve los procesos (LLM primero)"""
+    llm = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "fake_llm.py"), "--port", str(args.llm_port),
+         "--latency-ms", str(args.llm_latency_ms), "--jitter-ms", str(args.llm_jitter_ms),
+         "--error-rate", str(args.llm_error_rate)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    procs = [llm]
+    _wait_http(f"http://127.0.0.1:{args.llm_port}/stats", llm, 30, "fake_llm.py")
+
+    env = dict(os.environ, OPENAI_API_KEY="sk-fake-loadtest",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{args.llm_port}/v1")
+    server_log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "serve.py"), "--host", "127.0.0.1",
+         "--port", str(args.port), "--workers", str(args.workers),
+         "--memory-report-after", "0", "--log-level", "warning"],
+        env=env, stdout=server_log, stderr=subprocess.STDOUT,
+    )
+    procs.append(server)
+    _wait_http(f"http://127.0.0.1:{args.port}/", server, args.startup_timeout, "serve.py")
+    return procs
+
+
+def stop_stack(procs: List[subprocess.Popen]):
+    for proc in reversed(procs):
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise ValueError(f"Endpoints desconocidos en --mix: {', '.join(sorted(unknown))}")
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con tráfico mixto y reporte de SLOs")
+    parser.add_argument("--url", help="Servidor ya en marcha (si no se usa --start)")
+    parser.add_argument("--start", action="store_true", help="Levantar fake_llm.py y serve.py localmente")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=int, default=300)
+    parser.add_argument("--server-log", help="Guardar la salida de serve.py en este archivo")
+    parser.add_argument("--llm-port", type=int, default=8300)
+    parser.add_argument("--llm-latency-ms", type=float, default=1500.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=500.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--users", type=int, default=20, help="Usuarios virtuales concurrentes")
+    parser.add_argument("--duration", type=float, default=60.0, help="Segundos de medición")
+    parser.add_argument("--warmup", type=float, default=10.0, help="Segundos iniciales que no se miden")
+    parser.add_argument("--think-ms", type=float, default=1000.0, help="Espera media entre consultas de un usuario")
+    parser.add_argument("--mix", help="Pesos por endpoint, p. ej. chat=40,paises=20,organizaciones=25,insight=15")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Timeout por solicitud")
+    parser.add_argument("--slo", help="JSON con SLOs por endpoint (p95_ms, p99_ms, error_rate)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", help="Etiqueta del reporte (p. ej. commit o build)")
+    parser.add_argument("--output", "-o", help="Guardar el reporte en JSON")
+    parser.add_argument("--compare", help="Reporte JSON anterior con el que comparar")
+    args = parser.parse_args()
+
+    if not args.start and not args.url:
+        parser.error("Indique --url o --start")
+
+    mix = _parse_mix(args.mix) if args.mix else dict(DEFAULT_MIX)
+    slos = {endpoint: dict(slo) for endpoint, slo in DEFAULT_SLOS.items()}
+    if args.slo:
+        with open(args.slo, "r", encoding="utf-8") as f:
+            for endpoint, slo in json.load(f).items():
+                slos.setdefault(endpoint, {}).update(slo)
+
+    procs: List[subprocess.Popen] = []
+    pss_mb: Optional[float] = None
+    try:
+        if args.start:
+            print(f"🚀 Levantando fake_llm.py ({args.llm_latency_ms:.0f}±{args.llm_jitter_ms:.0f} ms) "
+                  f"y serve.py ({args.workers} workers)...", flush=True)
+            procs = start_stack(args)
+            base_url = f"http://127.0.0.1:{args.port}"
+        else:
+            base_url = args.url
+
+        target = Target(base_url, args.timeout)
+        target.discover()
+        print(f"▶️ {args.users} usuarios, {args.warmup:.0f}s de calentamiento + {args.duration:.0f}s "
+              f"de medición contra {base_url} (mezcla: {mix})", flush=True)
+        samples = run_load(target, mix, args.users, args.duration, args.warmup, args.think_ms, args.seed)
+
+        if args.start:
+            server = procs[-1]
+            pids = [server.pid] + child_pids(server.pid)
+            pss_mb = round(sum(memory_stats(pid).get("pss_kb", 0) for pid in pids) / 1024, 1)
+    finally:
+        stop_stack(procs)
+
+    report = build_report(samples, args.duration, slos)
+    report["etiqueta"] = args.label
+    report["parametros"] = {
+        "usuarios": args.users, "duracion_s": args.duration, "think_ms": args.think_ms, "mezcla": mix,
+        "workers": args.workers if args.start else None,
+        "llm_latency_ms": args.llm_latency_ms if args.start else None,
+    }
+    if pss_mb is not None:
+        report["pss_mb_total"] = pss_mb
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Reporte guardado en {args.output}")
+
+    sys.exit(0 if report["slo_ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,25 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import os
+import json
+import threading
 from dotenv import load_dotenv
-from document_manager import DocumentManager
-from rag_processor import RAGProcessor
 
-# Cargar variables de entorno desde .env
+# Cargar variables de entorno desde .env (antes de importar los módulos del
+# proyecto: leen su configuración del entorno al importarse)
 load_dotenv()
 
+from document_manager import DocumentManager
+from admission import AdmissionController, ClientDisconnected, Overloaded
+from comparison import COMPARE_MAX_ORGS
+from chat_service import (answer_question, answer_batch, answer_comparison, llm_stats, memory_report,
+                          new_session_id, RequestCancelled, ANSWER_MODES, LLM_DEGRADE_WHEN_SATURATED)
+from prewarm import set_questions as set_prewarm_questions
+from territorial import get_territorial_engine
+
 app = FastAPI(title="CATIE PARES API", version="1.0.0")
 
 # CORS Configuration
@@ -43,7 +53,8 @@ ORGANIZACIONES = {
             'descripcion': 'Soluciones locales a retos globales de desarrollo sostenible.',
             'descripcion_en': 'Local solutions to global sustainable development challenges.',
             'area': 'Desarrollo Sostenible',
-            'contacto': 'info@cecropia.org'
+            'contacto': 'info@cecropia.org',
+            'preguntas': ['¿Qué soluciones de desarrollo sostenible impulsa CECROPIA?']
         },
         {
             'id': 'mx2',
@@ -51,7 +62,8 @@ ORGANIZACIONES = {
             'descripcion': 'Fondo de Conservación El Triunfo.',
             'descripcion_en': 'El Triunfo Conservation Fund.',
             'area': 'Financiamiento',
-            'contacto': 'info@foncet.org'
+            'contacto': 'info@foncet.org',
+            'preguntas': ['¿Cómo financian la conservación de la Reserva El Triunfo?']
         }
     ],
     'Ecuador': [
@@ -61,7 +73,8 @@ ORGANIZACIONES = {
             'descripcion': 'Aprendiendo a través de la experimentación.',
             'descripcion_en': 'Learning through experimenting.',
             'area': 'Desarrollo Rural y Agroecología',
-            'contacto': 'info@tierraviva.org'
+            'contacto': 'info@tierraviva.org',
+            'preguntas': ['¿Qué prácticas agroecológicas promueve Tierra Viva?']
         },
         {
             'id': 'ec2',
@@ -69,7 +82,8 @@ ORGANIZACIONES = {
             'descripcion': 'Organización comunitaria enfocada en desarrollo sostenible en el Valle de Intag.',
             'descripcion_en': 'Community-based organization focused on sustainable development in the Intag Valley.',
             'area': 'Desarrollo Comunitario',
-            'contacto': 'info@toisan.org'
+            'contacto': 'info@toisan.org',
+            'preguntas': ['¿Qué iniciativas comunitarias desarrollan en el Valle de Intag?']
         }
     ],
     'Colombia': [
@@ -79,7 +93,8 @@ ORGANIZACIONES = {
             'descripcion': 'Promoción del uso sostenible de la biodiversidad.',
             'descripcion_en': 'Promotion of sustainable use of biodiversity.',
             'area': 'Biocomercio',
-            'contacto': 'info@biocomercio.org.co'
+            'contacto': 'info@biocomercio.org.co',
+            'preguntas': ['¿Cómo promueven el uso sostenible de la biodiversidad?']
         }
     ],
     'Honduras': [
@@ -89,7 +104,8 @@ ORGANIZACIONES = {
             'descripcion': 'Fundación para la Protección del Parque Nacional Montaña de Celaque.',
             'descripcion_en': 'Foundation for the Protection of Celaque Mountain National Park.',
             'area': 'Áreas Protegidas',
-            'contacto': 'info@puca.org'
+            'contacto': 'info@puca.org',
+            'preguntas': ['¿Qué amenazas enfrenta el Parque Nacional Montaña de Celaque?']
         },
         {
             'id': 'hn2',
@@ -97,7 +113,8 @@ ORGANIZACIONES = {
             'descripcion': 'Comité para la Defensa y Desarrollo de la Flora y Fauna del Golfo de Fonseca.',
             'descripcion_en': 'Committee for the Defense and Development of Flora and Fauna of the Gulf of Fonseca.',
             'area': 'Conservación',
-            'contacto': 'info@coddeffagolf.org'
+            'contacto': 'info@coddeffagolf.org',
+            'preguntas': ['¿Cómo protegen los manglares del Golfo de Fonseca?']
         },
         {
             'id': 'hn3',
@@ -105,7 +122,8 @@ ORGANIZACIONES = {
             'descripcion': 'Federación Nacional de Productores de Cacao de Honduras.',
             'descripcion_en': 'National Federation of Cocoa Producers of Honduras.',
             'area': 'Agricultura Sostenible',
-            'contacto': 'info@fenaprocacaho.org'
+            'contacto': 'info@fenaprocacaho.org',
+            'preguntas': ['¿Cómo apoyan a los productores de cacao?']
         }
     ],
     'El Salvador': [
@@ -115,7 +133,8 @@ ORGANIZACIONES = {
             'descripcion': 'Agencia de Desarrollo Económico Local de La Unión.',
             'descripcion_en': 'Local Economic Development Agency of La Unión.',
             'area': 'Desarrollo Local',
-            'contacto': 'info@adel.org.sv'
+            'contacto': 'info@adel.org.sv',
+            'preguntas': ['¿Qué proyectos de desarrollo económico local impulsan en La Unión?']
         }
     ],
     'Guatemala': [
@@ -125,7 +144,8 @@ ORGANIZACIONES = {
             'descripcion': 'Protección del patrimonio natural y cultural.',
             'descripcion_en': 'Protection of natural and cultural heritage.',
             'area': 'Conservación',
-            'contacto': 'info@defensores.org.gt'
+            'contacto': 'info@defensores.org.gt',
+            'preguntas': ['¿Qué áreas protegidas gestiona la organización?']
         },
         {
             'id': 'gt2',
@@ -133,7 +153,8 @@ ORGANIZACIONES = {
             'descripcion': 'Asociación para el Desarrollo Sostenible y Conservación.',
             'descripcion_en': 'Association for Sustainable Development and Conservation.',
             'area': 'Desarrollo Sostenible',
-            'contacto': 'info@asoverde.org'
+            'contacto': 'info@asoverde.org',
+            'preguntas': ['¿Qué acciones de conservación realizan con las comunidades?']
         },
         {
             'id': 'gt3',
@@ -141,18 +162,51 @@ ORGANIZACIONES = {
             'descripcion': 'Ecosistemas y Conservación.',
             'descripcion_en': 'Ecosystems and Conservation.',
             'area': 'Conservación',
-            'contacto': 'info@eco.org.gt'
+            'contacto': 'info@eco.org.gt',
+            'preguntas': ['¿Qué ecosistemas busca conservar la organización?']
         }
     ]
 }
 
+# Preguntas frecuentes que se precalientan al arrancar (ver prewarm.py)
+set_prewarm_questions(ORGANIZACIONES)
+
 # Pydantic Models
 class ChatRequest(BaseModel):
     organizacion: str
     mensaje: str
+    # Conversación de varios turnos: el cliente reenvía el session_id de la respuesta anterior
+    session_id: Optional[str] = None
+    # "extractiva": respuesta en milisegundos sin LLM (ver extractive.py); por defecto ANSWER_MODE
+    modo: Optional[str] = None
 
 class ChatResponse(BaseModel):
     respuesta: str
+    session_id: Optional[str] = None
+
+class CompareRequest(BaseModel):
+    mensaje: str
+    # Organizaciones a comparar y/o un país de ORGANIZACIONES (todas las suyas)
+    organizaciones: Optional[List[str]] = None
+    pais: Optional[str] = None
+    modo: Optional[str] = None
+
+class BatchChatItem(BaseModel):
+    organizacion: str
+    mensaje: str
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem]
+    concurrencia: Optional[int] = None
+
+# Límite de preguntas por llamada a /chat/batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# Lotes que se pueden procesar a la vez por proceso; los demás reciben 429
+BATCH_MAX_CONCURRENT = int(os.getenv("BATCH_MAX_CONCURRENT", "2"))
+_batch_slots = threading.BoundedSemaphore(max(1, BATCH_MAX_CONCURRENT))
+
+# Límites de /chat (ver admission.py)
+chat_admission = AdmissionController("chat")
 
 class TerritorialInsightRequest(BaseModel):
     lat: float
@@ -181,206 +235,131 @@ def obtener_organizaciones(nombre_pais: str):
     return ORGANIZACIONES[nombre_pais]
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest):
-    """Endpoint de chat RAG"""
+async def chat(request: ChatRequest, http_request: Request):
+    """
+    Endpoint de chat RAG.
+    Con el servidor saturado responde 429 (cola llena) o 503 (demasiada espera);
+    si el cliente se desconecta se abandona la consulta sin llamar al LLM.
+    Sin session_id se abre una sesión nueva y se devuelve su id.
+    """
+    if request.modo and request.modo not in ANSWER_MODES:
+        raise HTTPException(status_code=400, detail=f"modo debe ser uno de: {', '.join(ANSWER_MODES)}")
+    session_id = request.session_id or new_session_id()
     try:
-        # Inicializar procesador RAG
-        rag = RAGProcessor()
-        
-        # Mapeo de nombres de organizaciones a IDs de carpetas
-        # El frontend envía nombres como "Corporación Biocomercio", "Tierra Viva", etc.
-        # Las carpetas en backend/documents/orgs/ tienen nombres exactos
-        ORG_NAME_TO_FOLDER = {
-            # Colombia
-            "Corporación Biocomercio": "Corporación Biocomercio",
-            # Ecuador
-            "Tierra Viva": "TIERRA VIVA",
-            "Corporación Toisán": "Corporación Toisán",
-            # Mexico
-            "CECROPIA": "CECROPIA",
-            "FONCET": "FONCET",
-            # Honduras
-            "Fundación PUCA": "Fundación PUCA",
-            "CODDEFFAGOLF": "CODDEFFAGOLF",
-            "FENAPROCACAHO": "FENAPROCACAHO",
-            # El Salvador
-            "Asociación ADEL LA Unión": "Asociación ADEL LA Unión",
-            # Guatemala
-            "Defensores de la Naturaleza": "Defensores de la Naturaleza",
-            "ASOVERDE": "ASOVERDE",
-            "ECO": "ECO"
-        }
-        
-        # Obtener org_id (folder name) a partir del nombre
-        org_folder = ORG_NAME_TO_FOLDER.get(request.organizacion)
-        print(f"DEBUG: Request Org='{request.organizacion}' -> Folder/ID='{org_folder}'")
-        
-        if not rag.db:
-             return {
-                "respuesta": "El sistema de conocimiento aún no está inicializado. Por favor ingesta documentos primero."
-            }
-
-        # Usar búsqueda híbrida por niveles
-        if org_folder:
-            docs = rag.search_tiered(request.mensaje, org_id=org_folder)
-        else:
-            # Fallback a búsqueda general (Tier 2 only effectively)
-            # Podríamos implementar un 'search_global' en rag_processor, 
-            # pero por ahora usaremos search_tiered con un ID dummy o lógica custom.
-            # Simplemente buscaremos en Tier 2.
-            docs = rag.search_tiered(request.mensaje, org_id="GLOBAL_ONLY") # Esto retornará solo Tier 2 si Tier 1 falla o es vacío
-        
-        if not docs:
-            return {
-                "respuesta": f"No encontré información específica sobre '{request.mensaje}' en los documentos."
-            }
-        
-        # Construir contexto ESTRUCTURADO con etiquetas
-        contexto_parts = []
-        for doc in docs:
-            source = os.path.basename(doc.metadata.get('source', 'unknown'))
-            tier = doc.metadata.get('retrieval_tier', 'Support')
-            # Etiquetado claro para el LLM
-            tag = "ORGANIZATION_DOC (PRIORITY)" if "Tier 1" in tier else "GLOBAL_DOC (SUPPORT)"
-            
-            contexto_parts.append(
-                f"--- SOURCE: {source} [{tag}] ---\n{doc.page_content}\n"
-            )
-        
-        contexto = "\n".join(contexto_parts)
-        
-        # Lista de fuentes para el frontend (Markdown)
-        fuentes_unicas = {}
-        for doc in docs:
-            name = os.path.basename(doc.metadata.get('source', 'unknown'))
-            tier = doc.metadata.get('retrieval_tier', 'Unknown')
-            icon = "🏢" if "Tier 1" in tier else "🌍"
-            page = doc.metadata.get('page', '?')
-            fuentes_unicas[name] = f"* {icon} {name} (Pág. {page})"
-            
-        markdown_sources = "\n".join(fuentes_unicas.values())
-
-        # Intentar usar LLM (OpenAI)
-        try:
-            from langchain_openai import ChatOpenAI
-            from langchain_core.messages import HumanMessage
-            
-            api_key = os.getenv("OPENAI_API_KEY")
-            
-            if api_key:
-                llm = ChatOpenAI(
-                    model="gpt-4o-mini",
-                    temperature=0.0, # Rigor máximo
-                    openai_api_key=api_key
-                )
-                
-                # Prompt con "Methodological Backbone" y Thinking Block
-                prompt = f"""You are an Expert Consultant for the PARES Project (Conservation & Sustainable Development).
-
-ROLE & METHODOLOGY:
-1. **Understand**: Analyze the User's question and the context.
-2. **Define**: Identify key concepts (e.g., specific Org goals vs. global NbS definitions).
-3. **Check Evidence**: Compare [ORGANIZATION_DOC] vs [GLOBAL_DOC]. 
-   - RULE: [ORGANIZATION_DOC] is the TRUTH for this specific organization.
-   - RULE: Use [GLOBAL_DOC] only to fill gaps or explain technical concepts.
-4. **Synthesize**: Answer the user.
-
-CONTEXT:
-{contexto}
-
-USER QUESTION: {request.mensaje}
-TARGET ORGANIZATION: {request.organizacion}
-
-INSTRUCTIONS:
-- You MUST write a <thinking> block first. Inside, explain your Phase analysis and evidence check.
-- Then, write your final response in Spanish (Professional tone).
-- Do NOT write a "Sources" list. I will append it manually.
-
-RESPONSE:"""
-
-                messages = [HumanMessage(content=prompt)]
-                response = llm.invoke(messages)
-                full_response = response.content
-                
-                # Post-processing: Strip <thinking> block for the user
-                import re
-                clean_response = re.sub(r'<thinking>.*?</thinking>', '', full_response, flags=re.DOTALL).strip()
-                
-                # Append Real Sources (Markdown)
-                respuesta_final = f"{clean_response}\n\n**Fuentes Consultadas:**\n{markdown_sources}"
-                
-                return {"respuesta": respuesta_final}
-                
-                # Agregar fuentes
-                respuesta_final = f"{respuesta_sintetizada}\n\n---\n*Información basada en: {', '.join(fuentes)}*"
-                
-                return {"respuesta": respuesta_final}
-            
-        except Exception as llm_error:
-            print(f"Error usando LLM: {llm_error}")
-            import traceback
-            traceback.print_exc()
-            # Continuar con fallback
-        
-        # FALLBACK: Si no hay LLM disponible, crear un resumen mejorado
-        # Eliminar duplicados y crear un resumen más inteligente
-        unique_contents = []
-        seen = set()
-        
-        for doc in docs:
-            content = doc.page_content.strip()
-            # Usar primeras 100 chars como identificador para detectar duplicados
-            content_hash = content[:100]
-            if content_hash not in seen:
-                seen.add(content_hash)
-                unique_contents.append(content)
-        
-        # Limitar a los 3 extractos más relevantes y únicos
-        unique_contents = unique_contents[:3]
-        
-        respuesta_parts = [
-            f"📄 **Información de {request.organizacion}**\n",
-            f"*Pregunta: {request.mensaje}*\n",
-            "---\n"
-        ]
-        
-        for i, contenido in enumerate(unique_contents, 1):
-            # Limpiar y formatear
-            contenido_limpio = contenido.replace('\n', ' ').replace('  ', ' ').strip()
-            # Limitar longitud de cada extracto
-            if len(contenido_limpio) > 400:
-                contenido_limpio = contenido_limpio[:400] + "..."
-            respuesta_parts.append(f"**{i}.** {contenido_limpio}\n")
-        
-        respuesta_parts.append(f"\n---\n*Fuentes: {', '.join(fuentes)}*")
-        respuesta_parts.append(f"\n\n⚠️ *Nota: Configure OPENAI_API_KEY para obtener respuestas sintetizadas por IA*")
-        
-        respuesta_sintetizada = "\n".join(respuesta_parts)
-        
-        return {"respuesta": respuesta_sintetizada}
+        respuesta = await chat_admission.run(
+            http_request, answer_question, request.organizacion, request.mensaje,
+            degrade=LLM_DEGRADE_WHEN_SATURATED, session_id=session_id, modo=request.modo,
+        )
+        return {"respuesta": respuesta, "session_id": session_id}
 
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+    except (ClientDisconnected, RequestCancelled):
+        # Nadie va a leer la respuesta (499: convención de nginx)
+        return Response(status_code=499)
     except Exception as e:
         print(f"Error en chat: {e}")
         return {
-            "respuesta": "Lo siento, hubo un error procesando tu consulta."
+            "respuesta": "Lo siento, hubo un error procesando tu consulta.",
+            "session_id": session_id
         }
 
+@app.post("/chat/comparar", response_model=ChatResponse)
+async def chat_comparar(request: CompareRequest, http_request: Request):
+    """
+    Misma pregunta para varias organizaciones (o todas las de un país) en una sola
+    respuesta comparativa. Pasa por los mismos límites que /chat.
+    """
+    organizaciones = list(request.organizaciones or [])
+    if request.pais:
+        if request.pais not in ORGANIZACIONES:
+            raise HTTPException(status_code=404, detail=f"País desconocido: {request.pais}")
+        organizaciones += [org['nombre'] for org in ORGANIZACIONES[request.pais]]
+    organizaciones = list(dict.fromkeys(organizaciones))
+    if len(organizaciones) < 2:
+        raise HTTPException(status_code=400, detail="Se necesitan al menos dos organizaciones para comparar.")
+    if len(organizaciones) > COMPARE_MAX_ORGS:
+        raise HTTPException(status_code=400,
+                            detail=f"Se pueden comparar hasta {COMPARE_MAX_ORGS} organizaciones a la vez.")
+    if request.modo and request.modo not in ANSWER_MODES:
+        raise HTTPException(status_code=400, detail=f"modo debe ser uno de: {', '.join(ANSWER_MODES)}")
+    try:
+        respuesta = await chat_admission.run(
+            http_request, answer_comparison, organizaciones, request.mensaje,
+            degrade=LLM_DEGRADE_WHEN_SATURATED, modo=request.modo,
+        )
+        return {"respuesta": respuesta}
+
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+    except (ClientDisconnected, RequestCancelled):
+        return Response(status_code=499)
+    except Exception as e:
+        print(f"Error en comparación: {e}")
+        return {"respuesta": "Lo siento, hubo un error procesando tu consulta."}
+
+@app.post("/chat/batch")
+def chat_batch(request: BatchChatRequest):
+    """
+    Chat RAG por lotes para evaluaciones y reportes.
+    Devuelve NDJSON: una línea por pregunta a medida que se completa,
+    con el índice original para reordenar del lado del cliente.
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El lote excede el máximo de {BATCH_MAX_ITEMS} preguntas."
+        )
+
+    if not _batch_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=429,
+            detail="Ya hay lotes en proceso. Intente de nuevo más tarde.",
+            headers={"Retry-After": "30"},
+        )
+
+    items = [(item.organizacion, item.mensaje) for item in request.items]
+
+    def stream():
+        results = answer_batch(items, concurrency=request.concurrencia)
+        try:
+            yield ""
+            for result in results:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            # Cliente desconectado: cerrar el lote cancela lo pendiente sin esperarlo
+            results.close()
+            _batch_slots.release()
+
+    # Arrancar el generador aquí: si la respuesta nunca se envía, al descartarlo
+    # se ejecuta su finally y el lugar se libera igual
+    body = stream()
+    next(body)
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+
+@app.get("/debug/admission")
+def estado_admision():
+    """Estado de los límites de /chat, del presupuesto del LLM, del planificador de niveles y del registro de consultas"""
+    from query_log import query_log
+    from tier_planner import planner_stats
+    return {"chat": chat_admission.stats(), "llm": llm_stats(), "recuperacion": planner_stats.stats(),
+            "registro": query_log.stats()}
+
+
+@app.get("/debug/memory")
+def estado_memoria():
+    """Memoria residente de este proceso por componente (modelo, índices, cachés)"""
+    return memory_report()
 
 
 @app.post("/insight-territorial")
 def obtener_insight_territorial(request: TerritorialInsightRequest):
-    """Genera un insight territorial para coordenadas específicas"""
-    contexto_ubicacion = f"Coordenadas: {request.lat}, {request.lng}"
-    if request.nombre_ubicacion:
-        contexto_ubicacion += f", Ubicación: {request.nombre_ubicacion}"
-    return {
-        "respuesta": (
-            f"**Análisis Territorial** - {contexto_ubicacion}\n\n"
-            "**Amenazas principales:** Deforestación, expansión agrícola no sostenible, cambio climático.\n\n"
-            "**Servicios ecosistémicos clave:** Regulación hídrica, captura de carbono, conservación de biodiversidad.\n\n"
-            "**Medios de vida más afectados:** Agricultura familiar, turismo comunitario, pesca artesanal.\n\n"
-            "**Conflictos presentes:** Uso de suelo, acceso al agua, tenencia de tierra.\n\n"
-            "**Soluciones Basadas en Naturaleza sugeridas:** Agroforestería, restauración de riberas, corredores biológicos.\n\n"
-            "**Por qué importa esta zona:** Corredor biológico crítico para la conectividad de ecosistemas en la región."
-        )
-    }
+    """
+    Genera un insight territorial para coordenadas específicas.
+    Busca organizaciones y documentos cercanos en el índice espacial y devuelve
+    el insight precalculado de la celda (ver territorial.py precompute).
+    """
+    return get_territorial_engine().insight(request.lat, request.lng, request.nombre_ubicacion)
@@ -0,0 +1,101 @@
+"""
+Migra la colección única original de chroma_db/ a colecciones por organización.
+
+Copia ids, embeddings, textos y metadatos tal cual (no re-embebe nada) a la
+colección de cada fragmento según su scope/org_id, y luego elimina la colección
+original. Es idempotente: se puede volver a ejecutar si se interrumpe.
+
+Uso:
+    python migrate_shards.py               # migrar y eliminar la colección original
+    python migrate_shards.py --dry-run     # solo mostrar cuántos fragmentos van a cada colección
+    python migrate_shards.py --keep-legacy # migrar sin eliminar la original
+"""
+import argparse
+import os
+from typing import Dict
+
+from shards import (LEGACY_COLLECTION, collection_metadata_for, has_legacy_collection,
+                    shard_for_metadata)
+
+DB_DIR = os.getenv("CHROMA_DB_DIR")
+if not DB_DIR:
+    DB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db"))
+
+
+def migrate_legacy_collection(db_dir: str = DB_DIR, keep_legacy: bool = False,
+                              dry_run: bool = False, batch_size: int = 500) -> Dict[str, int]:
+    """Reparte la colección original en colecciones por organización; devuelve conteos por colección"""
+    import chromadb
+
+    client = chromadb.PersistentClient(path=db_dir)
+    if not has_legacy_collection(client):
+        print("✅ No hay colección original que migrar.")
+        return {}
+
+    legacy = client.get_collection(LEGACY_COLLECTION)
+    total = legacy.count()
+    print(f"🔄 Migrando {total} fragmentos de '{LEGACY_COLLECTION}' a colecciones por organización...")
+
+    counts: Dict[str, int] = {}
+    collections = {}
+    offset = 0
+    while offset < total:
+        batch = legacy.get(limit=batch_size, offset=offset,
+                           include=["embeddings", "documents", "metadatas"])
+        if not batch["ids"]:
+            break
+
+        groups: Dict[str, Dict[str, list]] = {}
+        for i, chunk_id in enumerate(batch["ids"]):
+            metadata = batch["metadatas"][i] or {}
+            name = shard_for_metadata(metadata)
+            group = groups.setdefault(name, {
+                "ids": [], "embeddings": [], "documents": [], "metadatas": [],
+                "scope": metadata.get("scope", "global"), "org_id": metadata.get("org_id", "UNKNOWN"),
+            })
+            group["ids"].append(chunk_id)
+            group["embeddings"].append(batch["embeddings"][i])
+            group["documents"].append(batch["documents"][i])
+            group["metadatas"].append(metadata)
+
+        for name, group in groups.items():
+            counts[name] = counts.get(name, 0) + len(group["ids"])
+            if dry_run:
+                continue
+            if name not in collections:
+                collections[name] = client.get_or_create_collection(
+                    name, metadata=collection_metadata_for(group["scope"], group["org_id"])
+                )
+            collections[name].upsert(
+                ids=group["ids"],
+                embeddings=group["embeddings"],
+                documents=group["documents"],
+                metadatas=group["metadatas"],
+            )
+
+        offset += len(batch["ids"])
+
+    for name, count in sorted(counts.items()):
+        print(f"   {name}: {count} fragmentos")
+
+    if dry_run:
+        print("ℹ️ Dry-run: no se escribió nada.")
+    elif keep_legacy:
+        print(f"✅ Migración completa. Colección '{LEGACY_COLLECTION}' conservada.")
+    else:
+        client.delete_collection(LEGACY_COLLECTION)
+        print(f"✅ Migración completa. Colección '{LEGACY_COLLECTION}' eliminada.")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrar chroma_db a colecciones por organización")
+    parser.add_argument("--db-dir", default=DB_DIR)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--keep-legacy", action="store_true")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🔄 Migración a colecciones por organización")
+    print("=" * 60)
+    migrate_legacy_collection(args.db_dir, keep_legacy=args.keep_legacy, dry_run=args.dry_run)
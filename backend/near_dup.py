@@ -0,0 +1,435 @@
+"""
+Detección de fragmentos casi duplicados en la ingesta (MinHash + LSH).
+
+Los mismos manuales y anexos globales se copian en varias carpetas
+documents/orgs/<ORG>/ y las versiones revisadas (_correcciones, _rev_...)
+conviven con los originales. Antes de embeber, cada fragmento se resume en una
+firma MinHash de sus trigramas de palabras; LSH (bandas de la firma) encuentra
+en tiempo constante los fragmentos ya indexados con similitud de Jaccard
+estimada >= NEAR_DUP_THRESHOLD:
+- en la misma colección, el fragmento no se guarda: el que ya existe recibe la
+  referencia (metadato alias_sources, "archivo (p. N); ...") y no ocupa otro
+  vector ni otro texto en el índice;
+- en otra colección (otra organización o global), se guarda para que la
+  búsqueda de esa organización lo encuentre, pero con el embedding copiado del
+  existente (sin pasar por el modelo) y el metadato dup_of; search_tiered no
+  devuelve en Tier 2 lo que ya está en Tier 1.
+
+Las firmas y los alias viven en near_dup/ junto a las colecciones (se copian con
+cada generación). Si no existe, se arma con los fragmentos ya indexados. Entre
+un guardado y otro, ingest.py anota los cambios de cada archivo terminado en
+near_dup/journal.jsonl (ver ingest_journal.py), que se aplica al cargar.
+
+Uso:
+    python near_dup.py report    # alias registrados y lo que ahorran
+    python near_dup.py scan      # casi duplicados que siguen guardados (ahorro de un ingest --force)
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "1").lower() in ("1", "true", "yes")
+# Jaccard estimado mínimo entre los trigramas de dos fragmentos
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.85"))
+NEAR_DUP_PERMUTATIONS = int(os.getenv("NEAR_DUP_PERMUTATIONS", "64"))
+# Bandas de LSH: con 64 permutaciones en 16 bandas de 4, un par con Jaccard 0.85
+# comparte alguna banda con probabilidad > 0.999; los candidatos se verifican
+NEAR_DUP_BANDS = int(os.getenv("NEAR_DUP_BANDS", "16"))
+# Fragmentos más cortos (encabezados, listas...) solo se deduplican si son idénticos
+NEAR_DUP_MIN_WORDS = int(os.getenv("NEAR_DUP_MIN_WORDS", "20"))
+SHINGLE_WORDS = 3
+NEAR_DUP_SUBDIR = "near_dup"
+NEAR_DUP_JOURNAL = "journal.jsonl"
+
+_PRIME = (1 << 31) - 1
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def near_dup_path(index_dir: str) -> str:
+    return os.path.join(index_dir, NEAR_DUP_SUBDIR)
+
+
+class MinHasher:
+    """Firmas MinHash de los trigramas de palabras de un texto (permutaciones a*x + b mod p)"""
+
+    def __init__(self, permutations: int = NEAR_DUP_PERMUTATIONS, seed: int = 7):
+        rng = np.random.RandomState(seed)
+        self.permutations = permutations
+        self.a = rng.randint(1, _PRIME, size=(permutations, 1), dtype=np.int64)
+        self.b = rng.randint(0, _PRIME, size=(permutations, 1), dtype=np.int64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """None si el texto no tiene palabras"""
+        from rag_processor import fold_accents
+
+        words = _WORD_RE.findall(fold_accents(text or ""))
+        if not words:
+            return None
+        if len(words) < max(NEAR_DUP_MIN_WORDS, SHINGLE_WORDS):
+            # Firma constante: similitud 1 con el mismo texto y ~0 con cualquier otro
+            return np.full(self.permutations, zlib.crc32(" ".join(words).encode("utf-8")), dtype=np.uint32)
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.int64,
+                             count=len(shingles)) % _PRIME
+        return ((self.a * hashes[None, :] + self.b) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard estimado: fracción de posiciones iguales de dos firmas"""
+    return float(np.mean(a == b))
+
+
+class NearDupIndex:
+    """Firmas de los fragmentos guardados (por id y colección), buckets LSH y alias"""
+
+    def __init__(self, hasher: Optional[MinHasher] = None, threshold: float = NEAR_DUP_THRESHOLD,
+                 bands: int = NEAR_DUP_BANDS):
+        self.hasher = hasher or MinHasher()
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = self.hasher.permutations // bands
+        self.ids: List[str] = []
+        self.collections: List[str] = []
+        self.sources: List[str] = []
+        self.signatures: List[np.ndarray] = []
+        self.alive: List[bool] = []
+        self._buckets: Dict[tuple, List[int]] = {}
+        self._by_source: Dict[tuple, List[int]] = {}
+        # id del fragmento guardado -> referencias que no se guardaron
+        # [{"collection", "source", "full_path", "page", "bytes" (del texto)}]
+        self.aliases: Dict[str, List[Dict[str, Any]]] = {}
+        # Bytes de un embedding float32 (los que tampoco ocupa cada alias)
+        self.vector_bytes = 0
+        # Cambios desde el último flush_journal()
+        self._journal: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return sum(self.alive)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, chunk_id: str, collection: str, source: str, signature: np.ndarray):
+        position = len(self.ids)
+        self.ids.append(chunk_id)
+        self.collections.append(collection)
+        self.sources.append(source)
+        self.signatures.append(signature)
+        self.alive.append(True)
+        self._by_source.setdefault((collection, source), []).append(position)
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(position)
+        self._journal.append({"op": "add", "id": chunk_id, "collection": collection, "source": source,
+                              "signature": signature.tolist()})
+
+    def find(self, signature: np.ndarray, collection: str) -> Optional[Dict[str, Any]]:
+        """
+        Fragmento guardado más parecido con similitud >= umbral; si hay uno en la
+        misma colección se prefiere (se puede usar como alias sin guardar nada)
+        """
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_rank = None, None
+        for position in candidates:
+            if not self.alive[position]:
+                continue
+            score = similarity(signature, self.signatures[position])
+            if score < self.threshold:
+                continue
+            rank = (self.collections[position] == collection, score)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = position, rank
+        if best is None:
+            return None
+        return {"id": self.ids[best], "collection": self.collections[best],
+                "source": self.sources[best], "similarity": best_rank[1]}
+
+    def add_alias(self, canonical_id: str, reference: Dict[str, Any]):
+        self.aliases.setdefault(canonical_id, []).append(reference)
+        self._journal.append({"op": "alias", "id": canonical_id, "reference": reference})
+
+    def alias_label(self, canonical_id: str) -> Optional[str]:
+        """Valor del metadato alias_sources ("archivo (p. N); ..."), None si ya no tiene alias"""
+        references = self.aliases.get(canonical_id)
+        if not references:
+            return None
+        return "; ".join(dict.fromkeys(f"{r['source']} (p. {r['page']})" for r in references))
+
+    def dependents(self, collection: str, source: str) -> Set[str]:
+        """
+        Archivos (full_path) con fragmentos que son alias de fragmentos de este
+        archivo: si este se reprocesa, sus fragmentos se borran y los alias quedan
+        sin texto, así que también hay que reprocesarlos
+        """
+        own = {self.ids[p] for p in self._by_source.get((collection, source), ()) if self.alive[p]}
+        return {r["full_path"] for chunk_id in own for r in self.aliases.get(chunk_id, ())
+                if r["source"] != source}
+
+    def remove_source(self, collection: str, source: str) -> Set[str]:
+        """
+        Olvida los fragmentos y alias de un archivo (antes de reprocesarlo).
+        Devuelve los ids de fragmentos guardados cuyo alias_sources cambió.
+        """
+        self._journal.append({"op": "remove", "collection": collection, "source": source})
+        for p in self._by_source.pop((collection, source), ()):
+            self.alive[p] = False
+            self.aliases.pop(self.ids[p], None)
+        changed = set()
+        for chunk_id, references in list(self.aliases.items()):
+            kept = [r for r in references if not (r["collection"] == collection and r["source"] == source)]
+            if len(kept) != len(references):
+                changed.add(chunk_id)
+                if kept:
+                    self.aliases[chunk_id] = kept
+                else:
+                    del self.aliases[chunk_id]
+        return changed
+
+    def savings(self) -> Dict[str, Any]:
+        """Alias registrados y bytes que no ocupan en el índice (texto + vector)"""
+        by_collection: Dict[str, int] = {}
+        total_bytes = 0
+        for references in self.aliases.values():
+            for r in references:
+                by_collection[r["collection"]] = by_collection.get(r["collection"], 0) + 1
+                total_bytes += r.get("bytes", 0) + self.vector_bytes
+        return {"fragmentos_guardados": len(self), "alias": sum(by_collection.values()),
+                "mb_ahorrados": round(total_bytes / 1024 / 1024, 2), "alias_por_coleccion": by_collection}
+
+    def flush_journal(self, path: str):
+        """
+        Anota en una línea de near_dup/journal.jsonl (con fsync) los cambios desde
+        el último flush; una línea a medio escribir se ignora al cargar
+        """
+        if not self._journal:
+            return
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, NEAR_DUP_JOURNAL), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ops": self._journal, "vector_bytes": self.vector_bytes}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal = []
+
+    def _replay(self, path: str):
+        try:
+            with open(os.path.join(path, NEAR_DUP_JOURNAL), "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            for op in entry["ops"]:
+                if op["op"] == "add":
+                    self.add(op["id"], op["collection"], op["source"], np.asarray(op["signature"], dtype=np.uint32))
+                elif op["op"] == "alias":
+                    self.add_alias(op["id"], op["reference"])
+                else:
+                    self.remove_source(op["collection"], op["source"])
+            self.vector_bytes = entry.get("vector_bytes", self.vector_bytes)
+
+    def save(self, path: str):
+        """Compacta (sin fragmentos borrados) y guarda de forma atómica (sin diario)"""
+        live = [p for p in range(len(self.ids)) if self.alive[p]]
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        signatures = (np.vstack([self.signatures[p] for p in live]) if live
+                      else np.zeros((0, self.hasher.permutations), dtype=np.uint32))
+        np.save(os.path.join(tmp_path, "signatures.npy"), signatures)
+        with open(os.path.join(tmp_path, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "permutations": self.hasher.permutations, "bands": self.bands, "shingle_words": SHINGLE_WORDS,
+                "ids": [self.ids[p] for p in live],
+                "collections": [self.collections[p] for p in live],
+                "sources": [self.sources[p] for p in live],
+                "aliases": self.aliases, "vector_bytes": self.vector_bytes,
+            }, f, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        # Lo pendiente ya está en el guardado (y el diario anterior se borró con la carpeta)
+        self._journal = []
+
+    @classmethod
+    def load(cls, path: str) -> Optional["NearDupIndex"]:
+        """None si no existe o se guardó con otros parámetros de MinHash"""
+        try:
+            with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        if (data["permutations"], data["bands"], data["shingle_words"]) != (
+                NEAR_DUP_PERMUTATIONS, NEAR_DUP_BANDS, SHINGLE_WORDS):
+            return None
+        index = cls()
+        signatures = np.load(os.path.join(path, "signatures.npy"))
+        for chunk_id, collection, source, signature in zip(data["ids"], data["collections"],
+                                                           data["sources"], signatures):
+            index.add(chunk_id, collection, source, signature)
+        index.aliases = data["aliases"]
+        index.vector_bytes = data.get("vector_bytes", 0)
+        index._replay(path)
+        index._journal = []
+        return index
+
+    @classmethod
+    def from_client(cls, client, page_size: int = 5000) -> "NearDupIndex":
+        """Firmas de todos los fragmentos ya guardados en las colecciones (sin alias)"""
+        from shards import list_shards
+
+        index = cls()
+        for name in list_shards(client).values():
+            collection = client.get_collection(name)
+            offset = 0
+            while True:
+                batch = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+                if not batch["ids"]:
+                    break
+                offset += len(batch["ids"])
+                for chunk_id, text, meta in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                    signature = index.hasher.signature(text)
+                    if signature is not None:
+                        index.add(chunk_id, name, (meta or {}).get("source", ""), signature)
+        index._journal = []
+        return index
+
+
+def open_near_dup_index(index_dir: str, client) -> NearDupIndex:
+    """Índice guardado en index_dir, o uno nuevo con los fragmentos que ya tiene Chroma"""
+    index = NearDupIndex.load(near_dup_path(index_dir))
+    if index is None:
+        start = time.perf_counter()
+        index = NearDupIndex.from_client(client)
+        print(f"   🧬 Firmas MinHash de {len(index)} fragmentos existentes ({time.perf_counter() - start:.1f}s)")
+        # Se guarda ya: el diario de la ingesta se aplica sobre esta versión
+        index.save(near_dup_path(index_dir))
+    return index
+
+
+def refresh_alias_metadata(collection, index: NearDupIndex, chunk_ids: Set[str]):
+    """Actualiza alias_sources de fragmentos guardados (None lo elimina del metadato)"""
+    existing = collection.get(ids=list(chunk_ids), include=[])["ids"]
+    if existing:
+        collection.update(ids=existing, metadatas=[{"alias_sources": index.alias_label(i)} for i in existing])
+
+
+def add_deduplicated_chunks(store, collection_name: str, chunks: List[Any], index: NearDupIndex,
+               embed, client) -> Dict[str, float]:
+    """
+    Reemplaza a store.add_documents(chunks): omite los casi duplicados de la misma
+    colección (como alias), copia el embedding de los de otra colección y embebe
+    el resto. Devuelve los contadores de la ingesta del archivo.
+    """
+    collection = store._collection
+    ids, texts, metadatas = [], [], []
+    copy_from: Dict[str, List[tuple]] = {}
+    aliased: Set[str] = set()
+    stats = {"fragmentos": len(chunks), "alias": 0, "copiados": 0, "embebidos": 0,
+             "embed_s": 0.0, "bytes_alias": 0}
+
+    for chunk in chunks:
+        meta = dict(chunk.metadata)
+        signature = index.hasher.signature(chunk.page_content)
+        match = index.find(signature, collection_name) if signature is not None else None
+        if match and match["collection"] == collection_name:
+            text_bytes = len(chunk.page_content.encode("utf-8"))
+            index.add_alias(match["id"], {"collection": collection_name, "source": meta.get("source"),
+                                          "full_path": meta.get("full_path"), "page": meta.get("page"),
+                                          "bytes": text_bytes})
+            aliased.add(match["id"])
+            stats["alias"] += 1
+            stats["bytes_alias"] += text_bytes
+            continue
+        chunk_id = str(uuid.uuid4())
+        if match:
+            meta["dup_of"] = match["id"]
+            copy_from.setdefault(match["collection"], []).append((len(ids), match["id"]))
+        ids.append(chunk_id)
+        texts.append(chunk.page_content)
+        metadatas.append(meta)
+        if signature is not None:
+            index.add(chunk_id, collection_name, meta.get("source", ""), signature)
+
+    embeddings: List[Optional[List[float]]] = [None] * len(ids)
+    for other, pairs in copy_from.items():
+        found = client.get_collection(other).get(ids=[canonical for _, canonical in pairs], include=["embeddings"])
+        vectors = dict(zip(found["ids"], found["embeddings"]))
+        for position, canonical in pairs:
+            if canonical in vectors:
+                embeddings[position] = list(vectors[canonical])
+                stats["copiados"] += 1
+
+    pending = [i for i, vector in enumerate(embeddings) if vector is None]
+    if pending:
+        start = time.perf_counter()
+        for i, vector in zip(pending, embed([texts[i] for i in pending])):
+            embeddings[i] = vector
+        stats["embed_s"] = time.perf_counter() - start
+        stats["embebidos"] = len(pending)
+    if ids:
+        index.vector_bytes = len(embeddings[0]) * 4
+        collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+    if aliased:
+        refresh_alias_metadata(collection, index, aliased)
+    # Cada alias tampoco ocupa su vector
+    stats["bytes_alias"] += stats["alias"] * index.vector_bytes
+    return stats
+
+
+def print_dedup_report(totals: Dict[str, float]):
+    """Resumen de la ingesta: fragmentos omitidos/copiados y tiempo de embedding ahorrado"""
+    if not totals.get("fragmentos"):
+        return
+    avoided = totals["alias"] + totals["copiados"]
+    per_chunk = totals["embed_s"] / totals["embebidos"] if totals["embebidos"] else 0.0
+    print(f"🧬 Casi duplicados: {totals['alias']} alias (no guardados) y {totals['copiados']} "
+          f"con embedding copiado de {totals['fragmentos']} fragmentos "
+          f"({100.0 * avoided / totals['fragmentos']:.1f}% sin embeber)")
+    print(f"   Ahorro estimado: {totals['bytes_alias'] / 1024 / 1024:.2f} MB de índice, "
+          f"{avoided * per_chunk:.1f}s de embedding")
+
+
+if __name__ == "__main__":
+    import chromadb
+    from generations import DB_DIR, resolve_index_dir
+
+    parser = argparse.ArgumentParser(description="Fragmentos casi duplicados (MinHash + LSH)")
+    parser.add_argument("--db-dir", default=DB_DIR)
+    parser.add_argument("comando", choices=["report", "scan"])
+    args = parser.parse_args()
+
+    index_dir = resolve_index_dir(args.db_dir)
+    client = chromadb.PersistentClient(path=index_dir)
+    if args.comando == "report":
+        index = NearDupIndex.load(near_dup_path(index_dir))
+        if index is None:
+            print("⚠️ No hay índice de casi duplicados (se crea en la próxima ingesta).")
+        else:
+            print(json.dumps(index.savings(), indent=2, ensure_ascii=False))
+    else:
+        # Fragmentos guardados que un ingest --force dejaría como alias o copias
+        stored = NearDupIndex.from_client(client)
+        seen = NearDupIndex()
+        same, other = 0, 0
+        for chunk_id, collection, source, signature in zip(stored.ids, stored.collections,
+                                                           stored.sources, stored.signatures):
+            match = seen.find(signature, collection)
+            if match and match["collection"] == collection:
+                same += 1
+                continue
+            other += bool(match)
+            seen.add(chunk_id, collection, source, signature)
+        print(f"🔍 {len(stored)} fragmentos con firma: {same} casi duplicados en la misma colección "
+              f"(se omitirían), {other} en otra colección (embedding copiado)")
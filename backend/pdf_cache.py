@@ -0,0 +1,180 @@
+"""
+Caché del texto extraído de los PDFs.
+
+Cada PDF se guarda como JSON comprimido (gzip) con el texto y los metadatos de
+cada página, indexado por el hash MD5 del contenido del archivo (el mismo del
+manifest de ingest.py) y la versión del extractor. Re-chunkear o re-embeber no
+vuelve a parsear ningún PDF; cambiar de versión de PyMuPDF o de EXTRACTOR_REVISION
+invalida las entradas automáticamente.
+
+Uso:
+    python pdf_cache.py stats    # tamaño de la caché y entradas huérfanas
+    python pdf_cache.py prune    # eliminar entradas de PDFs que ya no están en documents/
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+DOCS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "documents"))
+DB_DIR = os.getenv("CHROMA_DB_DIR")
+if not DB_DIR:
+    DB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db"))
+
+# Junto a chroma_db para que persista en el volumen de Docker
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR") or os.path.join(DB_DIR, "pdf_cache")
+
+# Subir si cambia la forma de extraer (opciones del loader, limpieza del texto...)
+EXTRACTOR_REVISION = 1
+CACHE_SUFFIX = ".json.gz"
+
+
+def extractor_version() -> str:
+    try:
+        import pymupdf
+    except ImportError:  # PyMuPDF < 1.24 solo expone el módulo fitz
+        import fitz as pymupdf
+    return f"pymupdf-{pymupdf.VersionBind}-r{EXTRACTOR_REVISION}"
+
+
+def calculate_file_hash(file_path: str) -> str:
+    """MD5 del contenido (el hash que guarda el manifest de ingest.py)"""
+    hash_md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
+def _entry_path(file_hash: str, version: str, cache_dir: str = PDF_CACHE_DIR) -> str:
+    return os.path.join(cache_dir, f"{file_hash}.{version}{CACHE_SUFFIX}")
+
+
+def _parse_entry_name(name: str):
+    """'<hash>.<versión>.json.gz' -> (hash, versión)"""
+    file_hash, _, version = name[:-len(CACHE_SUFFIX)].partition(".")
+    return file_hash, version
+
+
+def load_pdf_pages(file_path: str, file_hash: Optional[str] = None, cache_dir: str = PDF_CACHE_DIR):
+    """
+    Páginas del PDF como Documents de LangChain (igual que PyMuPDFLoader.load()),
+    leídas de la caché si el archivo ya se extrajo con esta versión del extractor.
+    """
+    from langchain_core.documents import Document
+
+    file_hash = file_hash or calculate_file_hash(file_path)
+    version = extractor_version()
+    path = _entry_path(file_hash, version, cache_dir)
+
+    if os.path.exists(path):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            # El mismo contenido puede estar en otra ruta (copia o renombre)
+            return [
+                Document(page_content=page["text"],
+                         metadata={**page["metadata"], "source": file_path, "file_path": file_path})
+                for page in entry["pages"]
+            ]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"   ⚠️ Entrada de caché ilegible para {os.path.basename(file_path)}: {e}")
+
+    from langchain_community.document_loaders import PyMuPDFLoader
+    docs = PyMuPDFLoader(file_path).load()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = {
+        "extractor": version,
+        "file_hash": file_hash,
+        "file_path": file_path,
+        "pages": [{"text": d.page_content, "metadata": d.metadata} for d in docs],
+    }
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return docs
+
+
+def _document_hashes(docs_dir: str = DOCS_DIR) -> Dict[str, str]:
+    """{hash: ruta} de todos los PDFs bajo documents/"""
+    hashes = {}
+    for root, _, files in os.walk(docs_dir):
+        for name in files:
+            if name.lower().endswith(".pdf"):
+                path = os.path.join(root, name)
+                hashes[calculate_file_hash(path)] = path
+    return hashes
+
+
+def scan_cache(cache_dir: str = PDF_CACHE_DIR, docs_dir: str = DOCS_DIR) -> List[Dict]:
+    """Entradas de la caché con su tamaño y si siguen vigentes"""
+    if not os.path.isdir(cache_dir):
+        return []
+    current = _document_hashes(docs_dir)
+    version = extractor_version()
+    entries = []
+    for name in sorted(os.listdir(cache_dir)):
+        if not name.endswith(CACHE_SUFFIX):
+            continue
+        file_hash, entry_version = _parse_entry_name(name)
+        if entry_version != version:
+            status = "versión antigua"
+        elif file_hash not in current:
+            status = "huérfana"
+        else:
+            status = "vigente"
+        entries.append({
+            "path": os.path.join(cache_dir, name),
+            "hash": file_hash,
+            "size": os.path.getsize(os.path.join(cache_dir, name)),
+            "status": status,
+            "source": current.get(file_hash),
+        })
+    return entries
+
+
+def print_stats(cache_dir: str = PDF_CACHE_DIR, docs_dir: str = DOCS_DIR):
+    entries = scan_cache(cache_dir, docs_dir)
+    print(f"📁 Caché: {cache_dir}")
+    print(f"   Extractor: {extractor_version()}")
+    total = sum(e["size"] for e in entries)
+    print(f"   {len(entries)} entradas, {total / 1024 / 1024:.1f} MB")
+    for status in ("vigente", "huérfana", "versión antigua"):
+        group = [e for e in entries if e["status"] == status]
+        if group:
+            size = sum(e["size"] for e in group) / 1024 / 1024
+            print(f"   - {status}: {len(group)} ({size:.1f} MB)")
+
+
+def prune(cache_dir: str = PDF_CACHE_DIR, docs_dir: str = DOCS_DIR, dry_run: bool = False) -> int:
+    """Elimina entradas de PDFs que ya no están en documents/ o de otra versión del extractor"""
+    removed = 0
+    freed = 0
+    for entry in scan_cache(cache_dir, docs_dir):
+        if entry["status"] == "vigente":
+            continue
+        if not dry_run:
+            os.remove(entry["path"])
+        removed += 1
+        freed += entry["size"]
+    action = "Se eliminarían" if dry_run else "Eliminadas"
+    print(f"🧹 {action} {removed} entradas ({freed / 1024 / 1024:.1f} MB)")
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caché de texto extraído de PDFs")
+    parser.add_argument("comando", choices=["stats", "prune"])
+    parser.add_argument("--cache-dir", default=PDF_CACHE_DIR)
+    parser.add_argument("--docs-dir", default=DOCS_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="prune: solo mostrar qué se eliminaría")
+    args = parser.parse_args()
+
+    if args.comando == "stats":
+        print_stats(args.cache_dir, args.docs_dir)
+    else:
+        prune(args.cache_dir, args.docs_dir, dry_run=args.dry_run)
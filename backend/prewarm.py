@@ -0,0 +1,128 @@
+"""
+Precalentamiento de cachés con las preguntas frecuentes de cada organización.
+
+Tras un despliegue o una generación nueva del índice, las primeras consultas de
+cada organización encuentran las cachés vacías: embedding, recuperación y la
+latencia completa del LLM. prewarm() pasa por el camino completo de /chat
+(answer_question) las preguntas de PREGUNTAS_COMUNES y las "preguntas" de cada
+organización de ORGANIZACIONES (main.py), con PREWARM_CONCURRENCY a la vez para
+no quitarle el LLM al tráfico real. Así quedan en caché los embeddings de las
+consultas, los fragmentos recuperados y las respuestas (ver chat_service.py).
+
+Se ejecuta en segundo plano:
+- en cada worker apenas el índice está listo (serve.py, PREWARM_ON_START);
+- cuando se activa otra generación: la recuperación se calienta sobre el índice
+  nuevo antes de empezar a usarlo y las respuestas justo después.
+
+Por defecto solo se calientan embeddings y recuperación. Las cachés son por
+proceso: con PREWARM_ANSWERS=1 cada worker pide sus respuestas al LLM
+(preguntas × workers llamadas por despliegue).
+
+Uso:
+    python prewarm.py --list
+    python prewarm.py --concurrency 4        # en este proceso, con tiempos en frío y en caliente
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+PREWARM_ON_START = os.getenv("PREWARM_ON_START", "1").lower() not in ("0", "false", "no")
+# 1 = también las respuestas (llamadas al LLM en cada worker)
+PREWARM_ANSWERS = os.getenv("PREWARM_ANSWERS", "0").lower() not in ("0", "false", "no")
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "2"))
+
+# Se hacen para todas las organizaciones, además de las propias
+PREGUNTAS_COMUNES = [
+    "¿Cuál es la misión de la organización?",
+    "¿Qué proyectos desarrolla la organización?",
+]
+
+_questions: List[Tuple[str, str]] = []
+_running = threading.Lock()
+
+
+def set_questions(organizaciones: Dict[str, List[Dict[str, Any]]]):
+    """Registra las preguntas de ORGANIZACIONES (main.py las pasa al importarse)"""
+    global _questions
+    items = []
+    for orgs in organizaciones.values():
+        for org in orgs:
+            for pregunta in PREGUNTAS_COMUNES + org.get("preguntas", []):
+                items.append((org["nombre"], pregunta))
+    _questions = list(dict.fromkeys(items))
+
+
+def questions() -> List[Tuple[str, str]]:
+    return list(_questions)
+
+
+def prewarm(items: Optional[List[Tuple[str, str]]] = None, concurrency: int = PREWARM_CONCURRENCY,
+            answers: bool = PREWARM_ANSWERS, rag=None) -> Dict[str, Any]:
+    """
+    Pasa las preguntas por la recuperación y, con answers, por la respuesta completa.
+    rag: índice que todavía no se está usando (recarga de generación): solo se
+    calienta su recuperación. Devuelve conteos y duración.
+    """
+    import chat_service
+
+    items = questions() if items is None else items
+    if not items:
+        return {"preguntas": 0}
+    if not _running.acquire(blocking=False):
+        print("⏭️ Precalentamiento ya en curso")
+        return {"preguntas": 0, "omitido": True}
+    full = answers and rag is None
+    target = rag or chat_service.get_rag()
+    errors = 0
+
+    def warm(item: Tuple[str, str]):
+        organizacion, pregunta = item
+        if full:
+            chat_service.answer_question(organizacion, pregunta, trace={})
+        else:
+            target.search_tiered(pregunta, org_id=chat_service.tier1_org_id(organizacion))
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="prewarm") as pool:
+            for future in [pool.submit(warm, item) for item in items]:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors += 1
+                    print(f"⚠️ Precalentamiento: {e}")
+    finally:
+        _running.release()
+    seconds = time.perf_counter() - start
+    stage = "respuestas" if full else "recuperación"
+    print(f"🔥 Precalentadas {len(items) - errors}/{len(items)} preguntas ({stage}) en {seconds:.1f}s")
+    return {"preguntas": len(items), "errores": errors, "respuestas": full, "segundos": round(seconds, 2)}
+
+
+def start_prewarm():
+    """prewarm() en un hilo de fondo (no bloquea el arranque ni las consultas)"""
+    if PREWARM_ON_START and _questions:
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalentar cachés con las preguntas frecuentes")
+    parser.add_argument("--list", action="store_true", help="Solo mostrar las preguntas")
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+    parser.add_argument("--sin-respuestas", action="store_true", help="Solo embeddings y recuperación")
+    args = parser.parse_args()
+
+    import main  # noqa: F401  (registra las preguntas de ORGANIZACIONES)
+
+    if args.list:
+        for organizacion, pregunta in questions():
+            print(f"{organizacion}: {pregunta}")
+    else:
+        cold = prewarm(concurrency=args.concurrency, answers=not args.sin_respuestas)
+        warm = prewarm(concurrency=args.concurrency, answers=not args.sin_respuestas)
+        if cold.get("segundos"):
+            print(f"En frío {cold['segundos']}s, en caliente {warm['segundos']}s "
+                  f"({cold['preguntas']} preguntas)")
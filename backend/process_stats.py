@@ -0,0 +1,57 @@
+"""
+Estadísticas de memoria de procesos (Linux /proc).
+
+RSS cuenta completas las páginas compartidas copy-on-write entre workers;
+PSS las reparte entre los procesos que las comparten, así que la suma de PSS
+es la memoria real que ocupan todos los workers.
+"""
+from typing import Dict, List, Union
+
+
+def memory_stats(pid: Union[int, str] = "self") -> Dict[str, int]:
+    """RSS/PSS/compartida/privada de un proceso en kB (vacío si /proc no está disponible)"""
+    stats: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    stats[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        stats["Rss"] = int(line.split()[1])
+        except OSError:
+            return {}
+
+    return {
+        "rss_kb": stats.get("Rss", 0),
+        "pss_kb": stats.get("Pss", 0),
+        "shared_kb": stats.get("Shared_Clean", 0) + stats.get("Shared_Dirty", 0),
+        "private_kb": stats.get("Private_Clean", 0) + stats.get("Private_Dirty", 0),
+        # Memoria no respaldada por archivos (heap de Python, tensores, Chroma); el resto
+        # del RSS son páginas de archivos mapeados (librerías, índices abiertos con mmap)
+        "anonymous_kb": stats.get("Anonymous", 0),
+    }
+
+
+def child_pids(pid: int) -> List[int]:
+    """PIDs hijos directos de un proceso"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def format_memory_table(rows: Dict[str, Dict[str, int]]) -> str:
+    """Tabla legible de memory_stats() por proceso"""
+    lines = [f"{'proceso':<16}{'RSS MB':>10}{'PSS MB':>10}{'compart. MB':>13}{'privada MB':>12}"]
+    for name, s in rows.items():
+        lines.append(
+            f"{name:<16}{s.get('rss_kb', 0) / 1024:>10.1f}{s.get('pss_kb', 0) / 1024:>10.1f}"
+            f"{s.get('shared_kb', 0) / 1024:>13.1f}{s.get('private_kb', 0) / 1024:>12.1f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,191 @@
+"""
+Registro de consultas de /chat para ajustar el sistema con tráfico real.
+
+Opcional (QUERY_LOG_ENABLED=1) y muestreado (QUERY_LOG_SAMPLE_RATE). Cada consulta
+registrada es una línea JSON en archivos .jsonl.gz de QUERY_LOG_DIR, uno por
+proceso, que rotan al superar QUERY_LOG_MAX_MB (sin comprimir); se conservan los
+QUERY_LOG_MAX_FILES más nuevos. Un hilo aparte escribe, así que /chat no espera
+al disco.
+
+    {"ts", "generacion", "organizacion", "org_id", "mensaje", "consulta", "modo",
+     "sesion", "turno", "fragmentos": {nivel: [chunk_id, ...]},
+     "tiempos_ms": {"embedding", "recuperacion", "respuesta", "total", ...},
+     "caches": {"sesion": ...}, "respuesta": "llm" | "extractiva" | "degradada" | ...}
+
+Privacidad: nunca se guardan la respuesta, la IP ni el session_id (solo un hash
+con sal, para agrupar los turnos de una conversación). Con QUERY_LOG_TEXT:
+- "redactado" (default): correos, URLs, teléfonos y números largos se reemplazan;
+- "completo": el texto tal cual;
+- "hash": solo un hash del texto (esas consultas no se pueden reproducir).
+
+replay_queries.py reproduce un registro contra un índice y compara corridas.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+
+QUERY_LOG_ENABLED = os.getenv("QUERY_LOG_ENABLED", "0").lower() in ("1", "true", "yes")
+QUERY_LOG_SAMPLE_RATE = float(os.getenv("QUERY_LOG_SAMPLE_RATE", "1.0"))
+QUERY_LOG_DIR = os.getenv("QUERY_LOG_DIR") or os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "query_logs"))
+QUERY_LOG_MAX_MB = float(os.getenv("QUERY_LOG_MAX_MB", "50"))
+QUERY_LOG_MAX_FILES = int(os.getenv("QUERY_LOG_MAX_FILES", "20"))
+QUERY_LOG_TEXT = os.getenv("QUERY_LOG_TEXT", "redactado").lower()
+# Sin sal fija, los hashes de sesión solo agrupan turnos dentro de un mismo proceso
+QUERY_LOG_SALT = os.getenv("QUERY_LOG_SALT") or os.urandom(16).hex()
+
+_REDACTIONS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<correo>"),
+    (re.compile(r"https?://\S+|www\.\S+"), "<url>"),
+    (re.compile(r"\+?\d[\d\s().-]{7,}\d"), "<telefono>"),
+    (re.compile(r"\b\d{5,}\b"), "<numero>"),
+]
+
+
+def redact(text: str) -> str:
+    for pattern, placeholder in _REDACTIONS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(f"{QUERY_LOG_SALT}:{text}".encode("utf-8")).hexdigest()[:16]
+
+
+def hash_session(session_id: str) -> str:
+    return _hash(f"sesion:{session_id}")
+
+
+def protect_text(text: Optional[str]) -> Optional[str]:
+    """Texto de la consulta según QUERY_LOG_TEXT"""
+    if text is None or QUERY_LOG_TEXT == "completo":
+        return text
+    if QUERY_LOG_TEXT == "hash":
+        return f"sha256:{_hash(text)}"
+    return redact(text)
+
+
+class QueryLog:
+    """Escritor en segundo plano de archivos .jsonl.gz rotados"""
+
+    def __init__(self, directory: str = QUERY_LOG_DIR, enabled: bool = QUERY_LOG_ENABLED,
+                 sample_rate: float = QUERY_LOG_SAMPLE_RATE, max_mb: float = QUERY_LOG_MAX_MB,
+                 max_files: int = QUERY_LOG_MAX_FILES):
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_files = max_files
+        self._queue: "queue.Queue" = queue.Queue(maxsize=10000)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        self._file = None
+        self._written = 0
+        self.counters = {"registradas": 0, "descartadas": 0, "archivos": 0}
+
+    def sampled(self) -> bool:
+        return self.enabled and random.random() < self.sample_rate
+
+    def record(self, entry: Dict[str, Any]):
+        """Encola una consulta; si la cola está llena se descarta (nunca bloquea /chat)"""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.counters["descartadas"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "activo": self.enabled, "muestreo": self.sample_rate,
+                "pendientes": self._queue.qsize(), "carpeta": self.directory}
+
+    def _ensure_worker(self):
+        # Un archivo y un hilo por proceso (serve.py hace fork de los workers)
+        pid = os.getpid()
+        if self._worker is not None and self._pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._pid == pid and self._worker.is_alive():
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue(maxsize=10000)
+                self._file = None
+            self._pid = pid
+            self._worker = threading.Thread(target=self._run, name="query-log", daemon=True)
+            self._worker.start()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"consultas-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), "wb")
+        self._written = 0
+        self.counters["archivos"] += 1
+        # Se borran los más viejos (de todos los procesos)
+        files = sorted(glob.glob(os.path.join(self.directory, "consultas-*.jsonl.gz")), key=os.path.getmtime)
+        for old in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def _run(self):
+        while True:
+            entries = [self._queue.get()]
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for entry in entries:
+                    if self._file is None or self._written >= self.max_bytes:
+                        if self._file is not None:
+                            self._file.close()
+                        self._open()
+                    line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+                    self._file.write(line)
+                    self._written += len(line)
+                    self.counters["registradas"] += 1
+                # Bloque gzip completo: lo escrito se puede leer aunque el proceso muera
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+            except Exception as e:
+                print(f"⚠️ Registro de consultas: {e}")
+                self._file = None
+
+
+query_log = QueryLog()
+
+
+def log_files(paths: List[str]) -> List[str]:
+    """Archivos de registro dados o dentro de las carpetas dadas, en orden cronológico"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "*.jsonl.gz")) + glob.glob(os.path.join(path, "*.jsonl")))
+        else:
+            files.append(path)
+    return sorted(files, key=lambda f: (os.path.getmtime(f), f))
+
+
+def read_log(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Consultas registradas (.jsonl o .jsonl.gz); tolera el final cortado de un archivo en uso"""
+    for path in log_files(paths):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        break
+            except (EOFError, OSError, zlib.error):
+                continue
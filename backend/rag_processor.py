@@ -2,167 +2,875 @@
 Procesador RAG Híbrido por Niveles (Tiered Hybrid RAG)
 Implementa búsqueda vectorial (Chroma) + palabras clave (BM25)
 y estrategia de recuperación por niveles (Org > Global).
+
+Las dependencias pesadas (LangChain, sentence-transformers/torch, ChromaDB,
+numpy/scipy) se importan al usarse, no al importar el módulo: así main.py arranca y
+sirve los endpoints ligeros sin esperar a cargar la pila de recuperación.
 """
+from __future__ import annotations
+
+import copy
 import os
+import re
 import time
-from typing import List, Optional, Dict, Any
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_community.retrievers import BM25Retriever
-from langchain_core.documents import Document
+import unicodedata
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, Tuple
+from embedding_batcher import EmbeddingBatcher
+from generations import current_generation, generation_path, keyword_index_path
+from shards import list_shards
+from tier_planner import (TIER1_K, TIER1_K_MIN, TIER2_K, TIER2_K_MIN, TIER_PLANNER_ENABLED, adaptive_k,
+                          cosine_similarities, covers_question, known_org_ids, planner_stats)
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import Chroma
+    from langchain_core.documents import Document
 
 # Configuración de DB_DIR
 DB_DIR = os.getenv("CHROMA_DB_DIR")
 if not DB_DIR:
     DB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db"))
 
+# Modo de bajo consumo: modelo en media precisión, índice de palabras clave
+# leído con mmap y cachés más chicas (ver /debug/memory)
+LOW_MEMORY_MODE = os.getenv("LOW_MEMORY_MODE", "0").lower() in ("1", "true", "yes")
+# float16 o bfloat16 (más rápido en CPUs con AVX512-BF16); float32 lo desactiva
+LOW_MEMORY_MODEL_DTYPE = os.getenv("LOW_MEMORY_MODEL_DTYPE", "float16")
+# Topes de las máscaras de filtros de BM25 (una por organización y scope)
+BM25_MASK_CACHE_ITEMS = int(os.getenv("BM25_MASK_CACHE_ITEMS", "32" if LOW_MEMORY_MODE else "256"))
+BM25_MASK_CACHE_MB = float(os.getenv("BM25_MASK_CACHE_MB", "16" if LOW_MEMORY_MODE else "128"))
+# Búsqueda vectorial: candidatos por resultado para MMR y balance relevancia/diversidad
+MMR_FETCH_K_MULTIPLIER = int(os.getenv("MMR_FETCH_K_MULTIPLIER", "4"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.6"))
+# Recuperación en dos etapas (ver doc_summaries.py): documentos que se eligen por
+# nivel antes de buscar fragmentos (0 = desactivada) y mínimo de documentos del
+# nivel para acotar (con menos se busca en Chroma entre todos sus fragmentos)
+DOC_PREFILTER_TOP_N = int(os.getenv("DOC_PREFILTER_TOP_N", "8"))
+DOC_PREFILTER_MIN_DOCS = int(os.getenv("DOC_PREFILTER_MIN_DOCS", "20"))
+# Términos ya reducidos por stem_es
+STEM_CACHE_SIZE = int(os.getenv("STEM_CACHE_SIZE", "20000" if LOW_MEMORY_MODE else "200000"))
+# Embeddings de consultas repetidas y resultados de search_tiered por (organización, consulta)
+QUERY_EMBEDDING_CACHE_ITEMS = int(os.getenv("QUERY_EMBEDDING_CACHE_ITEMS", "500" if LOW_MEMORY_MODE else "5000"))
+RETRIEVAL_CACHE_ITEMS = int(os.getenv("RETRIEVAL_CACHE_ITEMS", "200" if LOW_MEMORY_MODE else "2000"))
+RETRIEVAL_CACHE_MB = float(os.getenv("RETRIEVAL_CACHE_MB", "8" if LOW_MEMORY_MODE else "64"))
+
+def open_index(db_dir: str = DB_DIR, embedding_function=None):
+    """
+    Abre el índice vectorial.
+    Devuelve (client, shards, legacy): shards es {org_id | "GLOBAL": Chroma} si el
+    índice está particionado por organización (ver shards.py); si no, legacy es
+    la colección única original.
+    """
+    import chromadb
+    from langchain_community.vectorstores import Chroma
+
+    client = chromadb.PersistentClient(path=db_dir)
+    shards = {
+        org_id: Chroma(collection_name=name, client=client, embedding_function=embedding_function)
+        for org_id, name in list_shards(client).items()
+    }
+    if shards:
+        return client, shards, None
+    return client, {}, Chroma(client=client, embedding_function=embedding_function)
+
+
+def read_corpus(stores: List[Chroma]) -> Dict[str, Any]:
+    """Junta ids, textos y metadatos de varias colecciones"""
+    corpus = {"ids": [], "documents": [], "metadatas": []}
+    for store in stores:
+        data = store.get(include=["documents", "metadatas"])
+        for key in corpus:
+            corpus[key].extend(data[key])
+    return corpus
+
+
+def load_corpus(db_dir: str = DB_DIR) -> Dict[str, Any]:
+    """Lee todos los fragmentos (textos + metadatos) de ChromaDB para el índice BM25"""
+    _, shards, legacy = open_index(db_dir)
+    return read_corpus(list(shards.values()) or [legacy])
+
+
+# --- Índice de palabras clave ---
+
+# Palabras vacías frecuentes: no aportan a BM25 y son las columnas más densas
+STOPWORDS_ES = frozenset("""
+a al algo ante antes como con contra cual cuando de del desde donde e el ella ellas
+ellos en entre era es esa ese eso esta este esto fue ha hay la las le les lo los mas
+me mi muy ni no nos o otra otro para pero por que quien se ser si sin sobre su sus
+tambien te tiene u un una uno y ya
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold_accents(text: str) -> str:
+    """Minúsculas sin tildes ni diéresis: "Misión" -> "mision" """
+    text = text.lower()
+    if text.isascii():
+        return text
+    # Lo que no es ASCII tras descomponer no forma parte de ningún token
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem_es(word: str) -> str:
+    """
+    Stemmer ligero para español: quita plurales y la vocal final
+    ("misiones", "misión" -> "mision"; "comunidades" -> "comunidad").
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("ces"):
+        word = word[:-3] + "z"
+    elif word.endswith("es") and len(word) > 5:
+        word = word[:-2]
+    elif word.endswith("s"):
+        word = word[:-1]
+    if len(word) > 3 and word[-1] in "aeo":
+        word = word[:-1]
+    return word
+
+
+def tokenize_es(text: str) -> List[str]:
+    """Tokens normalizados para BM25 (mismo proceso en índice y consulta)"""
+    return [stem_es(t) for t in _TOKEN_RE.findall(fold_accents(text)) if t not in STOPWORDS_ES]
+
+
+class SparseBM25:
+    """
+    BM25 sobre una matriz dispersa término-documento (CSR, términos x fragmentos).
+
+    Los pesos BM25 de cada (término, fragmento) se calculan una vez al indexar;
+    puntuar una consulta es un producto matriz-vector disperso. Los filtros de
+    metadatos (org_id, scope) se aplican como máscaras booleanas antes del top-k,
+    así que cada organización recibe sus k mejores fragmentos y no los que
+    sobreviven a un top-k global.
+
+    Textos y metadatos viven en un ChunkStore (arrays, no objetos por fragmento)
+    y el vocabulario es un StringArray ordenado; guardado con save(), todo se
+    puede abrir con mmap (ver LOW_MEMORY_MODE).
+    """
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, corpus: Dict[str, Any], k1: float = 1.5, b: float = 0.75):
+        import numpy as np
+        from scipy import sparse
+        from chunk_store import ChunkStore, StringArray, TermIndex
+
+        texts = corpus["documents"]
+        vocab: Dict[str, int] = {}
+        # array en lugar de list: 4 bytes por entrada mientras se construye
+        rows, cols, tfs = array("i"), array("i"), array("f")
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+        for doc_idx, text in enumerate(texts):
+            tokens = tokenize_es(text or "")
+            counts = Counter(tokens)
+            doc_len[doc_idx] = len(tokens)
+            rows.extend([vocab.setdefault(token, len(vocab)) for token in counts])
+            cols.extend([doc_idx] * len(counts))
+            tfs.extend(counts.values())
+
+        n_docs, n_terms = len(texts), len(vocab)
+        rows = np.frombuffer(rows, dtype=np.int32)
+        cols = np.frombuffer(cols, dtype=np.int32)
+        tfs = np.frombuffer(tfs, dtype=np.float32)
+
+        doc_freq = np.bincount(rows, minlength=n_terms).astype(np.float32)
+        idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_len = float(doc_len.mean()) if n_docs else 0.0
+        norm = k1 * (1.0 - b + b * doc_len[cols] / (avg_len or 1.0))
+        weights = idf[rows] * tfs * (k1 + 1.0) / (tfs + norm)
+
+        matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(n_terms, n_docs), dtype=np.float32)
+        # Filas en orden alfabético de los términos: el vocabulario se busca por bisección
+        terms = sorted(vocab)
+        self.matrix = matrix[[vocab[t] for t in terms]] if terms else matrix
+        self.vocab = TermIndex(StringArray.from_strings(terms))
+        self.chunks = ChunkStore.from_corpus(corpus)
+        self._init_caches()
+
+    def _init_caches(self):
+        from bounded_cache import BoundedCache
+        # Una máscara ocupa 1 byte por fragmento: el tope es por bytes
+        self._masks = BoundedCache("bm25_mascaras", max_items=BM25_MASK_CACHE_ITEMS,
+                                   max_bytes=BM25_MASK_CACHE_MB * 1024 * 1024)
+
+    def save(self, path: str):
+        """Guarda matriz, vocabulario y fragmentos como .npy en una carpeta (ver generations.py)"""
+        import json
+        import numpy as np
+
+        os.makedirs(path, exist_ok=True)
+        for name in ("data", "indices", "indptr"):
+            np.save(os.path.join(path, f"matrix.{name}.npy"), getattr(self.matrix, name))
+        self.vocab.terms.save(os.path.join(path, "vocab"))
+        self.chunks.save(path)
+        with open(os.path.join(path, "format.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": self.FORMAT_VERSION, "shape": list(self.matrix.shape)}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "SparseBM25":
+        """
+        Carga un índice guardado con save() sin volver a tokenizar el corpus.
+        mmap=True lee matriz y fragmentos del disco según se usan en lugar de copiarlos a memoria.
+        """
+        import json
+        import numpy as np
+        from scipy import sparse
+        from chunk_store import ChunkStore, StringArray, TermIndex
+
+        format_file = os.path.join(path, "format.json")
+        if not os.path.exists(format_file):
+            return cls._load_v1(path)
+        with open(format_file, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        mode = "r" if mmap else None
+        data, indices, indptr = (np.load(os.path.join(path, f"matrix.{name}.npy"), mmap_mode=mode)
+                                 for name in ("data", "indices", "indptr"))
+
+        index = cls.__new__(cls)
+        index.matrix = sparse.csr_matrix((data, indices, indptr), shape=tuple(info["shape"]), copy=False)
+        index.vocab = TermIndex(StringArray.load(os.path.join(path, "vocab"), mmap))
+        index.chunks = ChunkStore.load(path, mmap)
+        index._init_caches()
+        return index
+
+    @classmethod
+    def _load_v1(cls, path: str) -> "SparseBM25":
+        """Formato anterior (chunks.json.gz + matrix.npz) de generaciones ya construidas"""
+        import gzip
+        import json
+        from scipy import sparse
+        from chunk_store import ChunkStore, StringArray, TermIndex
+
+        with gzip.open(os.path.join(path, "chunks.json.gz"), "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        matrix = sparse.load_npz(os.path.join(path, "matrix.npz")).tocsr()
+        order = sorted(range(len(data["vocab"])), key=data["vocab"].__getitem__)
+        index = cls.__new__(cls)
+        index.matrix = matrix[order] if order else matrix
+        index.vocab = TermIndex(StringArray.from_strings([data["vocab"][i] for i in order]))
+        index.chunks = ChunkStore.from_corpus(data)
+        index._init_caches()
+        return index
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def _mask(self, filter_dict: Dict[str, Any]):
+        """Máscara booleana de fragmentos que cumplen el filtro (cacheada por filtro)"""
+        key = tuple(sorted(filter_dict.items()))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self.chunks.mask(filter_dict)
+            self._masks.put(key, mask)
+        return mask
+
+    def scores(self, query: str):
+        """Puntaje BM25 de la consulta para cada fragmento (vector denso)"""
+        import numpy as np
+
+        terms = [self.vocab[t] for t in tokenize_es(query) if t in self.vocab]
+        if not terms:
+            return np.zeros(len(self.chunks), dtype=np.float32)
+        # Solo las filas de los términos de la consulta (repetidos cuentan varias veces)
+        unique, counts = np.unique(terms, return_counts=True)
+        return self.matrix[unique].T.dot(counts.astype(np.float32))
+
+    def search(self, query: str, k: int, filter_dict: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Top-k fragmentos con puntaje > 0 que cumplen el filtro"""
+        import numpy as np
+        from langchain_core.documents import Document
+
+        scores = self.scores(query)
+        if filter_dict:
+            scores = np.where(self._mask(filter_dict), scores, 0.0)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        chunks = self.chunks
+        return [
+            Document(page_content=chunks.text(i), metadata={**chunks.metadata(i), "chunk_id": chunks.chunk_id(i)})
+            for i in ranked
+        ]
+
+    def memory_breakdown(self) -> Dict[str, Dict[str, Any]]:
+        """Bytes por componente; los mapeados viven en la caché de páginas del sistema"""
+        from chunk_store import is_mapped
+
+        matrix_bytes = sum(int(getattr(self.matrix, name).nbytes) for name in ("data", "indices", "indptr"))
+        parts = {
+            "bm25_matriz": (matrix_bytes, is_mapped(self.matrix.data)),
+            "bm25_vocabulario": (self.vocab.terms.nbytes, self.vocab.terms.mapped),
+        }
+        for name, nbytes in self.chunks.nbytes().items():
+            parts[f"fragmentos_{name}"] = (nbytes, self.chunks.mapped)
+        return {name: {"kb": round(nbytes / 1024, 1), "mapeado": mapped}
+                for name, (nbytes, mapped) in parts.items()}
+
+
 class RAGProcessor:
-    def __init__(self, db_dir: str = DB_DIR):
+    def __init__(self, db_dir: str = DB_DIR, connect: bool = True):
+        """
+        connect=False solo carga el modelo de embeddings; ChromaDB y BM25 se abren
+        después con connect(). Lo usa serve.py para cargar el modelo antes del fork
+        sin abrir Chroma en el proceso padre.
+        """
         self.db_dir = db_dir
+        # Generación activa del índice (ver generations.py); None = formato original
+        self.generation = current_generation(db_dir)
+        self.index_dir = generation_path(db_dir, self.generation)
+        self.db = None
+        self.shards: Dict[str, Chroma] = {}
+        self.bm25 = None
+        # Vectores resumen por documento (ver doc_summaries.py); None = una sola etapa
+        self.doc_index = None
+        # org_id con documentos en el índice (ver tier_planner.py); None = desconocido
+        self.org_ids = None
+        # Resultados de search_tiered; uno nuevo por índice abierto (ver connect)
+        self._retrieval = None
+        # Segundos por fase de inicialización (ver serve.py --profile-startup)
+        self.init_timings: Dict[str, float] = {}
+
+        start = time.perf_counter()
+        from langchain_community.embeddings import SentenceTransformerEmbeddings
         self.embedding_function = SentenceTransformerEmbeddings(
             model_name="paraphrase-multilingual-MiniLM-L12-v2",
             model_kwargs={'device': 'cpu'}
         )
-        
-        # Inicializar ChromaDB (Vector Store)
-        if os.path.exists(db_dir):
-            self.db = Chroma(
-                persist_directory=db_dir,
-                embedding_function=self.embedding_function
-            )
-            print("📦 ChromaDB cargado correctamente.")
-            self._init_bm25()
+        if LOW_MEMORY_MODE:
+            self._reduce_model_precision(LOW_MEMORY_MODEL_DTYPE)
+        self.init_timings["modelo_embeddings"] = time.perf_counter() - start
+        # Las consultas concurrentes se embeben juntas en micro-lotes
+        self.query_embedder = EmbeddingBatcher(self.embedding_function.embed_documents)
+        from bounded_cache import BoundedCache
+        # No depende del índice: reopen() la comparte entre generaciones
+        self._query_vectors = BoundedCache("embeddings_consultas", max_items=QUERY_EMBEDDING_CACHE_ITEMS)
+
+        if connect:
+            self.connect()
+
+    def _reduce_model_precision(self, dtype_name: str):
+        """Pesos del modelo en media precisión: la mitad de memoria, embeddings casi idénticos"""
+        import torch
+
+        dtype = getattr(torch, dtype_name, None)
+        model = getattr(self.embedding_function, "client", None)
+        if not isinstance(dtype, torch.dtype) or model is None or dtype == torch.float32:
+            return
+        model.to(dtype)
+        print(f"🪶 Modelo de embeddings en {dtype_name}.")
+
+    def connect(self):
+        """Abre ChromaDB (Vector Store) e inicializa BM25 si aún no está cargado"""
+        if os.path.exists(self.index_dir):
+            start = time.perf_counter()
+            _, self.shards, legacy = open_index(self.index_dir, self.embedding_function)
+            self.init_timings["chromadb"] = time.perf_counter() - start
+            if self.shards:
+                # Índice particionado: `db` apunta a la colección global
+                self.db = self.shards.get("GLOBAL") or next(iter(self.shards.values()))
+                print(f"📦 ChromaDB cargado correctamente ({len(self.shards)} colecciones por organización).")
+            else:
+                self.db = legacy
+                print("📦 ChromaDB cargado correctamente.")
+            if self.bm25 is None:
+                self._init_bm25()
+            if self.doc_index is None:
+                self._init_doc_index()
+            self.org_ids = known_org_ids(self.shards, self.doc_index, self.bm25)
+            from bounded_cache import BoundedCache
+            self._retrieval = BoundedCache(
+                "recuperacion_consultas", max_items=RETRIEVAL_CACHE_ITEMS,
+                max_bytes=int(RETRIEVAL_CACHE_MB * 1024 * 1024),
+                sizeof=lambda docs: sum(len(d.page_content) * 2 + 512 for d in docs))
         else:
             self.db = None
             self.bm25 = None
+            self.doc_index = None
+            self.org_ids = None
             print("⚠️ Base de datos no encontrada. Ejecute ingest.py primero.")
 
-    def _init_bm25(self):
-        """Inicializa BM25 cargando documentos de Chroma (en memoria)"""
+    def reopen(self) -> "RAGProcessor":
+        """
+        Procesador nuevo sobre la generación activa del índice que comparte el
+        modelo de embeddings ya cargado (recarga tras generations.py swap).
+        """
+        other = copy.copy(self)
+        other.generation = current_generation(self.db_dir)
+        other.index_dir = generation_path(self.db_dir, other.generation)
+        other.db = None
+        other.shards = {}
+        other.bm25 = None
+        other.doc_index = None
+        other.org_ids = None
+        other._retrieval = None
+        other.init_timings = {}
+        other.connect()
+        return other
+
+    def has_keyword_index(self) -> bool:
+        return os.path.isdir(keyword_index_path(self.index_dir))
+
+    def load_bm25(self, corpus: Optional[Dict[str, Any]] = None):
+        """
+        Construye BM25 con un corpus ya leído, o carga el guardado en la generación,
+        sin abrir Chroma en este proceso
+        """
+        self._init_bm25(corpus)
+
+    def _init_bm25(self, corpus: Optional[Dict[str, Any]] = None):
+        """Construye el índice BM25 disperso con el corpus dado o leyéndolo de Chroma"""
+        start = time.perf_counter()
         try:
-            print("🔄 Inicializando índice BM25 (esto puede tardar unos segundos)...")
-            # Recuperar TODOS los documentos para crear índice invertido
-            # NOTA: En producción con millones de docs esto no escala.
-            # Para esete proyecto (<10k chunks) es aceptable.
-            all_docs = self.db.get()['documents']
-            all_metadatas = self.db.get()['metadatas']
-            
-            docs_objects = []
-            for text, meta in zip(all_docs, all_metadatas):
-                docs_objects.append(Document(page_content=text, metadata=meta))
-                
-            if docs_objects:
-                self.bm25 = BM25Retriever.from_documents(docs_objects)
-                self.bm25.k = 10  # Base retrieval count
-                print(f"✅ BM25 inicializado con {len(docs_objects)} fragmentos.")
+            if corpus is None and self.has_keyword_index():
+                # Guardado por generations.py: no hace falta leer Chroma ni tokenizar
+                self.bm25 = SparseBM25.load(keyword_index_path(self.index_dir), mmap=LOW_MEMORY_MODE)
+                mode = " con mmap" if LOW_MEMORY_MODE else ""
+                print(f"✅ BM25 cargado{mode} de la generación {self.generation} ({len(self.bm25)} fragmentos).")
             else:
-                self.bm25 = None
-                print("⚠️ No hay documentos para BM25.")
+                print("🔄 Inicializando índice BM25 (esto puede tardar unos segundos)...")
+                if corpus is None:
+                    corpus = read_corpus(list(self.shards.values()) or [self.db])
+
+                if corpus['documents']:
+                    self.bm25 = SparseBM25(corpus)
+                    print(f"✅ BM25 inicializado con {len(self.bm25)} fragmentos "
+                          f"y {len(self.bm25.vocab)} términos.")
+                else:
+                    self.bm25 = None
+                    print("⚠️ No hay documentos para BM25.")
         except Exception as e:
             print(f"❌ Error inicializando BM25: {e}")
             self.bm25 = None
+        self.init_timings["bm25"] = time.perf_counter() - start
+
+    def _init_doc_index(self):
+        """Carga los vectores resumen por documento guardados por la ingesta, si existen"""
+        from doc_summaries import DocumentSummaryIndex, document_index_path
+
+        path = document_index_path(self.index_dir)
+        if DOC_PREFILTER_TOP_N <= 0 or not os.path.isdir(path):
+            return
+        start = time.perf_counter()
+        try:
+            self.doc_index = DocumentSummaryIndex.load(path, mmap=LOW_MEMORY_MODE)
+            print(f"🗂️ Vectores resumen cargados ({len(self.doc_index)} documentos).")
+        except Exception as e:
+            print(f"❌ Error cargando los vectores resumen: {e}")
+            self.doc_index = None
+        self.init_timings["resumenes"] = time.perf_counter() - start
+
+    def memory_breakdown(self) -> Dict[str, Dict[str, Any]]:
+        """Memoria por componente del procesador (modelo, índice de palabras clave, Chroma)"""
+        parts: Dict[str, Dict[str, Any]] = {}
+        model = getattr(self.embedding_function, "client", None)
+        if model is not None and hasattr(model, "parameters"):
+            tensors = list(model.parameters()) + list(model.buffers())
+            nbytes = sum(t.numel() * t.element_size() for t in tensors)
+            dtype = str(tensors[0].dtype).replace("torch.", "") if tensors else None
+            parts["modelo_embeddings"] = {"kb": round(nbytes / 1024, 1), "mapeado": False, "dtype": dtype}
+
+        if self.bm25 is not None:
+            parts.update(self.bm25.memory_breakdown())
+        if self.doc_index is not None:
+            parts.update(self.doc_index.memory_breakdown())
+
+        stems = stem_es.cache_info()
+        parts["cache_stems"] = {"entradas": stems.currsize, "max_entradas": stems.maxsize}
+
+        if self.shards or self.db:
+            # Chroma no expone su memoria: cota de los vectores float32 si todas las
+            # colecciones tuvieran su grafo HNSW cargado
+            stores = list(self.shards.values()) or [self.db]
+            try:
+                chunks = sum(store._collection.count() for store in stores)
+                dim = model.get_sentence_embedding_dimension() if hasattr(
+                    model, "get_sentence_embedding_dimension") else len(self.embed_query("memoria"))
+                parts["chroma_vectores_estimado"] = {"kb": round(chunks * dim * 4 / 1024, 1),
+                                                     "mapeado": False, "estimado": True}
+            except Exception as e:
+                parts["chroma_vectores_estimado"] = {"error": str(e)}
+        return parts
+
+    def embed_query(self, query: str, caches: Optional[Dict[str, str]] = None) -> List[float]:
+        """
+        Embedding de una consulta (agrupado con otras consultas concurrentes).
+        caches: si se pasa, recibe "embedding": "acierto" | "fallo".
+        """
+        key = " ".join(query.split())
+        vector = self._query_vectors.get(key)
+        if caches is not None:
+            caches["embedding"] = "fallo" if vector is None else "acierto"
+        if vector is None:
+            vector = array("f", self.query_embedder.embed(query))
+            self._query_vectors.put(key, vector)
+        return vector.tolist()
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Calcula los embeddings de varias consultas en una sola pasada del modelo"""
+        if not queries:
+            return []
+        return self.embedding_function.embed_documents(list(queries))
 
-    def search_tiered(self, query: str, org_id: str) -> List[Document]:
+    def search_tiered(self, query: str, org_id: str, query_embedding: Optional[List[float]] = None,
+                      caches: Optional[Dict[str, str]] = None) -> List[Document]:
         """
         Ejecuta la estrategia 'Tiered Hybrid Retrieval':
         1. Tier 1: Documentos de la organización (Alta prioridad)
         2. Tier 2: Documentos globales (Soporte)
+        El resultado queda en caché por (org_id, consulta) mientras este índice esté abierto.
+        caches: si se pasa, recibe "recuperacion": "acierto" | "fallo".
         """
         if not self.db:
             return []
 
-        results = []
-        
+        key = (org_id, " ".join(query.split()))
+        cached = self._retrieval.get(key) if self._retrieval is not None else None
+        if caches is not None:
+            caches["recuperacion"] = "fallo" if cached is None else "acierto"
+        if cached is not None:
+            return list(cached)
+
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+
+        docs = self.search_tiered_batch([query], [org_id], [query_embedding])[0]
+        if self._retrieval is not None:
+            self._retrieval.put(key, tuple(docs))
+        return docs
+
+    def search_comparative(self, query: str, org_ids: List[str], query_embedding: Optional[List[float]] = None
+                           ) -> Tuple[Dict[str, List[Document]], List[Document]]:
+        """
+        Recuperación para comparar organizaciones (ver comparison.py): un solo
+        embedding, Tier 1 de cada organización en paralelo y un solo Tier 2
+        compartido, que corre al mismo tiempo.
+        Devuelve ({org_id: fragmentos de Tier 1}, fragmentos de Tier 2).
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        org_ids = list(dict.fromkeys(org_ids))
+        if not self.db:
+            return {org_id: [] for org_id in org_ids}, []
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        queries, embeddings = [query], [query_embedding]
+        plan = TIER_PLANNER_ENABLED
+
+        def tier1(org_id: str) -> List[Document]:
+            if plan and self.org_ids is not None and org_id not in self.org_ids:
+                return []
+            docs = self._tier_search(queries, embeddings, [0], k=TIER1_K, filter_dict={"org_id": org_id},
+                                     k_min=TIER1_K_MIN if plan else None)[0]
+            return self._label_tier(docs, 'Tier 1 (Org)')
+
+        def tier2() -> List[Document]:
+            return self._tier_search(queries, embeddings, [0], k=TIER2_K, filter_dict={"scope": "global"},
+                                     k_min=TIER2_K_MIN if plan else None)[0]
+
+        print(f"🔍 Comparación: Tier 1 de {len(org_ids)} organizaciones en paralelo + Tier 2 compartido...")
+        with ThreadPoolExecutor(max_workers=len(org_ids) + 1, thread_name_prefix="comparar") as pool:
+            global_future = pool.submit(tier2)
+            per_org = dict(zip(org_ids, pool.map(tier1, org_ids)))
+            tier2_docs = global_future.result()
+
+        # Sin las copias de lo que ya trajo algún Tier 1 (ver search_tiered_batch)
+        seen = {group for docs in per_org.values() for d in docs
+                for group in (d.metadata.get("chunk_id"), d.metadata.get("dup_of"))}
+        tier2_docs = [d for d in tier2_docs if not seen & {d.metadata.get("chunk_id"), d.metadata.get("dup_of")} - {None}]
+        return per_org, self._label_tier(tier2_docs, 'Tier 2 (Global)')
+
+    def search_tiered_batch(self, queries: List[str], org_ids: List[str],
+                            query_embeddings: Optional[List[List[float]]] = None) -> List[List[Document]]:
+        """
+        Versión por lotes de search_tiered.
+        Los embeddings se calculan en una sola llamada al modelo y cada nivel
+        se consulta en Chroma con todas las consultas que comparten filtro.
+        Con TIER_PLANNER_ENABLED se omiten los niveles que no aportan y k se
+        ajusta por consulta (ver tier_planner.py).
+        """
+        if not self.db or not queries:
+            return [[] for _ in queries]
+
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(queries)
+
+        results = [[] for _ in queries]
+        plan = TIER_PLANNER_ENABLED
+        covered: Dict[int, bool] = {}
+
         # --- TIER 1: Organización (Priority) ---
-        print(f"🔍 Buscando Tier 1 (Org: {org_id})...")
-        tier1_docs = self._hybrid_search(
-            query, 
-            k=10, 
-            filter_dict={"org_id": org_id}
-        )
-        for d in tier1_docs:
-            d.metadata['retrieval_tier'] = 'Tier 1 (Org)'
-        results.extend(tier1_docs)
+        # Agrupamos por org_id para hacer una consulta vectorial por filtro
+        by_org: Dict[str, List[int]] = {}
+        for i, org_id in enumerate(org_ids):
+            by_org.setdefault(org_id, []).append(i)
+
+        skipped_tier1 = 0
+        for org_id, idxs in by_org.items():
+            if plan and self.org_ids is not None and org_id not in self.org_ids:
+                # Organización sin documentos (p. ej. GLOBAL_ONLY): Tier 1 no puede encontrar nada
+                print(f"⏭️ Tier 1 omitido (Org: {org_id} sin documentos, {len(idxs)} consultas)")
+                skipped_tier1 += len(idxs)
+                continue
+            print(f"🔍 Buscando Tier 1 (Org: {org_id}, {len(idxs)} consultas)...")
+            tier1 = self._tier_search(queries, query_embeddings, idxs, k=TIER1_K, filter_dict={"org_id": org_id},
+                                      k_min=TIER1_K_MIN if plan else None, covered=covered if plan else None)
+            for i, tier1_docs in zip(idxs, tier1):
+                results[i].extend(self._label_tier(tier1_docs, 'Tier 1 (Org)'))
 
         # --- TIER 2: Global (Support) ---
-        print(f"🔍 Buscando Tier 2 (Global)...")
-        tier2_docs = self._hybrid_search(
-            query, 
-            k=3, 
-            filter_dict={"scope": "global"}
-        )
-        for d in tier2_docs:
-            d.metadata['retrieval_tier'] = 'Tier 2 (Global)'
-        results.extend(tier2_docs)
-        
+        # Sin las consultas que Tier 1 ya cubre
+        tier2_idxs = [i for i in range(len(queries)) if not covered.get(i)]
+        if len(tier2_idxs) < len(queries):
+            print(f"⏭️ Tier 2 omitido en {len(queries) - len(tier2_idxs)} consultas (Tier 1 las cubre)")
+        tier2 = []
+        if tier2_idxs:
+            print(f"🔍 Buscando Tier 2 (Global, {len(tier2_idxs)} consultas)...")
+            tier2 = self._tier_search(queries, query_embeddings, tier2_idxs, k=TIER2_K,
+                                      filter_dict={"scope": "global"}, k_min=TIER2_K_MIN if plan else None)
+        planner_stats.add(consultas=len(queries), tier1_omitidos=skipped_tier1,
+                          tier2_omitidos=len(queries) - len(tier2_idxs),
+                          fragmentos_tier1=sum(len(r) for r in results),
+                          fragmentos_tier2=sum(len(docs) for docs in tier2))
+        for i, tier2_docs in zip(tier2_idxs, tier2):
+            # Sin las copias de lo que ya trajo Tier 1 (manuales globales copiados en la carpeta
+            # de la organización, ver near_dup.py)
+            seen = {group for d in results[i] for group in (d.metadata.get("chunk_id"), d.metadata.get("dup_of"))}
+            tier2_docs = [d for d in tier2_docs
+                          if not seen & {d.metadata.get("chunk_id"), d.metadata.get("dup_of")} - {None}]
+            results[i].extend(self._label_tier(tier2_docs, 'Tier 2 (Global)'))
+
         return results
 
-    def _hybrid_search(self, query: str, k: int, filter_dict: Dict[str, Any]) -> List[Document]:
+    def _tier_search(self, queries: List[str], query_embeddings: List[List[float]], idxs: List[int],
+                     k: int, filter_dict: Dict[str, Any], k_min: Optional[int] = None,
+                     covered: Optional[Dict[int, bool]] = None) -> List[List[Document]]:
+        """
+        Búsqueda híbrida (vectorial + BM25, RRF) de un nivel para las consultas idxs.
+        Con vectores resumen la parte vectorial es en dos etapas (ver doc_summaries.py);
+        si el nivel es chico, con una sola consulta a Chroma para todo el lote.
+        k_min: k de cada consulta entre k_min y k según sus similitudes (ver tier_planner.py).
+        covered: recibe por consulta si estos fragmentos cubren la pregunta.
+        """
+        bm25 = {i: self.bm25.search(queries[i], k, filter_dict) if self.bm25 else [] for i in idxs}
+        vector: Dict[int, List[Document]] = {}
+        chosen_k: Dict[int, int] = {}
+        if self.doc_index is not None:
+            vector, chosen_k = self._document_vector_search({i: query_embeddings[i] for i in idxs}, k, filter_dict,
+                                                            bm25, k_min=k_min)
+        rest = [i for i in idxs if i not in vector]
+        if rest:
+            vector_batch, batch_k = self._vector_search([query_embeddings[i] for i in rest], k=k,
+                                                        filter_dict=filter_dict, k_min=k_min)
+            vector.update(zip(rest, vector_batch))
+            chosen_k.update(zip(rest, batch_k))
+        fused = []
+        for i in idxs:
+            # El k elegido por la parte vectorial también acota BM25 y la fusión (no cuántos
+            # fragmentos devolvió: pueden ser menos que k sin que adaptive_k lo haya bajado)
+            k_i = chosen_k.get(i, k)
+            fused.append(self._rrf_fuse([vector[i], bm25[i][:k_i]], k_i))
+            if covered is not None:
+                covered[i] = covers_question(tokenize_es(queries[i]), fused[-1], vector[i], bm25[i])
+        return fused
+
+    def _document_vector_search(self, query_embeddings: Dict[int, List[float]], k: int,
+                                filter_dict: Dict[str, Any], bm25: Dict[int, List[Document]],
+                                k_min: Optional[int] = None
+                                ) -> Tuple[Dict[int, List[Document]], Dict[int, int]]:
+        """
+        Recuperación en dos etapas: fragmentos de los DOC_PREFILTER_TOP_N documentos
+        más parecidos a la consulta (más los que encontró BM25, para no perder
+        coincidencias exactas), con MMR. Solo las consultas cuyo nivel se acota.
+        Devuelve los fragmentos y el k elegido para cada consulta.
+        """
+        import numpy as np
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+        from langchain_core.documents import Document
+
+        fetch_k = k * MMR_FETCH_K_MULTIPLIER
+        selected_ids: Dict[int, List[str]] = {}
+        chosen_k: Dict[int, int] = {}
+        similarity: Dict[int, Dict[str, float]] = {}
+        for i, query_embedding in query_embeddings.items():
+            found = self.doc_index.search_chunks(
+                query_embedding, filter_dict, fetch_k, DOC_PREFILTER_TOP_N, DOC_PREFILTER_MIN_DOCS,
+                extra_sources=[d.metadata.get("source") for d in bm25.get(i, [])])
+            if found is None:
+                continue
+            ids, candidates = found
+            similarities = cosine_similarities(query_embedding, candidates)
+            k_i = k if k_min is None else adaptive_k(similarities, k, k_min)
+            chosen_k[i] = k_i
+            candidates = candidates[:k_i * MMR_FETCH_K_MULTIPLIER]
+            selected = maximal_marginal_relevance(np.array(query_embedding, dtype=np.float32), candidates,
+                                                  k=k_i, lambda_mult=MMR_LAMBDA)
+            # Igual que _vector_search: en orden de similitud
+            selected_ids[i] = [ids[j] for j in sorted(selected)]
+            similarity[i] = {ids[j]: round(float(similarities[j]), 4) for j in selected}
+
+        # Textos y metadatos de los elegidos por todas las consultas en una sola lectura
+        wanted = list(dict.fromkeys(chunk_id for ids in selected_ids.values() for chunk_id in ids))
+        docs = {d.metadata["chunk_id"]: d for d in self.fetch_chunks(wanted, filter_dict)}
+        return {i: [Document(page_content=docs[chunk_id].page_content,
+                             metadata={**docs[chunk_id].metadata, "similarity": similarity[i][chunk_id]})
+                    for chunk_id in ids if chunk_id in docs]
+                for i, ids in selected_ids.items()}, chosen_k
+
+    def refine_tiered(self, query: str, org_id: str, previous_ids: Dict[str, List[str]]) -> List[Document]:
+        """
+        Recuperación liviana para un seguimiento sobre el mismo tema (ver sessions.py):
+        los fragmentos del turno anterior (por id, sin búsqueda vectorial) se combinan
+        por RRF con BM25 de la nueva consulta, nivel por nivel.
+        """
+        if not self.db:
+            return []
+        results = []
+        for tier, filter_dict, k in (('Tier 1 (Org)', {"org_id": org_id}, TIER1_K),
+                                     ('Tier 2 (Global)', {"scope": "global"}, TIER2_K)):
+            previous_docs = self.fetch_chunks(previous_ids.get(tier, []), filter_dict)
+            bm25_docs = self.bm25.search(query, k, filter_dict) if self.bm25 else []
+            fused = self._rrf_fuse([previous_docs, bm25_docs], k)
+            results.extend(self._label_tier(fused, tier))
+        return results
+
+    def fetch_chunks(self, chunk_ids: List[str], filter_dict: Dict[str, Any]) -> List[Document]:
+        """Fragmentos por id en el orden dado (los que ya no existen se omiten)"""
+        from langchain_core.documents import Document
+
+        store, _ = self._route(filter_dict)
+        if store is None or not chunk_ids:
+            return []
+        raw = store._collection.get(ids=list(chunk_ids), include=["documents", "metadatas"])
+        found = {
+            chunk_id: Document(page_content=text, metadata={**(meta or {}), "chunk_id": chunk_id})
+            for chunk_id, text, meta in zip(raw["ids"], raw["documents"], raw["metadatas"])
+        }
+        return [found[chunk_id] for chunk_id in chunk_ids if chunk_id in found]
+
+    @staticmethod
+    def _label_tier(docs: List[Document], tier: str) -> List[Document]:
+        """Copia los documentos con la etiqueta de nivel (los de BM25 son compartidos entre consultas)"""
+        from langchain_core.documents import Document
+        return [
+            Document(page_content=d.page_content, metadata={**d.metadata, 'retrieval_tier': tier})
+            for d in docs
+        ]
+
+    def _route(self, filter_dict: Dict[str, Any]):
+        """
+        Colección y filtro de metadatos para la búsqueda vectorial de un nivel.
+        Con colecciones por organización la colección ya es el filtro; con el
+        índice original se filtra por metadatos dentro de la colección única.
+        """
+        if not self.shards:
+            return self.db, filter_dict
+        if "org_id" in filter_dict:
+            return self.shards.get(filter_dict["org_id"]), None
+        if filter_dict.get("scope") == "global":
+            return self.shards.get("GLOBAL"), None
+        return self.db, filter_dict
+
+    def _vector_search(self, query_embeddings: List[List[float]], k: int,
+                       filter_dict: Dict[str, Any], k_min: Optional[int] = None
+                       ) -> Tuple[List[List[Document]], List[int]]:
+        """
+        Búsqueda vectorial con diversidad MMR para varias consultas a la vez.
+        Chroma acepta múltiples embeddings por consulta, así que un lote con el
+        mismo filtro cuesta una sola llamada. k_min: ver _tier_search.
+        Devuelve los fragmentos y el k elegido para cada consulta.
+        """
+        import numpy as np
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+        from langchain_core.documents import Document
+
+        store, where = self._route(filter_dict)
+        if store is None:
+            # Sin colección para este nivel (p. ej. organización sin documentos)
+            return [[] for _ in query_embeddings], [k for _ in query_embeddings]
+
+        fetch_k = k * MMR_FETCH_K_MULTIPLIER
+        raw = store._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=fetch_k,
+            where=where or None,
+            include=["metadatas", "documents", "embeddings"],
+        )
+
+        batch = []
+        chosen_k = []
+        for q, query_embedding in enumerate(query_embeddings):
+            candidates = raw["embeddings"][q] if raw.get("embeddings") is not None else []
+            if candidates is None or len(candidates) == 0:
+                batch.append([])
+                chosen_k.append(k)
+                continue
+            similarities = cosine_similarities(query_embedding, candidates)
+            k_q = k if k_min is None else adaptive_k(similarities, k, k_min)
+            chosen_k.append(k_q)
+            candidates = candidates[:k_q * MMR_FETCH_K_MULTIPLIER]
+            selected = set(maximal_marginal_relevance(
+                np.array(query_embedding, dtype=np.float32),
+                candidates,
+                k=k_q,
+                lambda_mult=MMR_LAMBDA # 0.6 = balanceado tirando a semántico
+            ))
+            # Igual que LangChain: se conservan en orden de similitud
+            batch.append([
+                Document(
+                    page_content=raw["documents"][q][i],
+                    metadata={**(raw["metadatas"][q][i] or {}), "chunk_id": raw["ids"][q][i],
+                              "similarity": round(float(similarities[i]), 4)},
+                )
+                for i in range(len(candidates)) if i in selected
+            ])
+        return batch, chosen_k
+
+    def _hybrid_search(self, query: str, k: int, filter_dict: Dict[str, Any],
+                       vector_docs: Optional[List[Document]] = None) -> List[Document]:
         """
         Realiza búsqueda híbrida (Vector + BM25) y filtra resultados.
-        Como BM25Retriever de LangChain no soporta filtros nativos eficientes pre-query,
-        hacemos:
-        1. Vector Search con filtro (Chroma)
-        2. BM25 Search global -> Filtrar en Python
+        1. Vector Search con filtro (Chroma) - o los resultados ya calculados por lote
+        2. BM25 disperso con el mismo filtro como máscara
         3. Combinar (Dedup)
         """
         # 1. Vector Search (Semantic) - Force Diversity with MMR
-        vector_docs = self.db.max_marginal_relevance_search(
-            query,
-            k=k,
-            fetch_k=k*4,
-            filter=filter_dict,
-            lambda_mult=0.6 # 0.6 = balanceado tirando a semántico
-        )
+        if vector_docs is None:
+            query_embedding = self.embed_query(query)
+            vector_docs = self._vector_search([query_embedding], k=k, filter_dict=filter_dict)[0][0]
         
         # 2. Keyword Search (BM25)
         bm25_docs = []
         if self.bm25:
-            # Recuperamos más candidatos para tener margen tras filtrar
-            raw_bm25 = self.bm25.invoke(query)
-            
-            # Filtrado manual de BM25
-            for doc in raw_bm25:
-                match = True
-                for key, val in filter_dict.items():
-                    if doc.metadata.get(key) != val:
-                        match = False
-                        break
-                if match:
-                    bm25_docs.append(doc)
-            
-            # Cortar a k
-            bm25_docs = bm25_docs[:k]
+            bm25_docs = self.bm25.search(query, k, filter_dict)
 
         # 3. Reciprocal Rank Fusion (RRF)
-        # RRF_Score(d) = 1 / (rank + k_const) + 1 / (rank + k_const)
+        return self._rrf_fuse([vector_docs, bm25_docs], k)
+
+    @staticmethod
+    def _rrf_fuse(rankings: List[List[Document]], k: int) -> List[Document]:
+        """
+        Combina varios rankings con Reciprocal Rank Fusion (deduplicando por fuente y contenido).
+        RRF_Score(d) = suma de 1 / (rank + k_const) en cada ranking donde aparece d
+        """
         rrf_k = 60 # Constante estándar para RRF
         doc_scores = {}
         doc_map = {} # uid -> Document object
 
-        # Procesar rankings Vectoriales
-        for rank, doc in enumerate(vector_docs):
-            uid = f"{doc.metadata.get('source')}_{hash(doc.page_content)}"
-            doc_map[uid] = doc
-            if uid not in doc_scores:
-                doc_scores[uid] = 0.0
-            doc_scores[uid] += 1.0 / (rank + rrf_k)
-
-        # Procesar rankings BM25
-        for rank, doc in enumerate(bm25_docs):
-            uid = f"{doc.metadata.get('source')}_{hash(doc.page_content)}"
-            # Si el documento no estaba en vector search, añadirlo
-            if uid not in doc_map:
-                doc_map[uid] = doc
-                doc_scores[uid] = 0.0
-            doc_scores[uid] += 1.0 / (rank + rrf_k)
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking):
+                uid = f"{doc.metadata.get('source')}_{hash(doc.page_content)}"
+                # El primer ranking donde aparece define el Document que se devuelve
+                if uid not in doc_map:
+                    doc_map[uid] = doc
+                    doc_scores[uid] = 0.0
+                doc_scores[uid] += 1.0 / (rank + rrf_k)
 
         # Ordenar por puntaje RRF descendente
         sorted_uids = sorted(doc_scores.keys(), key=lambda x: doc_scores[x], reverse=True)
-        
-        # Construir resultado final
-        final_results = []
-        for uid in sorted_uids:
-            final_results.append(doc_map[uid])
-
-        return final_results[:k] # Retornar top k combinados
+        return [doc_map[uid] for uid in sorted_uids][:k] # Retornar top k combinados
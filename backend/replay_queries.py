@@ -0,0 +1,248 @@
+"""
+Reproduce consultas registradas (ver query_log.py) y compara corridas.
+
+`run` vuelve a hacer cada consulta del registro, en orden y una a la vez,
+contra el índice de --db-dir con el código actual. El LLM se reemplaza por uno
+falso con latencia fija (--llm-latency-ms), así que las diferencias vienen de la
+recuperación y no de OpenAI. Las cachés de embeddings, recuperación y respuestas
+se desactivan: una consulta repetida en el registro mide el camino completo y no
+la caché. Las conversaciones se reproducen con sesiones
+nuevas (una por sesión registrada). El resultado tiene el mismo formato que el
+registro, más "origen" (posición de la consulta en el registro).
+
+`diff` compara dos corridas (o el registro original con una corrida): latencia
+por etapa (p50/p95/media), fragmentos recuperados (Jaccard total y por nivel,
+consultas con el mismo resultado) y cambios en cómo se respondió.
+
+Uso:
+    python replay_queries.py run ../query_logs -o antes.jsonl.gz
+    (cambio de código, de parámetros o de generación del índice)
+    python replay_queries.py run ../query_logs -o despues.jsonl.gz --db-dir /ruta/chroma_db
+    python replay_queries.py diff antes.jsonl.gz despues.jsonl.gz
+"""
+import argparse
+import gzip
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from latency_stats import percentile
+from query_log import read_log
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("embedding", "recuperacion", "llm", "respuesta", "total")
+
+RESPUESTA_FALSA = ("<thinking>Respuesta simulada por replay_queries.py.</thinking>\n"
+                   "Respuesta simulada: la reproducción no llama al LLM.")
+
+
+class _StubMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubLLM:
+    """Reemplazo de ChatOpenAI: respuesta fija tras una latencia fija"""
+
+    def __init__(self, latency_ms: float):
+        self.latency_s = latency_ms / 1000.0
+
+    def invoke(self, messages):
+        time.sleep(self.latency_s)
+        return _StubMessage(RESPUESTA_FALSA)
+
+
+def _build_label() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def load_records(paths: List[str]) -> List[Dict[str, Any]]:
+    """Consultas en orden; las de un registro original reciben "origen" por posición"""
+    records = list(read_log(paths))
+    if all("origen" in r for r in records):
+        return sorted(records, key=lambda r: r["origen"])
+    records.sort(key=lambda r: r.get("ts", 0))
+    for position, record in enumerate(records):
+        record.setdefault("origen", position)
+    return records
+
+
+def run(paths: List[str], output: str, db_dir: Optional[str] = None, llm_latency_ms: float = 0.0,
+        limit: Optional[int] = None, label: Optional[str] = None):
+    """Reproduce el registro y escribe una corrida en `output`"""
+    import chat_service
+    from query_log import query_log
+    from rag_processor import RAGProcessor
+
+    records = load_records(paths)
+    if limit:
+        records = records[:limit]
+    query_log.enabled = False
+    os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY") or "replay"
+    chat_service._llm = StubLLM(llm_latency_ms)
+    rag = RAGProcessor(db_dir) if db_dir else RAGProcessor()
+    chat_service.set_rag(rag)
+    _disable_caches(rag)
+    label = label or _build_label()
+
+    sessions: Dict[str, str] = {}
+    replayed = skipped = 0
+    start = time.perf_counter()
+    with gzip.open(output, "wt", encoding="utf-8") as f:
+        for record in records:
+            mensaje = record.get("mensaje")
+            # QUERY_LOG_TEXT=hash: no hay texto que reproducir
+            if not mensaje or mensaje.startswith("sha256:"):
+                skipped += 1
+                continue
+            session_id = None
+            if record.get("sesion"):
+                session_id = sessions.setdefault(record["sesion"], chat_service.new_session_id())
+            trace: Dict[str, Any] = {}
+            chat_service.answer_question(record["organizacion"], mensaje, session_id=session_id,
+                                         modo=record.get("modo"), trace=trace)
+            trace.update({"origen": record["origen"], "corrida": label})
+            f.write(json.dumps(trace, ensure_ascii=False) + "\n")
+            replayed += 1
+            if replayed % 50 == 0:
+                print(f"   {replayed}/{len(records)} consultas...")
+    print(f"✅ {replayed} consultas reproducidas en {time.perf_counter() - start:.1f}s "
+          f"({skipped} sin texto reproducible) -> {output}")
+
+
+def _disable_caches(rag):
+    import chat_service
+    import extractive
+
+    rag._retrieval = None
+    for cache in (rag._query_vectors, chat_service._answers, extractive._sentence_vectors):
+        cache.clear()
+        cache.max_items = 0
+
+
+def _chunk_set(record: Dict[str, Any], tier: Optional[str] = None) -> set:
+    fragmentos = record.get("fragmentos") or {}
+    if tier is not None:
+        return set(fragmentos.get(tier, []))
+    return {chunk_id for ids in fragmentos.values() for chunk_id in ids}
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _latency(values: List[float]) -> Dict[str, float]:
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95),
+            "media": round(sum(values) / len(values), 1) if values else 0.0}
+
+
+def compare(records_a: List[Dict[str, Any]], records_b: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reporte de diferencias entre dos corridas, alineadas por "origen" """
+    by_origin = {r["origen"]: r for r in records_b}
+    pairs = [(a, by_origin[a["origen"]]) for a in records_a if a["origen"] in by_origin]
+
+    latencias = {}
+    for stage in STAGES:
+        a_values = [a["tiempos_ms"][stage] for a, b in pairs
+                    if stage in a.get("tiempos_ms", {}) and stage in b.get("tiempos_ms", {})]
+        b_values = [b["tiempos_ms"][stage] for a, b in pairs
+                    if stage in a.get("tiempos_ms", {}) and stage in b.get("tiempos_ms", {})]
+        if a_values:
+            latencias[stage] = {"a": _latency(a_values), "b": _latency(b_values), "n": len(a_values)}
+
+    tiers = sorted({tier for a, b in pairs for r in (a, b) for tier in (r.get("fragmentos") or {})}, key=str)
+    jaccards = [_jaccard(_chunk_set(a), _chunk_set(b)) for a, b in pairs]
+    por_nivel = {}
+    for tier in tiers:
+        values = [_jaccard(_chunk_set(a, tier), _chunk_set(b, tier)) for a, b in pairs]
+        por_nivel[tier] = round(sum(values) / len(values), 3) if values else None
+
+    peores = sorted(zip(jaccards, pairs), key=lambda item: item[0])
+    caminos = Counter((a.get("respuesta"), b.get("respuesta")) for a, b in pairs
+                      if a.get("respuesta") != b.get("respuesta"))
+    return {
+        "corridas": [records_a[0].get("corrida") if records_a else None,
+                     records_b[0].get("corrida") if records_b else None],
+        "consultas": len(pairs),
+        "solo_a": len(records_a) - len(pairs),
+        "solo_b": len(records_b) - len(pairs),
+        "latencias_ms": latencias,
+        "jaccard_medio": round(sum(jaccards) / len(jaccards), 3) if jaccards else None,
+        "jaccard_por_nivel": por_nivel,
+        "mismos_fragmentos": round(sum(1 for j in jaccards if j == 1.0) / max(len(pairs), 1), 3),
+        "mismo_orden": round(sum(1 for a, b in pairs
+                                 if (a.get("fragmentos") or {}) == (b.get("fragmentos") or {}))
+                             / max(len(pairs), 1), 3),
+        "peores": [{"origen": a["origen"], "organizacion": a.get("organizacion"), "mensaje": a.get("mensaje"),
+                    "jaccard": round(j, 3)} for j, (a, b) in peores[:10] if j < 1.0],
+        "cambios_respuesta": {f"{a} -> {b}": n for (a, b), n in caminos.most_common()},
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    def delta(new, old):
+        if not old:
+            return "   n/a"
+        return f"{(new - old) / old * 100:+6.1f}%"
+
+    a_name, b_name = (name or "?" for name in report["corridas"])
+    print(f"\n🔁 {report['consultas']} consultas comparadas: A={a_name} B={b_name} "
+          f"(solo en A: {report['solo_a']}, solo en B: {report['solo_b']})")
+    print(f"\n{'etapa':<14}{'p50 A':>9}{'p50 B':>9}{'Δp50':>9}{'p95 A':>9}{'p95 B':>9}{'Δp95':>9}{'Δmedia':>9}")
+    for stage, stats in report["latencias_ms"].items():
+        a, b = stats["a"], stats["b"]
+        print(f"{stage:<14}{a['p50']:>9.1f}{b['p50']:>9.1f}{delta(b['p50'], a['p50']):>9}"
+              f"{a['p95']:>9.1f}{b['p95']:>9.1f}{delta(b['p95'], a['p95']):>9}{delta(b['media'], a['media']):>9}")
+
+    print(f"\n📚 Fragmentos: Jaccard medio {report['jaccard_medio']}, "
+          f"{report['mismos_fragmentos'] * 100:.1f}% con los mismos, {report['mismo_orden'] * 100:.1f}% en el mismo orden")
+    for tier, value in report["jaccard_por_nivel"].items():
+        print(f"   {tier}: {value}")
+    if report["peores"]:
+        print("   Consultas con más cambios:")
+        for item in report["peores"]:
+            print(f"   #{item['origen']} [{item['jaccard']}] {item['organizacion']}: {(item['mensaje'] or '')[:70]}")
+    if report["cambios_respuesta"]:
+        print("\n💬 Cambios en cómo se respondió:")
+        for change, n in report["cambios_respuesta"].items():
+            print(f"   {change}: {n}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducción y comparación de consultas registradas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    run_parser = sub.add_parser("run", help="Reproducir un registro contra un índice")
+    run_parser.add_argument("registros", nargs="+", help="Archivos .jsonl(.gz) o carpetas")
+    run_parser.add_argument("-o", "--output", required=True)
+    run_parser.add_argument("--db-dir", help="Default: CHROMA_DB_DIR")
+    run_parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    run_parser.add_argument("--limit", type=int)
+    run_parser.add_argument("--etiqueta", help="Nombre de la corrida (default: commit actual)")
+    diff_parser = sub.add_parser("diff", help="Comparar dos corridas (o el registro original y una corrida)")
+    diff_parser.add_argument("a")
+    diff_parser.add_argument("b")
+    diff_parser.add_argument("--json", help="Guardar el reporte en JSON")
+    args = parser.parse_args()
+
+    if args.comando == "run":
+        run(args.registros, args.output, args.db_dir, args.llm_latency_ms, args.limit, args.etiqueta)
+    elif args.comando == "diff":
+        records_a, records_b = load_records([args.a]), load_records([args.b])
+        if not records_a or not records_b:
+            print("❌ Una de las corridas está vacía")
+            sys.exit(1)
+        report = compare(records_a, records_b)
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,249 @@
+"""
+Servidor de producción con modo multi-worker pre-fork.
+
+El proceso padre carga el modelo de embeddings, el corpus BM25 y el índice
+territorial una sola vez y después hace fork de los workers, que comparten
+esas páginas copy-on-write en lugar de duplicarlas en cada proceso.
+
+ChromaDB no se abre en el padre: su runtime nativo no sobrevive a un fork.
+El corpus BM25 se lee en un proceso auxiliar y cada worker abre su propio
+cliente Chroma al arrancar.
+
+Con un solo worker no se precarga por defecto: el worker empieza a servir en
+cuanto importa main.py (que ya no importa torch ni Chroma) y calienta la
+recuperación en un hilo de fondo (WARMUP_ON_START).
+
+Uso:
+    python serve.py --workers 4 --port 8000
+    WEB_CONCURRENCY=4 python serve.py
+    python serve.py --profile-startup   # tiempos de import e inicialización
+"""
+import argparse
+import gc
+import os
+import pickle
+import signal
+import socket
+import sys
+import threading
+import time
+
+from process_stats import memory_stats, format_memory_table
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1").lower() not in ("0", "false", "no")
+
+
+def _load_corpus_in_helper(db_dir):
+    """Lee el corpus de Chroma en un proceso hijo efímero y lo recibe por un pipe"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        code = 0
+        try:
+            from rag_processor import load_corpus
+            with os.fdopen(write_fd, 'wb') as pipe:
+                pickle.dump(load_corpus(db_dir), pipe, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print(f"❌ Error leyendo el corpus de Chroma: {e}", file=sys.stderr)
+            code = 1
+        os._exit(code)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as pipe:
+        try:
+            corpus = pickle.load(pipe)
+        except EOFError:
+            corpus = None
+    os.waitpid(pid, 0)
+    return corpus
+
+
+def preload():
+    """Carga en el padre todo lo de solo lectura que comparten los workers"""
+    start = time.time()
+    from chat_service import set_rag
+    from rag_processor import RAGProcessor
+
+    rag = RAGProcessor(connect=False)
+    print(f"🧠 Modelo de embeddings cargado ({time.time() - start:.1f}s)")
+
+    if rag.has_keyword_index():
+        # Índice guardado por generations.py: se carga sin abrir Chroma
+        rag.load_bm25()
+    elif os.path.exists(rag.index_dir):
+        corpus = _load_corpus_in_helper(rag.index_dir)
+        if corpus is not None:
+            rag.load_bm25(corpus)
+    set_rag(rag)
+
+    from territorial import get_territorial_engine
+    get_territorial_engine()
+
+    import main
+    # Mover lo cargado a la generación permanente del GC: sus recorridos no
+    # tocarán esas páginas y seguirán compartidas tras el fork
+    gc.collect()
+    gc.freeze()
+    print(f"✅ Precarga completa en {time.time() - start:.1f}s")
+    return main.app
+
+
+def _warmup():
+    """Carga modelo, Chroma y BM25 sin bloquear el arranque del servidor"""
+    start = time.time()
+    try:
+        from chat_service import get_rag
+        from territorial import get_territorial_engine
+        get_territorial_engine()
+        get_rag()
+        print(f"🔥 Recuperación lista en {time.time() - start:.1f}s")
+        from prewarm import start_prewarm
+        start_prewarm()
+    except Exception as e:
+        print(f"⚠️ Error en el calentamiento: {e}", file=sys.stderr)
+
+
+def _bind_socket(host, port):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock, args, threads, preloaded):
+    """Cuerpo de cada worker tras el fork"""
+    import uvicorn
+
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM, signal.SIGUSR1):
+        signal.signal(sig, signal.SIG_DFL)
+
+    if preloaded:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+        # Chroma se abre aquí, en el proceso que lo va a usar
+        from chat_service import get_rag
+        get_rag()
+        from prewarm import start_prewarm
+        start_prewarm()
+    elif WARMUP_ON_START:
+        threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+
+    config = uvicorn.Config(app, host=args.host, port=args.port, log_level=args.log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def report_memory(children):
+    rows = {f"padre {os.getpid()}": memory_stats()}
+    for pid, index in sorted(children.items(), key=lambda x: x[1]):
+        rows[f"worker{index} {pid}"] = memory_stats(pid)
+    total_pss = sum(s.get("pss_kb", 0) for s in rows.values()) / 1024
+    print(format_memory_table(rows))
+    print(f"PSS total: {total_pss:.1f} MB")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor CATIE PARES (pre-fork)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Hilos de torch por worker (por defecto núcleos / workers)")
+    parser.add_argument("--memory-report-after", type=int, default=10,
+                        help="Segundos tras el arranque para imprimir la memoria por worker (0 = nunca)")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=None,
+                        help="Precargar modelo e índices antes del fork (por defecto solo con más de un worker)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Medir tiempos de import e inicialización y salir")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    if args.profile_startup:
+        from startup_profile import profile_startup
+        profile_startup()
+        return
+
+    snapshot = os.getenv("SNAPSHOT_RESTORE")
+    if snapshot:
+        # Contenedor nuevo: restaura el índice empaquetado en lugar de reingerir
+        from snapshots import restore_on_start
+        restore_on_start(snapshot)
+
+    if not hasattr(os, "fork"):
+        # Windows: sin fork, servidor de un solo proceso
+        import uvicorn
+        uvicorn.run("main:app", host=args.host, port=args.port, log_level=args.log_level)
+        return
+
+    workers = max(1, args.workers)
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    preloaded = args.preload if args.preload is not None else workers > 1
+    print(f"🚀 Pre-fork: {workers} workers x {threads} hilos en {args.host}:{args.port}")
+
+    if preloaded:
+        app = preload()
+    else:
+        import main as api
+        app = api.app
+    sock = _bind_socket(args.host, args.port)
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, sock, args, threads, preloaded)
+            except Exception as e:
+                print(f"❌ Worker {index} terminó con error: {e}", file=sys.stderr)
+                code = 1
+            os._exit(code)
+        children[pid] = index
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    # kill -USR1 <padre> imprime la memoria por worker en cualquier momento
+    signal.signal(signal.SIGUSR1, lambda s, f: report_memory(children))
+    signal.signal(signal.SIGALRM, lambda s, f: report_memory(children))
+
+    for index in range(workers):
+        spawn(index)
+    if args.memory_report_after > 0:
+        signal.alarm(args.memory_report_after)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"⚠️ Worker {index} (pid {pid}) terminó ({status}); relanzando...")
+            spawn(index)
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Sesiones de chat de varios turnos.
+
+Cada sesión guarda sus últimos turnos: la pregunta, la consulta autónoma con
+la que se recuperó y los ids de los fragmentos recuperados por nivel. Con eso
+chat_service puede:
+- reescribir una pregunta de seguimiento ("¿y cuáles son sus metas para 2028?")
+  con los términos del tema anterior antes de recuperar;
+- si el tema no cambió, reutilizar los candidatos del turno anterior y solo
+  extenderlos con BM25 (sin consultar Chroma) en lugar de repetir la
+  recuperación por niveles completa.
+
+Las sesiones viven en memoria del proceso, con TTL y número máximo (ver
+bounded_cache.py). Con serve.py --workers N cada worker tiene las suyas: una
+sesión que cae en otro worker simplemente empieza de cero.
+"""
+import os
+import re
+import uuid
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from bounded_cache import BoundedCache
+
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "2000"))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "64"))
+# Turnos que se recuerdan por sesión
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+# Similitud coseno mínima con la consulta anterior para considerar que el tema no cambió:
+# más baja si la pregunta es explícitamente de seguimiento ("¿y sus metas?")
+SESSION_REUSE_SIMILARITY = float(os.getenv("SESSION_REUSE_SIMILARITY", "0.8"))
+SESSION_FOLLOWUP_SIMILARITY = float(os.getenv("SESSION_FOLLOWUP_SIMILARITY", "0.5"))
+# Turnos seguidos que pueden reutilizar candidatos antes de recuperar de nuevo
+SESSION_MAX_REUSE = int(os.getenv("SESSION_MAX_REUSE", "3"))
+# Términos del tema anterior que se agregan a una pregunta de seguimiento
+FOLLOWUP_MAX_TERMS = 12
+
+# Inicios y referencias típicas de una pregunta que depende de la anterior
+_FOLLOWUP_STARTS = ("y ", "e ", "tambien", "ademas", "entonces", "pero ", "que mas")
+_FOLLOWUP_REFERENCES = frozenset("""
+su sus suyo suya ello ellos ellas esto eso estas estos esa esas ese esos
+alli ahi dicho dicha dichos dichas mismo misma mismos mismas anterior anteriores
+""".split())
+# Palabras de la pregunta que no describen el tema
+_QUESTION_WORDS = frozenset("""
+cual cuales cuanto cuanta cuantos cuantas donde como cuando quien quienes son estan
+tienen hace hacen puede pueden explique explica describa dime sobre acerca
+""".split())
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class Turn:
+    mensaje: str
+    # Consulta autónoma (reescrita) con la que se recuperó
+    consulta: str
+    # Nivel ("Tier 1 (Org)", "Tier 2 (Global)") -> ids de fragmentos en orden
+    chunk_ids: Dict[str, List[str]]
+    embedding: array
+    reutilizado: bool = False
+
+
+@dataclass
+class Session:
+    session_id: str
+    organizacion: str
+    turns: List[Turn] = field(default_factory=list)
+
+    def add_turn(self, turn: Turn):
+        self.turns.append(turn)
+        del self.turns[:-SESSION_MAX_TURNS]
+
+    def reuse_streak(self) -> int:
+        streak = 0
+        for turn in reversed(self.turns):
+            if not turn.reutilizado:
+                break
+            streak += 1
+        return streak
+
+    def reusable_turn(self, query_embedding: List[float], followup: bool = False) -> Optional[Turn]:
+        """Último turno si el tema no cambió y todavía se pueden reutilizar sus candidatos"""
+        if not self.turns or self.reuse_streak() >= SESSION_MAX_REUSE:
+            return None
+        previous = self.turns[-1]
+        if not any(previous.chunk_ids.values()):
+            return None
+        threshold = SESSION_FOLLOWUP_SIMILARITY if followup else SESSION_REUSE_SIMILARITY
+        if cosine_similarity(previous.embedding, query_embedding) < threshold:
+            return None
+        return previous
+
+
+def cosine_similarity(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm_a = sum(x * x for x in a) ** 0.5
+    norm_b = sum(y * y for y in b) ** 0.5
+    if not norm_a or not norm_b:
+        return 0.0
+    return dot / (norm_a * norm_b)
+
+
+def is_followup(mensaje: str) -> bool:
+    """La pregunta depende de la anterior (empieza con "y", "también"... o hace referencias)"""
+    from rag_processor import fold_accents
+
+    text = fold_accents(mensaje).lstrip("¿¡ ").strip()
+    if text.startswith(_FOLLOWUP_STARTS):
+        return True
+    return any(word in _FOLLOWUP_REFERENCES for word in _WORD_RE.findall(text))
+
+
+def rewrite_followup(mensaje: str, turns: List[Turn]) -> str:
+    """
+    Consulta autónoma para recuperar: a una pregunta de seguimiento se le agregan
+    los términos del tema anterior que no repite
+    ("¿y cuáles son sus metas para 2028?" -> "... (restauración manglar TIERRA VIVA)").
+    """
+    from rag_processor import STOPWORDS_ES, fold_accents, stem_es, tokenize_es
+
+    if not turns or not is_followup(mensaje):
+        return mensaje
+    present = set(tokenize_es(mensaje))
+    extra = []
+    for word in _WORD_RE.findall(turns[-1].consulta):
+        folded = fold_accents(word)
+        if (folded in STOPWORDS_ES or folded in _FOLLOWUP_REFERENCES or folded in _QUESTION_WORDS
+                or len(folded) < 3):
+            continue
+        stem = stem_es(folded)
+        if stem not in present:
+            present.add(stem)
+            extra.append(word)
+    if not extra:
+        return mensaje
+    return f"{mensaje} ({' '.join(extra[:FOLLOWUP_MAX_TERMS])})"
+
+
+def _session_size(session: Session) -> int:
+    """Bytes aproximados de una sesión para el tope de la caché"""
+    size = 256
+    for turn in session.turns:
+        size += len(turn.mensaje) + len(turn.consulta) + len(turn.embedding) * turn.embedding.itemsize
+        size += sum(64 + len(i) for ids in turn.chunk_ids.values() for i in ids)
+    return size
+
+
+class SessionStore:
+    """Sesiones en memoria con TTL (desde el último turno) y cantidad máxima"""
+
+    def __init__(self, max_sessions: int = SESSION_MAX, max_mb: float = SESSION_MAX_MB,
+                 ttl_s: float = SESSION_TTL_S):
+        self._cache = BoundedCache("sesiones_chat", max_items=max_sessions,
+                                   max_bytes=int(max_mb * 1024 * 1024), ttl_s=ttl_s, sizeof=_session_size)
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def get(self, session_id: str, organizacion: str) -> Session:
+        """Sesión existente, o una vacía si expiró, no existe o cambió la organización"""
+        session = self._cache.get(session_id)
+        if session is None or session.organizacion != organizacion:
+            session = Session(session_id=session_id, organizacion=organizacion)
+        return session
+
+    def save(self, session: Session):
+        # put() renueva el TTL y el lugar en el LRU
+        self._cache.put(session.session_id, session)
+
+    def stats(self) -> Dict:
+        return self._cache.stats()
@@ -0,0 +1,72 @@
+"""
+Distribución del índice vectorial en colecciones por organización.
+
+Cada org_id tiene su propia colección Chroma y los documentos globales otra,
+siguiendo el mismo (scope, org_id) que determine_scope_and_org() deriva de la
+ruta del archivo. Así Tier 1 busca en un grafo HNSW pequeño sin filtro, en
+lugar de filtrar por metadatos dentro de un grafo con todas las organizaciones.
+"""
+import hashlib
+import re
+import unicodedata
+from typing import Any, Dict, Optional
+
+# Colección única original (nombre por defecto de LangChain)
+LEGACY_COLLECTION = "langchain"
+GLOBAL_COLLECTION = "pares_global"
+ORG_COLLECTION_PREFIX = "pares_org_"
+
+
+def collection_name_for(scope: str, org_id: str) -> str:
+    """
+    Nombre de la colección para un (scope, org_id).
+    Chroma solo admite [a-zA-Z0-9._-], así que el org_id se translitera y se
+    agrega un hash corto para que nombres distintos no colisionen.
+    """
+    if scope == "global":
+        return GLOBAL_COLLECTION
+
+    ascii_id = unicodedata.normalize("NFKD", org_id).encode("ascii", "ignore").decode("ascii")
+    slug = re.sub(r"[^a-zA-Z0-9]+", "_", ascii_id).strip("_").lower()[:40] or "org"
+    digest = hashlib.md5(org_id.encode("utf-8")).hexdigest()[:8]
+    return f"{ORG_COLLECTION_PREFIX}{slug}_{digest}"
+
+
+def collection_metadata_for(scope: str, org_id: str) -> Dict[str, Any]:
+    """
+    Metadatos de la colección: permiten recuperar el org_id original del nombre
+    e incluyen los parámetros HNSW con los que se crea (ver hnsw_params.py)
+    """
+    from hnsw_params import hnsw_metadata, params_for
+
+    return {"scope": scope, "org_id": org_id, **hnsw_metadata(params_for(collection_name_for(scope, org_id)))}
+
+
+def _collection_names(client):
+    # Chroma 0.6 devuelve nombres; las demás versiones, objetos Collection
+    return [c if isinstance(c, str) else c.name for c in client.list_collections()]
+
+
+def list_shards(client) -> Dict[str, str]:
+    """
+    Colecciones por organización existentes: {org_id: nombre_coleccion}.
+    La colección global se indica con la clave "GLOBAL".
+    """
+    shards = {}
+    for name in _collection_names(client):
+        if name == GLOBAL_COLLECTION:
+            shards["GLOBAL"] = name
+        elif name.startswith(ORG_COLLECTION_PREFIX):
+            metadata = client.get_collection(name).metadata or {}
+            shards[metadata.get("org_id", name)] = name
+    return shards
+
+
+def has_legacy_collection(client) -> bool:
+    return LEGACY_COLLECTION in _collection_names(client)
+
+
+def shard_for_metadata(metadata: Optional[dict]) -> str:
+    """Colección destino de un fragmento según sus metadatos de ingesta"""
+    metadata = metadata or {}
+    return collection_name_for(metadata.get("scope", "global"), metadata.get("org_id", "UNKNOWN"))
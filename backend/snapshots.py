@@ -0,0 +1,293 @@
+"""
+Snapshots portables del índice (export / import).
+
+Un snapshot es un .tar.gz con una generación completa del índice, lista para
+servir sin embeber nada:
+- index/: colecciones Chroma, índice de palabras clave, vectores resumen,
+  near_dup/ y el manifest de la ingesta (lo que generations.py guarda por generación);
+- registry/: el registro de documentos (documents/metadata.json) y
+  hnsw_params.json si existen;
+- SNAPSHOT.json (primer miembro): versión de formato, generación, modelo de
+  embeddings, versión de Chroma, fragmentos por colección y el sha256 y tamaño de
+  cada archivo.
+
+import verifica cada archivo mientras lo extrae a generations/<id>.importing,
+valida la generación como un build y recién entonces la activa (ver
+generations.swap). Junto al snapshot se escribe <archivo>.sha256 para verificar
+la copia con `sha256sum -c`.
+
+Uso:
+    python snapshots.py export                          # generación activa -> snapshots/<gen>.tar.gz
+    python snapshots.py export --generation 20250301-120000 -o indice.tar.gz
+    python snapshots.py import indice.tar.gz            # extrae, valida y activa
+    python snapshots.py import indice.tar.gz --no-activate
+    python snapshots.py info indice.tar.gz
+Con SNAPSHOT_RESTORE=<archivo> serve.py importa el snapshot al arrancar si su
+generación no está ya en chroma_db (un contenedor nuevo sirve en segundos).
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from generations import (CURRENT_FILE, DB_DIR, GENERATION_ID_RE, MANIFEST_NAME, build_keyword_index,
+                         current_generation, generation_path, index_entries, keyword_index_path, list_generations, swap,
+                         validate_generation)
+
+FORMAT_VERSION = 1
+SNAPSHOT_FILE = "SNAPSHOT.json"
+EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+DOCS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "documents"))
+REGISTRY_FILE = os.path.join(DOCS_DIR, "metadata.json")
+# Default: chroma_db/snapshots (fuera del índice, ver generations._NOT_INDEX)
+SNAPSHOTS_DIR = os.getenv("SNAPSHOTS_DIR")
+_BLOCK = 1 << 20
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _snapshot_files(index_dir: str, db_dir: str) -> Dict[str, str]:
+    """Ruta dentro del snapshot -> ruta en disco"""
+    files = {}
+    for name in index_entries(index_dir):
+        path = os.path.join(index_dir, name)
+        if os.path.isdir(path):
+            for root, _, filenames in os.walk(path):
+                for filename in filenames:
+                    full = os.path.join(root, filename)
+                    files[f"index/{os.path.relpath(full, index_dir).replace(os.sep, '/')}"] = full
+        else:
+            files[f"index/{name}"] = path
+    # En el formato original el manifest vive en documents/
+    if f"index/{MANIFEST_NAME}" not in files and os.path.exists(os.path.join(DOCS_DIR, MANIFEST_NAME)):
+        files[f"index/{MANIFEST_NAME}"] = os.path.join(DOCS_DIR, MANIFEST_NAME)
+    for name, path in (("metadata.json", REGISTRY_FILE), ("hnsw_params.json", os.path.join(db_dir, "hnsw_params.json"))):
+        if os.path.exists(path):
+            files[f"registry/{name}"] = path
+    return files
+
+
+def _collection_counts(index_dir: str) -> Dict[str, int]:
+    import chromadb
+    from shards import list_shards
+
+    client = chromadb.PersistentClient(path=index_dir)
+    return {org_id: client.get_collection(name).count() for org_id, name in list_shards(client).items()}
+
+
+def export_snapshot(output: Optional[str] = None, generation: Optional[str] = None, db_dir: str = DB_DIR,
+                    level: int = 6) -> str:
+    """Empaqueta una generación (la activa por defecto); devuelve la ruta del snapshot"""
+    import chromadb
+
+    generation = generation or current_generation(db_dir)
+    index_dir = generation_path(db_dir, generation)
+    if not os.path.exists(os.path.join(index_dir, "chroma.sqlite3")):
+        raise ValueError(f"No hay índice en {index_dir}")
+    # El formato original no tiene id: el snapshot crea una generación nueva al importarse
+    snapshot_generation = generation or datetime.now().strftime("%Y%m%d-%H%M%S")
+    output = output or os.path.join(SNAPSHOTS_DIR or os.path.join(db_dir, "snapshots"), f"{snapshot_generation}.tar.gz")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    start = time.time()
+    files = _snapshot_files(index_dir, db_dir)
+    print(f"📸 Snapshot de la generación {generation or 'formato original'}: {len(files)} archivos")
+    info = {
+        "format_version": FORMAT_VERSION,
+        "generation": snapshot_generation,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "embedding_model": EMBEDDING_MODEL,
+        "chromadb": chromadb.__version__,
+        "collections": _collection_counts(index_dir),
+        "files": {name: {"sha256": _sha256(path), "size": os.path.getsize(path)}
+                  for name, path in sorted(files.items())},
+    }
+
+    tmp_output = f"{output}.tmp"
+    with tarfile.open(tmp_output, "w:gz", compresslevel=level) as tar:
+        header = json.dumps(info, indent=2, ensure_ascii=False).encode("utf-8")
+        member = tarfile.TarInfo(SNAPSHOT_FILE)
+        member.size, member.mtime = len(header), int(time.time())
+        tar.addfile(member, io.BytesIO(header))
+        for name in sorted(files):
+            tar.add(files[name], arcname=name, recursive=False)
+    os.replace(tmp_output, output)
+
+    digest = _sha256(output)
+    with open(f"{output}.sha256", "w", encoding="utf-8") as f:
+        f.write(f"{digest}  {os.path.basename(output)}\n")
+    raw = sum(entry["size"] for entry in info["files"].values())
+    print(f"✅ {output}: {os.path.getsize(output) / 1024 / 1024:.1f} MB "
+          f"({raw / 1024 / 1024:.1f} MB sin comprimir, {time.time() - start:.1f}s)")
+    return output
+
+
+def read_info(path: str) -> Dict:
+    """SNAPSHOT.json de un snapshot, sin extraer el resto"""
+    with tarfile.open(path, "r:*") as tar:
+        first = tar.next()
+        if first is None or first.name != SNAPSHOT_FILE:
+            raise ValueError(f"{path} no es un snapshot (falta {SNAPSHOT_FILE})")
+        return json.load(tar.extractfile(first))
+
+
+def _safe_target(root: str, name: str) -> str:
+    target = os.path.abspath(os.path.join(root, name))
+    if not target.startswith(os.path.abspath(root) + os.sep):
+        raise ValueError(f"Ruta fuera del snapshot: {name}")
+    return target
+
+
+def _restore_registry(extracted: str, db_dir: str, overwrite: bool):
+    """Registro de documentos y parámetros HNSW: solo si faltan, salvo overwrite"""
+    for name, path in (("metadata.json", REGISTRY_FILE), ("hnsw_params.json", os.path.join(db_dir, "hnsw_params.json"))):
+        source = os.path.join(extracted, name)
+        if not os.path.exists(source):
+            continue
+        if os.path.exists(path) and not overwrite:
+            print(f"   ℹ️ {path} ya existe; se conserva (--overwrite-registry para reemplazarlo)")
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copy2(source, path)
+        print(f"   📄 Restaurado {path}")
+
+
+def import_snapshot(path: str, db_dir: str = DB_DIR, activate: bool = True, validate: bool = True,
+                    overwrite_registry: bool = False) -> str:
+    """Extrae, verifica, valida y (por defecto) activa un snapshot; devuelve la generación"""
+    start = time.time()
+    info = read_info(path)
+    if info.get("format_version", 0) > FORMAT_VERSION:
+        raise ValueError(f"Snapshot con formato {info['format_version']}; este código lee hasta {FORMAT_VERSION}")
+    if info.get("embedding_model") != EMBEDDING_MODEL:
+        print(f"   ⚠️ Snapshot embebido con {info.get('embedding_model')}; la API usa {EMBEDDING_MODEL}")
+    try:
+        import chromadb
+        if info.get("chromadb", "").split(".")[:2] != chromadb.__version__.split(".")[:2]:
+            print(f"   ⚠️ Snapshot de Chroma {info.get('chromadb')}; instalado {chromadb.__version__}")
+    except ImportError:
+        pass
+
+    generation = info.get("generation")
+    # Viene del propio archivo: sin validarlo, "../../x" borraría o pisaría carpetas fuera de generations/
+    if not isinstance(generation, str) or not GENERATION_ID_RE.fullmatch(generation):
+        raise ValueError(f"Id de generación inválido en el snapshot: {generation!r}")
+    if generation in list_generations(db_dir):
+        print(f"ℹ️ La generación {generation} ya existe; no se vuelve a importar")
+        if activate and current_generation(db_dir) != generation:
+            swap(generation, db_dir)
+        return generation
+
+    root = os.path.join(db_dir, "generations")
+    work_dir = os.path.join(root, f"{generation}.importing")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    expected = info["files"]
+    seen = set()
+    try:
+        with tarfile.open(path, "r:*") as tar:
+            for member in tar:
+                if member.name == SNAPSHOT_FILE:
+                    continue
+                if not member.isfile() or member.name not in expected:
+                    raise ValueError(f"Miembro inesperado en el snapshot: {member.name}")
+                target = _safe_target(work_dir, member.name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                digest = hashlib.sha256()
+                source = tar.extractfile(member)
+                with open(target, "wb") as f:
+                    for block in iter(lambda: source.read(_BLOCK), b""):
+                        digest.update(block)
+                        f.write(block)
+                if digest.hexdigest() != expected[member.name]["sha256"]:
+                    raise ValueError(f"Checksum distinto: {member.name}")
+                seen.add(member.name)
+        missing = set(expected) - seen
+        if missing:
+            raise ValueError(f"Faltan {len(missing)} archivos en el snapshot (p. ej. {sorted(missing)[0]})")
+
+        index_dir = os.path.join(work_dir, "index")
+        if not os.path.isdir(keyword_index_path(index_dir)):
+            # Exportado del formato original: el índice de palabras clave se construía al arrancar
+            print("🔤 Construyendo índice de palabras clave...")
+            build_keyword_index(index_dir)
+        if validate:
+            report = validate_generation(index_dir)
+            if not report["ok"]:
+                raise ValueError("La generación importada no pasó la validación: " + "; ".join(report["errors"]))
+            if report["collections"] != info.get("collections", report["collections"]):
+                raise ValueError("Los fragmentos por colección no coinciden con los del snapshot")
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    _restore_registry(os.path.join(work_dir, "registry"), db_dir, overwrite_registry)
+    final_dir = os.path.join(root, generation)
+    os.rename(index_dir, final_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"✅ Generación {generation} importada ({sum(info['collections'].values())} fragmentos, "
+          f"{time.time() - start:.1f}s)")
+    if activate:
+        swap(generation, db_dir)
+    return generation
+
+
+def restore_on_start(path: str, db_dir: str = DB_DIR):
+    """serve.py: importa SNAPSHOT_RESTORE si su generación no está ya en chroma_db"""
+    if not os.path.exists(path):
+        print(f"⚠️ SNAPSHOT_RESTORE={path} no existe; se sirve el índice actual")
+        return
+    generation = read_info(path)["generation"]
+    if generation in list_generations(db_dir):
+        # Reinicio del contenedor: no se pisa una generación activada después (swap, build)
+        if not os.path.exists(os.path.join(db_dir, CURRENT_FILE)):
+            swap(generation, db_dir)
+        return
+    import_snapshot(path, db_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshots portables del índice")
+    parser.add_argument("--db-dir", default=DB_DIR)
+    sub = parser.add_subparsers(dest="comando", required=True)
+    export_parser = sub.add_parser("export", help="Empaquetar una generación")
+    export_parser.add_argument("--generation", help="Default: la activa")
+    export_parser.add_argument("-o", "--output")
+    export_parser.add_argument("--level", type=int, default=6, help="Compresión gzip (1-9)")
+    import_parser = sub.add_parser("import", help="Restaurar un snapshot como generación nueva")
+    import_parser.add_argument("archivo")
+    import_parser.add_argument("--no-activate", action="store_true")
+    import_parser.add_argument("--no-validate", action="store_true")
+    import_parser.add_argument("--overwrite-registry", action="store_true",
+                               help="Reemplazar documents/metadata.json y hnsw_params.json existentes")
+    info_parser = sub.add_parser("info", help="Mostrar el contenido de un snapshot")
+    info_parser.add_argument("archivo")
+    args = parser.parse_args()
+
+    try:
+        if args.comando == "export":
+            export_snapshot(args.output, args.generation, args.db_dir, args.level)
+        elif args.comando == "import":
+            import_snapshot(args.archivo, args.db_dir, activate=not args.no_activate,
+                            validate=not args.no_validate, overwrite_registry=args.overwrite_registry)
+        elif args.comando == "info":
+            info = read_info(args.archivo)
+            files = info.pop("files")
+            print(json.dumps(info, indent=2, ensure_ascii=False))
+            print(f"{len(files)} archivos, {sum(f['size'] for f in files.values()) / 1024 / 1024:.1f} MB sin comprimir")
+    except (ValueError, tarfile.TarError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
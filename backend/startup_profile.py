@@ -0,0 +1,93 @@
+"""
+Perfil de arranque en frío del proceso de la API (serve.py --profile-startup).
+
+1. Importa main.py en un intérprete nuevo con `-X importtime` y agrupa el
+   tiempo de importación por paquete de primer nivel.
+2. En este proceso mide cuándo quedan listos los endpoints ligeros
+   (/paises, /organizaciones) y cuánto tarda cada fase de inicialización
+   de la recuperación (modelo, ChromaDB, BM25, índice territorial).
+"""
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module: str = "main") -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """
+    Tiempo total de `import <module>` en un intérprete limpio y, por paquete
+    de primer nivel, (tiempo propio acumulado en µs, número de módulos).
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "import falló")
+
+    packages: Dict[str, Tuple[int, int]] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, _, name = [part.strip() for part in line[len("import time:"):].split("|")]
+            top = name.split(".")[0]
+            total, count = packages.get(top, (0, 0))
+            packages[top] = (total + int(self_us), count + 1)
+        except ValueError:
+            continue
+    return wall, packages
+
+
+def _timed(label: str, func, rows: List[Tuple[str, float]]):
+    start = time.perf_counter()
+    result = func()
+    rows.append((label, time.perf_counter() - start))
+    return result
+
+
+def profile_startup(top: int = 15):
+    print("=" * 60)
+    print("⏱️  Perfil de arranque en frío")
+    print("=" * 60)
+
+    wall, packages = import_times("main")
+    print(f"\nimport main (intérprete nuevo, incluye arranque de Python): {wall:.3f}s")
+    print(f"\n{'paquete':<28}{'ms propios':>12}{'módulos':>10}")
+    for name, (self_us, count) in sorted(packages.items(), key=lambda x: -x[1][0])[:top]:
+        print(f"{name:<28}{self_us / 1000:>12.1f}{count:>10}")
+
+    heavy = [m for m in ("torch", "sentence_transformers", "chromadb", "langchain_community", "numpy")
+             if m in packages]
+    if heavy:
+        print(f"\n⚠️ Dependencias pesadas importadas al arrancar: {', '.join(heavy)}")
+    else:
+        print("\n✅ Ninguna dependencia pesada se importa al arrancar.")
+
+    # Fases en este proceso
+    rows: List[Tuple[str, float]] = []
+    process_start = time.perf_counter()
+    main = _timed("import main", lambda: __import__("main"), rows)
+    _timed("GET /paises", main.obtener_paises, rows)
+    _timed("GET /organizaciones/{pais}", lambda: main.obtener_organizaciones("Mexico"), rows)
+    light_ready = time.perf_counter() - process_start
+
+    from territorial import get_territorial_engine
+    from chat_service import get_rag
+    _timed("índice territorial", get_territorial_engine, rows)
+    rag = _timed("RAGProcessor (total)", get_rag, rows)
+    for phase, seconds in rag.init_timings.items():
+        rows.append((f"  └ {phase}", seconds))
+    if rag.db:
+        _timed("primer embedding de consulta", lambda: rag.embed_query("misión de la organización"), rows)
+    full_ready = time.perf_counter() - process_start
+
+    print(f"\n{'fase':<36}{'segundos':>10}")
+    for label, seconds in rows:
+        print(f"{label:<36}{seconds:>10.3f}")
+    print(f"\nEndpoints ligeros listos tras {light_ready:.3f}s; recuperación lista tras {full_ready:.3f}s")
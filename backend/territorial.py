@@ -0,0 +1,482 @@
+"""
+Motor territorial para /insight-territorial.
+
+- Las ubicaciones de organizaciones y documentos (documents/locations.json)
+  se guardan en un índice espacial de grilla (celdas de TERRITORIAL_CELL_DEG grados).
+- Para un clic en el mapa se buscan las organizaciones y documentos más cercanos.
+- Los insights se generan offline por vecindario (conjunto de organizaciones a
+  menos de TERRITORIAL_RADIUS_KM de una celda) a partir de los fragmentos
+  recuperados, y se guardan en un caché JSON. En línea solo se hace un lookup.
+
+Uso:
+    python territorial.py precompute          # genera territorial_cache.json
+    python territorial.py query 0.43 -78.02   # prueba un punto
+"""
+import argparse
+import json
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+DOCS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "documents"))
+LOCATIONS_FILE = os.path.join(DOCS_DIR, "locations.json")
+
+DB_DIR = os.getenv("CHROMA_DB_DIR")
+if not DB_DIR:
+    DB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chroma_db"))
+
+TERRITORIAL_CACHE_FILE = os.getenv("TERRITORIAL_CACHE_FILE") or os.path.join(DB_DIR, "territorial_cache.json")
+TERRITORIAL_CELL_DEG = float(os.getenv("TERRITORIAL_CELL_DEG", "0.5"))
+TERRITORIAL_RADIUS_KM = float(os.getenv("TERRITORIAL_RADIUS_KM", "150"))
+
+CACHE_VERSION = 1
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = 111.32
+
+# Aspectos del análisis territorial y la consulta usada para recuperar evidencia
+ASPECTOS = [
+    ("Amenazas principales", "amenazas deforestación degradación riesgos climáticos del territorio"),
+    ("Servicios ecosistémicos clave", "servicios ecosistémicos agua carbono biodiversidad suelos"),
+    ("Medios de vida más afectados", "medios de vida comunidades producción agrícola ingresos familias"),
+    ("Conflictos presentes", "conflictos uso del suelo acceso al agua tenencia de la tierra"),
+    ("Soluciones Basadas en Naturaleza sugeridas", "soluciones basadas en la naturaleza restauración agroforestería"),
+    ("Por qué importa esta zona", "importancia del paisaje conectividad ecosistemas áreas protegidas"),
+]
+
+# Texto genérico (sin caché precalculado)
+GENERIC_INSIGHT = (
+    "**Amenazas principales:** Deforestación, expansión agrícola no sostenible, cambio climático.\n\n"
+    "**Servicios ecosistémicos clave:** Regulación hídrica, captura de carbono, conservación de biodiversidad.\n\n"
+    "**Medios de vida más afectados:** Agricultura familiar, turismo comunitario, pesca artesanal.\n\n"
+    "**Conflictos presentes:** Uso de suelo, acceso al agua, tenencia de tierra.\n\n"
+    "**Soluciones Basadas en Naturaleza sugeridas:** Agroforestería, restauración de riberas, corredores biológicos.\n\n"
+    "**Por qué importa esta zona:** Corredor biológico crítico para la conectividad de ecosistemas en la región."
+)
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Distancia de gran círculo en km"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Índice espacial de grilla regular (lat/lng en grados)"""
+
+    def __init__(self, cell_deg: float = TERRITORIAL_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.cells: Dict[Tuple[int, int], List[Tuple[float, float, dict]]] = {}
+        self.size = 0
+
+    def cell_of(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def insert(self, lat: float, lng: float, item: dict):
+        self.cells.setdefault(self.cell_of(lat, lng), []).append((lat, lng, item))
+        self.size += 1
+
+    def nearest(self, lat: float, lng: float, k: int = 3,
+                max_km: Optional[float] = None) -> List[Tuple[float, dict]]:
+        """
+        k elementos más cercanos, buscando por anillos de celdas alrededor del punto
+        (las columnas dan la vuelta en el antimeridiano). Se detiene cuando ningún
+        anillo más lejano puede mejorar el k-ésimo resultado; si el punto está lejos
+        de todo y recorrer anillos cuesta más que las celdas ocupadas, las revisa todas.
+        """
+        if not self.size:
+            return []
+
+        row, col = self.cell_of(lat, lng)
+        n_cols = max(1, int(round(360.0 / self.cell_deg)))
+        half = n_cols // 2
+        found: List[Tuple[float, dict]] = []
+        seen = set()
+        visited = 0
+
+        for ring in range(max(n_cols, int(math.ceil(180.0 / self.cell_deg))) + 1):
+            perimeter = [(r, c) for r in (row - ring, row + ring) for c in range(col - ring, col + ring + 1)]
+            perimeter += [(r, c) for c in (col - ring, col + ring) for r in range(row - ring + 1, row + ring)]
+            if len(seen) + len(perimeter) > len(self.cells):
+                return self._scan(lat, lng, k, max_km)
+            for r, c in perimeter:
+                # Misma numeración de columnas que cell_of para lng en [-180, 180)
+                key = (r, (c + half) % n_cols - half)
+                if key in seen:
+                    continue
+                seen.add(key)
+                for item_lat, item_lng, item in self.cells.get(key, ()):
+                    visited += 1
+                    dist = haversine_km(lat, lng, item_lat, item_lng)
+                    if max_km is None or dist <= max_km:
+                        found.append((dist, item))
+
+            found.sort(key=lambda x: x[0])
+            bound_km = self._outside_bound_km(lat, lng, row, col, ring, n_cols)
+            if visited >= self.size:
+                break
+            if max_km is not None and bound_km > max_km:
+                break
+            if len(found) >= k and found[k - 1][0] <= bound_km:
+                break
+
+        return found[:k]
+
+    def _outside_bound_km(self, lat: float, lng: float, row: int, col: int, ring: int, n_cols: int) -> float:
+        """
+        Distancia mínima posible a un elemento fuera de los anillos 0..ring: o está
+        en otra fila (al menos la distancia en latitud al borde) o en una fila del
+        bloque y otra columna (distancia en longitud, en el paralelo más cercano al polo)
+        """
+        lat_lo, lat_hi = (row - ring) * self.cell_deg, (row + ring + 1) * self.cell_deg
+        lat_gap = min(lat - lat_lo if lat_lo > -90.0 else math.inf, lat_hi - lat if lat_hi < 90.0 else math.inf)
+        lat_km = math.radians(lat_gap) * EARTH_RADIUS_KM if lat_gap != math.inf else math.inf
+
+        if 2 * ring + 1 >= n_cols:
+            lng_km = math.inf
+        else:
+            lng_gap = min(lng - (col - ring) * self.cell_deg, (col + ring + 1) * self.cell_deg - lng, 180.0)
+            max_lat = min(90.0, max(abs(lat_lo), abs(lat_hi)))
+            lng_km = 2 * EARTH_RADIUS_KM * math.asin(
+                min(1.0, math.cos(math.radians(max_lat)) * math.sin(math.radians(lng_gap) / 2)))
+        return min(lat_km, lng_km)
+
+    def _scan(self, lat: float, lng: float, k: int, max_km: Optional[float]) -> List[Tuple[float, dict]]:
+        """Todos los elementos por distancia (pocos elementos o punto lejos de todos)"""
+        found = [(haversine_km(lat, lng, item_lat, item_lng), item)
+                 for items in self.cells.values() for item_lat, item_lng, item in items]
+        found = [(dist, item) for dist, item in found if max_km is None or dist <= max_km]
+        found.sort(key=lambda x: x[0])
+        return found[:k]
+
+
+class TerritorialEngine:
+    """Índices espaciales + caché de insights precalculados"""
+
+    def __init__(self,
+                 locations_file: str = LOCATIONS_FILE,
+                 cache_file: str = TERRITORIAL_CACHE_FILE,
+                 cell_deg: float = TERRITORIAL_CELL_DEG,
+                 radius_km: float = TERRITORIAL_RADIUS_KM):
+        self.locations_file = locations_file
+        self.cache_file = cache_file
+        self.cell_deg = cell_deg
+        self.radius_km = radius_km
+        self.org_index = GridIndex(cell_deg)
+        self.doc_index = GridIndex(cell_deg)
+        self.orgs: Dict[str, dict] = {}
+        self.cache: dict = {}
+        self._cache_mtime = None
+        self._load_locations()
+        self._load_cache()
+
+    # --- Índices ---
+
+    def _load_locations(self):
+        if not os.path.exists(self.locations_file):
+            print("⚠️ No hay documents/locations.json; el insight territorial será genérico.")
+            return
+
+        with open(self.locations_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        # Nombre visible (el del frontend) por org_id
+        from chat_service import ORG_NAME_TO_FOLDER
+        display = {folder: name for name, folder in ORG_NAME_TO_FOLDER.items()}
+
+        for org_id, loc in data.get("organizaciones", {}).items():
+            org = {"org_id": org_id, "nombre": display.get(org_id, org_id),
+                   "lugar": loc.get("lugar"), "lat": loc["lat"], "lng": loc["lng"]}
+            self.orgs[org_id] = org
+            self.org_index.insert(loc["lat"], loc["lng"], org)
+
+        # Documentos: heredan la ubicación de su organización salvo override
+        overrides = data.get("documentos", {})
+        orgs_dir = os.path.join(DOCS_DIR, "orgs")
+        if os.path.exists(orgs_dir):
+            for org_id in os.listdir(orgs_dir):
+                org_path = os.path.join(orgs_dir, org_id)
+                if not os.path.isdir(org_path):
+                    continue
+                for file in os.listdir(org_path):
+                    if not file.lower().endswith(".pdf"):
+                        continue
+                    loc = overrides.get(file) or self.orgs.get(org_id)
+                    if loc:
+                        self.doc_index.insert(loc["lat"], loc["lng"], {"source": file, "org_id": org_id})
+
+    def _load_cache(self):
+        """Carga (o recarga si cambió en disco) el caché precalculado"""
+        try:
+            mtime = os.path.getmtime(self.cache_file)
+        except OSError:
+            self.cache = {}
+            return
+        if mtime == self._cache_mtime:
+            return
+        with open(self.cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get("version") != CACHE_VERSION or cache.get("cell_deg") != self.cell_deg:
+            print("⚠️ Caché territorial con otra versión o tamaño de celda; ignorado.")
+            cache = {}
+        self.cache = cache
+        self._cache_mtime = mtime
+
+    def cell_key(self, lat: float, lng: float) -> str:
+        row, col = self.org_index.cell_of(lat, lng)
+        return f"{row},{col}"
+
+    def nearby_orgs(self, lat: float, lng: float, k: int = 3) -> List[Tuple[float, dict]]:
+        return self.org_index.nearest(lat, lng, k=k, max_km=self.radius_km)
+
+    def nearest_documents(self, lat: float, lng: float, k: int = 5) -> List[Tuple[float, dict]]:
+        return self.doc_index.nearest(lat, lng, k=k, max_km=self.radius_km)
+
+    # --- Consulta en línea ---
+
+    def insight(self, lat: float, lng: float, nombre_ubicacion: Optional[str] = None) -> dict:
+        """Insight para un punto: lookup en índices + caché, sin RAG ni LLM"""
+        self._load_cache()
+
+        contexto_ubicacion = f"Coordenadas: {lat}, {lng}"
+        if nombre_ubicacion:
+            contexto_ubicacion += f", Ubicación: {nombre_ubicacion}"
+
+        cercanas = self.nearby_orgs(lat, lng)
+        documentos = self.nearest_documents(lat, lng)
+        cell = self.cell_key(lat, lng)
+
+        insights = self.cache.get("insights", {})
+        key = self.cache.get("cells", {}).get(cell)
+        partes = [f"**Análisis Territorial** - {contexto_ubicacion}"]
+
+        if cercanas:
+            lista = ", ".join(f"{org['nombre']} ({dist:.0f} km)" for dist, org in cercanas)
+            partes.append(f"**Organizaciones PARES cercanas:** {lista}")
+            if key not in insights:
+                # Celda sin precalcular: usar el insight de la organización más cercana
+                key = cercanas[0][1]["org_id"]
+        else:
+            lejana = self.org_index.nearest(lat, lng, k=1)
+            if lejana:
+                dist, org = lejana[0]
+                partes.append(
+                    f"No hay organizaciones socias PARES a menos de {self.radius_km:.0f} km. "
+                    f"La más cercana es **{org['nombre']}** ({org.get('lugar') or 'sin lugar'}), a {dist:.0f} km."
+                )
+                key = org["org_id"]
+
+        entry = insights.get(key) if key else None
+        if entry:
+            partes.append(entry["texto"])
+        else:
+            partes.append(GENERIC_INSIGHT)
+
+        if documentos:
+            nombres = list(dict.fromkeys(doc["source"] for _, doc in documentos))
+            partes.append("**Documentos de referencia:** " + ", ".join(nombres))
+
+        return {
+            "respuesta": "\n\n".join(partes),
+            "celda": cell,
+            "precalculado": bool(entry),
+            "organizaciones_cercanas": [
+                {"org_id": org["org_id"], "nombre": org["nombre"], "distancia_km": round(dist, 1)}
+                for dist, org in cercanas
+            ],
+            "documentos_cercanos": [
+                {"source": doc["source"], "org_id": doc["org_id"], "distancia_km": round(dist, 1)}
+                for dist, doc in documentos
+            ],
+        }
+
+    # --- Precálculo offline ---
+
+    def neighbourhoods(self) -> Dict[str, List[str]]:
+        """Mapea cada celda a menos de radius_km de alguna organización a su vecindario"""
+        cells: Dict[str, List[str]] = {}
+        span = int(math.ceil(self.radius_km / (KM_PER_DEG * self.cell_deg))) + 1
+        for org in self.orgs.values():
+            row, col = self.org_index.cell_of(org["lat"], org["lng"])
+            for r in range(row - span, row + span + 1):
+                for c in range(col - span, col + span + 1):
+                    key = f"{r},{c}"
+                    if key in cells:
+                        continue
+                    center_lat = (r + 0.5) * self.cell_deg
+                    center_lng = (c + 0.5) * self.cell_deg
+                    cercanas = self.nearby_orgs(center_lat, center_lng)
+                    if cercanas:
+                        cells[key] = sorted(o["org_id"] for _, o in cercanas)
+        return cells
+
+    def precompute(self, rag, use_llm: bool = True) -> dict:
+        """Genera el caché de insights por vecindario a partir del índice RAG"""
+        cell_orgs = self.neighbourhoods()
+        groups = {"|".join(ids): ids for ids in cell_orgs.values()}
+        # Cada organización tiene también su propio insight (clics lejanos)
+        for org_id in self.orgs:
+            groups.setdefault(org_id, [org_id])
+
+        print(f"🗺️ {len(cell_orgs)} celdas, {len(groups)} vecindarios a precalcular...")
+        insights = {}
+        for key, org_ids in groups.items():
+            start = time.time()
+            insights[key] = self._generate_insight(rag, org_ids, use_llm)
+            print(f"   ✓ {key} ({time.time() - start:.1f}s)")
+
+        cache = {
+            "version": CACHE_VERSION,
+            "generado": datetime.now().isoformat(),
+            "cell_deg": self.cell_deg,
+            "radius_km": self.radius_km,
+            "insights": insights,
+            "cells": {cell: "|".join(ids) for cell, ids in cell_orgs.items()},
+        }
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+        self._load_cache()
+        return cache
+
+    def _generate_insight(self, rag, org_ids: List[str], use_llm: bool) -> dict:
+        # Una consulta por (aspecto, organización), recuperadas en un solo lote
+        queries, targets = [], []
+        for _, consulta in ASPECTOS:
+            for org_id in org_ids:
+                lugar = self.orgs.get(org_id, {}).get("lugar") or ""
+                queries.append(f"{consulta} {lugar}".strip())
+                targets.append(org_id)
+        results = rag.search_tiered_batch(queries, targets)
+
+        por_aspecto = []
+        for i, (titulo, _) in enumerate(ASPECTOS):
+            docs = []
+            for j in range(len(org_ids)):
+                docs.extend(results[i * len(org_ids) + j])
+            # Primero la evidencia de las organizaciones
+            docs.sort(key=lambda d: 0 if "Tier 1" in d.metadata.get("retrieval_tier", "") else 1)
+            por_aspecto.append((titulo, docs))
+
+        fuentes = sorted({
+            f"{d.metadata.get('source')} (Pág. {d.metadata.get('page', '?')})"
+            for _, docs in por_aspecto for d in docs[:2]
+        })
+
+        texto = self._llm_insight(org_ids, por_aspecto) if use_llm else None
+        if not texto:
+            texto = self._extractive_insight(por_aspecto)
+        return {"organizaciones": org_ids, "texto": texto, "fuentes": fuentes}
+
+    @staticmethod
+    def _best_sentence(docs) -> Optional[str]:
+        """Primera oración sustantiva del fragmento mejor ubicado, con su cita"""
+        for doc in docs[:3]:
+            content = re.sub(r'\s+', ' ', doc.page_content).strip()
+            for sentence in re.split(r'(?<=[.!?])\s+', content):
+                if len(sentence) >= 60:
+                    if len(sentence) > 300:
+                        sentence = sentence[:300].rsplit(' ', 1)[0] + "..."
+                    source = os.path.basename(doc.metadata.get('source', 'unknown'))
+                    return f"{sentence} _({source}, pág. {doc.metadata.get('page', '?')})_"
+        return None
+
+    def _extractive_insight(self, por_aspecto) -> str:
+        partes = []
+        for titulo, docs in por_aspecto:
+            frase = self._best_sentence(docs)
+            partes.append(f"**{titulo}:** {frase or 'Sin evidencia en los documentos.'}")
+        return "\n\n".join(partes)
+
+    def _llm_insight(self, org_ids: List[str], por_aspecto) -> Optional[str]:
+        from chat_service import get_llm
+        llm = get_llm()
+        if not llm:
+            return None
+        try:
+            from langchain_core.messages import HumanMessage
+
+            contexto = []
+            for titulo, docs in por_aspecto:
+                for doc in docs[:3]:
+                    source = os.path.basename(doc.metadata.get('source', 'unknown'))
+                    contexto.append(f"--- [{titulo}] SOURCE: {source} ---\n{doc.page_content}\n")
+            lugares = "; ".join(
+                f"{self.orgs[o]['nombre']} ({self.orgs[o].get('lugar')})" for o in org_ids if o in self.orgs
+            )
+            secciones = "\n".join(f"**{titulo}:** ..." for titulo, _ in ASPECTOS)
+
+            prompt = f"""You are a territorial analyst for the PARES Project (Conservation & Sustainable Development).
+Using ONLY the context below, write a short territorial insight for the area where these partner
+organizations work: {lugares}.
+
+CONTEXT:
+{"".join(contexto)}
+
+INSTRUCTIONS:
+- Write in Spanish, one or two sentences per section, exactly with these section headers:
+{secciones}
+- If the context has no evidence for a section, say so briefly.
+
+RESPONSE:"""
+            response = llm.invoke([HumanMessage(content=prompt)])
+            return response.content.strip()
+        except Exception as e:
+            print(f"Error usando LLM para insight territorial: {e}")
+            return None
+
+
+_engine: Optional[TerritorialEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_territorial_engine() -> TerritorialEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TerritorialEngine()
+        return _engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Motor territorial PARES")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    pre = sub.add_parser("precompute", help="Precalcula los insights por celda")
+    pre.add_argument("--sin-llm", action="store_true", help="Solo insights extractivos")
+
+    query = sub.add_parser("query", help="Consulta el insight de un punto")
+    query.add_argument("lat", type=float)
+    query.add_argument("lng", type=float)
+
+    args = parser.parse_args()
+    engine = TerritorialEngine()
+
+    if args.command == "precompute":
+        from dotenv import load_dotenv
+        from chat_service import get_rag
+        load_dotenv()
+        rag = get_rag()
+        if not rag.db:
+            print("⚠️ Base de datos no encontrada. Ejecute ingest.py primero.")
+            return
+        cache = engine.precompute(rag, use_llm=not args.sin_llm)
+        print(f"✅ Caché territorial guardado en {engine.cache_file} ({len(cache['insights'])} insights)")
+    else:
+        start = time.perf_counter()
+        result = engine.insight(args.lat, args.lng)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(result["respuesta"])
+        print(f"\n({elapsed_ms:.2f} ms, precalculado={result['precalculado']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Pruebas de AdmissionController (429, 503, desconexión) sin servidor.
+
+    python -m pytest -q test_admission.py
+    python test_admission.py
+"""
+import asyncio
+import threading
+import time
+
+import admission
+from admission import AdmissionController, ClientDisconnected, Overloaded
+
+admission.DISCONNECT_POLL_S = 0.01
+
+
+class FakeRequest:
+    """Lo único que usa AdmissionController de starlette.Request"""
+
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+
+def _blocking(release: threading.Event, cancelled: threading.Event = None):
+    release.wait(5)
+    return "ok"
+
+
+async def _rejected_with(controller: AdmissionController) -> int:
+    try:
+        await controller.run(FakeRequest(), lambda cancelled: "ok")
+    except Overloaded as e:
+        return e.status_code
+    return 200
+
+
+def test_full_queue_returns_429():
+    async def scenario():
+        controller = AdmissionController("prueba", max_concurrency=1, max_queue=0, queue_timeout_s=1)
+        release = threading.Event()
+        running = asyncio.ensure_future(controller.run(FakeRequest(), _blocking, release))
+        await asyncio.sleep(0.05)
+        status = await _rejected_with(controller)
+        release.set()
+        assert await running == "ok"
+        return status, controller.stats()
+
+    status, stats = asyncio.run(scenario())
+    assert status == 429
+    assert stats["rechazadas_429"] == 1 and stats["admitidas"] == 1
+    assert stats["en_curso"] == 0 and stats["en_cola"] == 0
+
+
+def test_queue_timeout_returns_503():
+    async def scenario():
+        controller = AdmissionController("prueba", max_concurrency=1, max_queue=1, queue_timeout_s=0.1)
+        release = threading.Event()
+        running = asyncio.ensure_future(controller.run(FakeRequest(), _blocking, release))
+        await asyncio.sleep(0.05)
+        status = await _rejected_with(controller)
+        release.set()
+        await running
+        # El lugar quedó libre: la siguiente entra
+        return status, await controller.run(FakeRequest(), lambda cancelled: "ok"), controller.stats()
+
+    status, result, stats = asyncio.run(scenario())
+    assert status == 503 and result == "ok"
+    assert stats["rechazadas_503"] == 1 and stats["en_cola"] == 0
+
+
+def test_disconnect_cancels_running_request_and_frees_slot():
+    seen = {}
+
+    def work(cancelled: threading.Event = None):
+        deadline = time.monotonic() + 5
+        while not cancelled.is_set() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        seen["cancelled"] = cancelled.is_set()
+
+    async def scenario():
+        controller = AdmissionController("prueba", max_concurrency=1, max_queue=0, queue_timeout_s=1)
+        request = FakeRequest()
+        running = asyncio.ensure_future(controller.run(request, work))
+        await asyncio.sleep(0.05)
+        request.disconnected = True
+        try:
+            await running
+            raise AssertionError("se esperaba ClientDisconnected")
+        except ClientDisconnected:
+            pass
+        # El hilo ve `cancelled`, termina y libera el lugar
+        for _ in range(100):
+            if controller.active == 0:
+                break
+            await asyncio.sleep(0.01)
+        return await controller.run(FakeRequest(), lambda cancelled: "ok"), controller.stats()
+
+    result, stats = asyncio.run(scenario())
+    assert seen["cancelled"] and result == "ok"
+    assert stats["canceladas"] == 1 and stats["en_curso"] == 0
+
+
+def test_disconnect_while_queued_cancels_without_running():
+    calls = []
+
+    async def scenario():
+        controller = AdmissionController("prueba", max_concurrency=1, max_queue=1, queue_timeout_s=5)
+        release = threading.Event()
+        running = asyncio.ensure_future(controller.run(FakeRequest(), _blocking, release))
+        await asyncio.sleep(0.05)
+        request = FakeRequest()
+        queued = asyncio.ensure_future(controller.run(request, lambda cancelled: calls.append(1)))
+        await asyncio.sleep(0.05)
+        request.disconnected = True
+        try:
+            await queued
+            raise AssertionError("se esperaba ClientDisconnected")
+        except ClientDisconnected:
+            pass
+        release.set()
+        await running
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert calls == []
+    assert stats["canceladas"] == 1 and stats["admitidas"] == 1 and stats["en_cola"] == 0
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"✅ {name}")
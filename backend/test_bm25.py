@@ -0,0 +1,75 @@
+"""
+Pruebas de SparseBM25 y la tokenización en español (sin Chroma ni modelo).
+
+    python -m pytest -q test_bm25.py
+    python test_bm25.py
+"""
+import tempfile
+
+from rag_processor import SparseBM25, tokenize_es
+
+CORPUS = {
+    "ids": ["a1", "a2", "a3", "b1", "g1"],
+    "documents": [
+        "Restauración de manglares y pesca artesanal en la costa.",
+        "Manglares, manglares y más manglares: el plan de restauración.",
+        "Talleres de cacao con la comunidad.",
+        "Misión: conservar los bosques nublados.",
+        "Guía global de restauración de ecosistemas.",
+    ],
+    "metadatas": [
+        {"org_id": "A", "scope": "org"},
+        {"org_id": "A", "scope": "org"},
+        {"org_id": "A", "scope": "org"},
+        {"org_id": "B", "scope": "org"},
+        {"org_id": "GLOBAL", "scope": "global"},
+    ],
+}
+
+
+def _ids(docs):
+    return [d.metadata["chunk_id"] for d in docs]
+
+
+def test_tokenize_es_folds_accents_and_plurals():
+    assert tokenize_es("Misión") == tokenize_es("mision")
+    assert tokenize_es("manglares") == tokenize_es("manglar")
+    assert tokenize_es("de la y los") == []
+
+
+def test_search_ranks_by_term_frequency():
+    bm25 = SparseBM25(CORPUS)
+    assert _ids(bm25.search("manglares", k=5)) == ["a2", "a1"]
+
+
+def test_org_filter_applies_before_top_k():
+    bm25 = SparseBM25(CORPUS)
+    query = "manglares pesca plan conservar"
+    # Sin filtro los de A ocupan el top-2; con filtro B recibe su propio mejor fragmento
+    assert _ids(bm25.search(query, k=2)) == ["a2", "a1"]
+    assert _ids(bm25.search(query, k=2, filter_dict={"org_id": "B"})) == ["b1"]
+    assert _ids(bm25.search("restauración", k=5, filter_dict={"scope": "global"})) == ["g1"]
+    assert bm25.search("cacao", k=5, filter_dict={"org_id": "B"}) == []
+
+
+def test_unknown_terms_return_nothing():
+    bm25 = SparseBM25(CORPUS)
+    assert bm25.search("xilófono", k=5) == []
+
+
+def test_save_and_load_keep_results():
+    bm25 = SparseBM25(CORPUS)
+    with tempfile.TemporaryDirectory() as path:
+        bm25.save(path)
+        for mmap in (False, True):
+            loaded = SparseBM25.load(path, mmap=mmap)
+            assert len(loaded) == len(bm25)
+            for query, filter_dict in (("manglares", None), ("restauración", {"org_id": "A"})):
+                assert _ids(loaded.search(query, 5, filter_dict)) == _ids(bm25.search(query, 5, filter_dict))
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"✅ {name}")
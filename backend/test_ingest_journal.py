@@ -0,0 +1,93 @@
+"""
+Pruebas de IngestJournal: recuperación tras un corte y reintentos con espera.
+
+    python -m pytest -q test_ingest_journal.py
+    python test_ingest_journal.py
+"""
+import json
+import os
+import tempfile
+
+import ingest_journal
+from ingest_journal import IngestJournal
+
+
+def test_recover_applies_done_files_and_ignores_truncated_line():
+    with tempfile.TemporaryDirectory() as root:
+        manifest_file = os.path.join(root, "manifest.json")
+        journal = IngestJournal(manifest_file)
+        journal.done("a.pdf", "h1")
+        journal.failed("b.pdf", "h2", RuntimeError("PDF ilegible"))
+        # El proceso muere mientras escribe la línea de c.pdf
+        with open(journal.path, "a", encoding="utf-8") as f:
+            f.write('{"status": "done", "file": "c.pdf", "ha')
+
+        # b.pdf estaba en el manifest de una ingesta anterior: al fallar sus fragmentos se borraron
+        manifest = {"b.pdf": "h0", "viejo.pdf": "h9"}
+        restarted = IngestJournal(manifest_file)
+        assert restarted.recover(manifest) == 1
+        assert manifest == {"a.pdf": "h1", "viejo.pdf": "h9"}
+        assert restarted.failures["b.pdf"]["attempts"] == 1
+        assert restarted.pending == 2
+
+
+def test_recover_without_journal_is_a_no_op():
+    with tempfile.TemporaryDirectory() as root:
+        manifest = {"a.pdf": "h1"}
+        assert IngestJournal(os.path.join(root, "manifest.json")).recover(manifest) == 0
+        assert manifest == {"a.pdf": "h1"}
+
+
+def test_retry_backoff_doubles_until_abandoned():
+    saved = (ingest_journal.INGEST_RETRY_BASE_S, ingest_journal.INGEST_RETRY_MAX_S,
+             ingest_journal.INGEST_MAX_ATTEMPTS)
+    ingest_journal.INGEST_RETRY_BASE_S, ingest_journal.INGEST_RETRY_MAX_S = 100.0, 300.0
+    ingest_journal.INGEST_MAX_ATTEMPTS = 4
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            journal = IngestJournal(os.path.join(root, "manifest.json"))
+            assert journal.retry_wait("a.pdf", "h1") is None
+            waits = []
+            for _ in range(4):
+                failure = journal.failed("a.pdf", "h1", ValueError("x"))
+                waits.append(round(failure["next_retry"] - failure["last_attempt"]))
+            assert waits == [100, 200, 300, 300]
+            assert failure["attempts"] == 4 and failure["abandoned"]
+            assert journal.retry_wait("a.pdf", "h1") == float("inf")
+
+            # El PDF cambió: se reintenta ya y los intentos vuelven a empezar
+            assert journal.retry_wait("a.pdf", "h2") is None
+            assert journal.failed("a.pdf", "h2", ValueError("x"))["attempts"] == 1
+            assert 99 < journal.retry_wait("a.pdf", "h2") <= 100
+
+            journal.done("a.pdf", "h3")
+            assert journal.retry_wait("a.pdf", "h3") is None
+    finally:
+        (ingest_journal.INGEST_RETRY_BASE_S, ingest_journal.INGEST_RETRY_MAX_S,
+         ingest_journal.INGEST_MAX_ATTEMPTS) = saved
+
+
+def test_checkpoint_persists_manifest_and_failures():
+    with tempfile.TemporaryDirectory() as root:
+        manifest_file = os.path.join(root, "manifest.json")
+        journal = IngestJournal(manifest_file)
+        journal.done("a.pdf", "h1")
+        journal.failed("b.pdf", "h2", RuntimeError("x"))
+        journal.checkpoint({"a.pdf": "h1"})
+
+        assert not os.path.exists(journal.path) and journal.pending == 0
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            assert json.load(f) == {"a.pdf": "h1"}
+        assert set(IngestJournal(manifest_file).failures) == {"b.pdf"}
+
+        # Sin errores pendientes el archivo de errores se borra
+        journal.forget_missing(["a.pdf"])
+        journal.checkpoint({"a.pdf": "h1"})
+        assert not os.path.exists(journal.failures_file)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"✅ {name}")
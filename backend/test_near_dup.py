@@ -0,0 +1,92 @@
+"""
+Pruebas de NearDupIndex (MinHash/LSH, alias, diario) sin Chroma.
+
+    python -m pytest -q test_near_dup.py
+    python test_near_dup.py
+"""
+import os
+import tempfile
+
+from near_dup import NEAR_DUP_JOURNAL, NearDupIndex, similarity
+
+MANUAL = ("El manual de monitoreo comunitario describe cómo registrar cada visita de campo, "
+          "qué indicadores de restauración medir en las parcelas, cómo fotografiar los puntos "
+          "fijos y cómo enviar los formularios al equipo técnico al final de cada mes.")
+# Misma página con una corrección menor (versión _rev)
+MANUAL_REV = MANUAL.replace("al final de cada mes", "al final de cada mes calendario")
+OTRO = ("La cooperativa de cacao vende su producción a compradores de comercio justo y reinvierte "
+        "las utilidades en viveros, capacitación de jóvenes y caminos rurales para las veredas "
+        "más alejadas del municipio durante la temporada seca.")
+
+
+def _reference(source: str, collection: str = "org_a", page: int = 1):
+    return {"collection": collection, "source": source, "full_path": f"/docs/{source}", "page": page, "bytes": 100}
+
+
+def test_signatures_estimate_similarity():
+    index = NearDupIndex()
+    manual, rev, otro = (index.hasher.signature(t) for t in (MANUAL, MANUAL_REV, OTRO))
+    assert similarity(manual, index.hasher.signature(MANUAL)) == 1.0
+    assert similarity(manual, rev) >= index.threshold
+    assert similarity(manual, otro) < 0.2
+    assert index.hasher.signature("") is None
+
+
+def test_find_prefers_same_collection_and_ignores_others():
+    index = NearDupIndex()
+    signature = index.hasher.signature(MANUAL)
+    index.add("g1", "global", "manual.pdf", signature)
+    index.add("a1", "org_a", "manual.pdf", signature)
+    index.add("a2", "org_a", "cacao.pdf", index.hasher.signature(OTRO))
+
+    rev = index.hasher.signature(MANUAL_REV)
+    assert index.find(rev, "org_a")["id"] == "a1"
+    assert index.find(rev, "global")["id"] == "g1"
+    # En otra colección igual lo encuentra (para copiar su embedding)
+    assert index.find(rev, "org_b")["collection"] in ("global", "org_a")
+
+
+def test_remove_source_drops_chunks_and_aliases():
+    index = NearDupIndex()
+    index.add("a1", "org_a", "manual.pdf", index.hasher.signature(MANUAL))
+    index.add_alias("a1", _reference("manual_rev.pdf", page=3))
+    assert index.alias_label("a1") == "manual_rev.pdf (p. 3)"
+    assert index.dependents("org_a", "manual.pdf") == {"/docs/manual_rev.pdf"}
+
+    # Reprocesar la versión revisada: el original pierde el alias
+    assert index.remove_source("org_a", "manual_rev.pdf") == {"a1"}
+    assert index.alias_label("a1") is None
+
+    # Reprocesar el original: ya no se encuentra
+    index.remove_source("org_a", "manual.pdf")
+    assert index.find(index.hasher.signature(MANUAL), "org_a") is None
+    assert len(index) == 0
+
+
+def test_journal_replay_ignores_truncated_line():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "near_dup")
+        index = NearDupIndex()
+        index.add("a1", "org_a", "manual.pdf", index.hasher.signature(MANUAL))
+        index.save(path)
+
+        # Un archivo terminado después del guardado (en el diario)...
+        index.add("a2", "org_a", "cacao.pdf", index.hasher.signature(OTRO))
+        index.add_alias("a1", _reference("manual_rev.pdf"))
+        index.flush_journal(path)
+        # ...y otro cortado a mitad de la escritura de su línea
+        with open(os.path.join(path, NEAR_DUP_JOURNAL), "a", encoding="utf-8") as f:
+            f.write('{"ops": [{"op": "remove", "collection": "org_a", "sour')
+
+        loaded = NearDupIndex.load(path)
+        assert len(loaded) == 2
+        assert loaded.find(index.hasher.signature(OTRO), "org_a")["id"] == "a2"
+        assert loaded.alias_label("a1") == "manual_rev.pdf (p. 1)"
+        assert loaded._journal == []
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"✅ {name}")
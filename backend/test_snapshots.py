@@ -0,0 +1,127 @@
+"""
+Pruebas de la verificación de snapshots al importar (sin Chroma).
+
+Los snapshots se arman a mano con el mismo formato que export_snapshot y se
+importan sin validar ni activar: lo que se prueba es la verificación de cada
+miembro contra SNAPSHOT.json.
+
+    python -m pytest -q test_snapshots.py
+    python test_snapshots.py
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+
+from snapshots import FORMAT_VERSION, SNAPSHOT_FILE, import_snapshot, read_info
+
+GENERATION = "20250301-120000"
+FILES = {
+    "index/chroma.sqlite3": b"sqlite de prueba",
+    "index/keyword_index/vocab.npy": b"vocabulario de prueba",
+    "index/manifest.json": b"{}",
+}
+
+
+def _add(tar: tarfile.TarFile, name: str, data: bytes):
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    tar.addfile(member, io.BytesIO(data))
+
+
+def _write_snapshot(path: str, files=FILES, recorded=FILES, extra=None, generation=GENERATION):
+    """files: lo que se empaqueta; recorded: lo que SNAPSHOT.json dice que hay"""
+    info = {
+        "format_version": FORMAT_VERSION,
+        "generation": generation,
+        "embedding_model": "paraphrase-multilingual-MiniLM-L12-v2",
+        "collections": {},
+        "files": {name: {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+                  for name, data in recorded.items()},
+    }
+    with tarfile.open(path, "w:gz") as tar:
+        _add(tar, SNAPSHOT_FILE, json.dumps(info).encode("utf-8"))
+        for name, data in list(files.items()) + list((extra or {}).items()):
+            _add(tar, name, data)
+
+
+def _import_error(snapshot: str, db_dir: str) -> str:
+    try:
+        import_snapshot(snapshot, db_dir, activate=False, validate=False)
+    except ValueError as e:
+        # Lo extraído a medias no queda en generations/
+        assert os.listdir(os.path.join(db_dir, "generations")) == []
+        return str(e)
+    raise AssertionError("se esperaba ValueError")
+
+
+def test_intact_snapshot_is_imported():
+    with tempfile.TemporaryDirectory() as root:
+        snapshot = os.path.join(root, "indice.tar.gz")
+        _write_snapshot(snapshot)
+        assert read_info(snapshot)["generation"] == GENERATION
+        assert import_snapshot(snapshot, root, activate=False, validate=False) == GENERATION
+        with open(os.path.join(root, "generations", GENERATION, "chroma.sqlite3"), "rb") as f:
+            assert f.read() == FILES["index/chroma.sqlite3"]
+
+
+def test_corrupted_member_is_rejected():
+    with tempfile.TemporaryDirectory() as root:
+        snapshot = os.path.join(root, "indice.tar.gz")
+        _write_snapshot(snapshot, files={**FILES, "index/chroma.sqlite3": b"sqlite de prueba, alterado"})
+        assert "Checksum distinto: index/chroma.sqlite3" in _import_error(snapshot, root)
+
+
+def test_missing_member_is_rejected():
+    with tempfile.TemporaryDirectory() as root:
+        snapshot = os.path.join(root, "indice.tar.gz")
+        files = {name: data for name, data in FILES.items() if name != "index/manifest.json"}
+        _write_snapshot(snapshot, files=files)
+        assert "Faltan 1 archivos" in _import_error(snapshot, root)
+
+
+def test_unexpected_member_is_rejected():
+    with tempfile.TemporaryDirectory() as root:
+        snapshot = os.path.join(root, "indice.tar.gz")
+        _write_snapshot(snapshot, extra={"../fuera.txt": b"x"})
+        assert "Miembro inesperado" in _import_error(snapshot, root)
+        assert not os.path.exists(os.path.join(root, "..", "fuera.txt"))
+
+
+def test_malicious_generation_id_is_rejected():
+    with tempfile.TemporaryDirectory() as root:
+        db_dir = os.path.join(root, "chroma_db")
+        victim = os.path.join(root, "victima")
+        os.makedirs(os.path.join(db_dir, "generations"))
+        os.makedirs(victim)
+        with open(os.path.join(victim, "datos.txt"), "w", encoding="utf-8") as f:
+            f.write("no borrar")
+        snapshot = os.path.join(root, "indice.tar.gz")
+        # generations/../../victima.importing y generations/../../victima
+        for generation in ("../../victima", "../victima", "20250301-120000/../..", "20250301-120000\n", "", None):
+            _write_snapshot(snapshot, generation=generation)
+            assert "Id de generación inválido" in _import_error(snapshot, db_dir)
+        with open(os.path.join(victim, "datos.txt"), "r", encoding="utf-8") as f:
+            assert f.read() == "no borrar"
+        assert sorted(os.listdir(root)) == ["chroma_db", "indice.tar.gz", "victima"]
+
+
+def test_archive_without_header_is_not_a_snapshot():
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "otro.tar.gz")
+        with tarfile.open(path, "w:gz") as tar:
+            _add(tar, "index/chroma.sqlite3", b"x")
+        try:
+            read_info(path)
+            raise AssertionError("se esperaba ValueError")
+        except ValueError as e:
+            assert SNAPSHOT_FILE in str(e)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,74 @@
+"""
+Pruebas de GridIndex.nearest (lejos de todo, antimeridiano, latitudes altas).
+
+    python -m pytest -q test_territorial.py
+    python test_territorial.py
+"""
+import json
+import random
+import time
+
+from territorial import LOCATIONS_FILE, GridIndex, haversine_km
+
+
+def _brute_force(points, lat, lng, k, max_km=None):
+    found = sorted((haversine_km(lat, lng, p_lat, p_lng), item) for p_lat, p_lng, item in points)
+    return [(dist, item) for dist, item in found if max_km is None or dist <= max_km][:k]
+
+
+def _index(points, cell_deg=0.5):
+    index = GridIndex(cell_deg)
+    for p_lat, p_lng, item in points:
+        index.insert(p_lat, p_lng, item)
+    return index
+
+
+def _partner_points():
+    with open(LOCATIONS_FILE, "r", encoding="utf-8") as f:
+        orgs = json.load(f)["organizaciones"]
+    return [(o["lat"], o["lng"], nombre) for nombre, o in orgs.items()]
+
+
+def test_far_point_finds_nearest_partner_quickly():
+    points = _partner_points()
+    index = _index(points)
+    for lat, lng in ((-33.0, 151.0), (40.0, 100.0), (-89.0, 0.0), (89.9, -179.9)):
+        start = time.perf_counter()
+        found = index.nearest(lat, lng, k=1)
+        assert time.perf_counter() - start < 0.5
+        assert found == _brute_force(points, lat, lng, 1)
+
+
+def test_antimeridian_wraps_around():
+    points = [(0.0, 179.9, "este"), (0.0, 170.0, "lejos_este"), (0.0, -170.0, "lejos_oeste")]
+    index = _index(points)
+    assert [item for _, item in index.nearest(0.0, -179.9, k=1)] == ["este"]
+    assert [item for _, item in index.nearest(0.0, -179.9, k=3, max_km=100)] == ["este"]
+
+
+def test_high_latitude_uses_true_distance():
+    # A 80° de latitud 90° de longitud son ~1570 km y 20° de latitud ~2220 km
+    points = [(80.0, 90.0, "mismo_paralelo"), (60.0, 0.0, "mismo_meridiano")]
+    index = _index(points)
+    assert [item for _, item in index.nearest(80.0, 0.0, k=1)] == ["mismo_paralelo"]
+
+
+def test_matches_brute_force_on_random_points():
+    rng = random.Random(28)
+    points = [(rng.uniform(-60, 60), rng.uniform(-180, 180), i) for i in range(300)]
+    points += [(rng.uniform(80, 89.9), rng.uniform(-180, 180), 300 + i) for i in range(30)]
+    points += [(rng.uniform(-5, 5), rng.choice((-1, 1)) * rng.uniform(178, 180), 330 + i) for i in range(30)]
+    index = _index(points, cell_deg=2.0)
+    queries = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)]
+    queries += [(0.0, 179.99), (0.0, -179.99), (89.5, 45.0), (-89.5, -45.0)]
+    for lat, lng in queries:
+        for k, max_km in ((1, None), (5, None), (5, 1500.0)):
+            expected = [round(dist, 6) for dist, _ in _brute_force(points, lat, lng, k, max_km)]
+            assert [round(dist, 6) for dist, _ in index.nearest(lat, lng, k, max_km)] == expected
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_"):
+            func()
+            print(f"✅ {name}")
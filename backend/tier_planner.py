@@ -0,0 +1,114 @@
+"""
+Planificación de la recuperación por niveles.
+
+Sin planificador, search_tiered busca siempre los dos niveles con k fijo (10 en
+la organización y 3 en global). Con TIER_PLANNER_ENABLED:
+- Tier 1 se omite si la organización no tiene documentos en el índice (p. ej.
+  GLOBAL_ONLY, una organización sin carpeta): no hay nada que encontrar;
+- el k de cada nivel va de TIER*_K_MIN a TIER*_K según cuántos candidatos
+  vectoriales quedan a menos de TIER_K_MARGIN de similitud del mejor (una
+  pregunta puntual con un fragmento claramente mejor trae menos contexto que
+  una amplia); fetch_k = k × MMR_FETCH_K_MULTIPLIER;
+- Tier 2 se omite cuando Tier 1 cubre claramente la pregunta: la mejor
+  similitud llega a TIER2_SKIP_MIN_SIMILARITY, los fragmentos contienen al
+  menos TIER2_SKIP_COVERAGE de los términos de la consulta y la parte vectorial
+  y BM25 coinciden en al menos TIER2_SKIP_AGREEMENT fragmentos.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+
+TIER_PLANNER_ENABLED = os.getenv("TIER_PLANNER_ENABLED", "1").lower() in ("1", "true", "yes")
+TIER1_K = int(os.getenv("TIER1_K", "10"))
+TIER1_K_MIN = int(os.getenv("TIER1_K_MIN", "5"))
+TIER2_K = int(os.getenv("TIER2_K", "3"))
+TIER2_K_MIN = int(os.getenv("TIER2_K_MIN", "2"))
+# Similitud coseno por debajo de la mejor que todavía cuenta como "igual de relevante"
+TIER_K_MARGIN = float(os.getenv("TIER_K_MARGIN", "0.1"))
+TIER2_SKIP_MIN_SIMILARITY = float(os.getenv("TIER2_SKIP_MIN_SIMILARITY", "0.6"))
+TIER2_SKIP_COVERAGE = float(os.getenv("TIER2_SKIP_COVERAGE", "0.8"))
+TIER2_SKIP_AGREEMENT = int(os.getenv("TIER2_SKIP_AGREEMENT", "2"))
+
+
+def cosine_similarities(query_embedding: Iterable[float], vectors) -> np.ndarray:
+    import numpy as np
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+    return (vectors @ query) / norms
+
+
+def adaptive_k(similarities: np.ndarray, k: int, k_min: int) -> int:
+    """Candidatos a menos de TIER_K_MARGIN del mejor, entre k_min y k"""
+    import numpy as np
+
+    if len(similarities) == 0:
+        return k
+    close = int(np.count_nonzero(similarities >= similarities.max() - TIER_K_MARGIN))
+    return max(min(k_min, k), min(close, k))
+
+
+def covers_question(query_terms: List[str], docs: List[Any], vector_docs: List[Any],
+                    bm25_docs: List[Any]) -> bool:
+    """Si los fragmentos de Tier 1 bastan para responder (ver el docstring del módulo)"""
+    from rag_processor import tokenize_es
+
+    similarities = [d.metadata["similarity"] for d in vector_docs if "similarity" in d.metadata]
+    if not query_terms or not similarities or max(similarities) < TIER2_SKIP_MIN_SIMILARITY:
+        return False
+    vector_ids = {d.metadata.get("chunk_id") for d in vector_docs}
+    agreement = sum(1 for d in bm25_docs if d.metadata.get("chunk_id") in vector_ids)
+    if agreement < TIER2_SKIP_AGREEMENT:
+        return False
+    wanted = set(query_terms)
+    missing = set(wanted)
+    for doc in docs:
+        missing.difference_update(tokenize_es(doc.page_content))
+        if len(wanted) - len(missing) >= TIER2_SKIP_COVERAGE * len(wanted):
+            return True
+    return False
+
+
+class PlannerStats:
+    """Contadores para /debug/admission: cuánto trabajo se ahorra"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"consultas": 0, "tier1_omitidos": 0, "tier2_omitidos": 0,
+                         "fragmentos_tier1": 0, "fragmentos_tier2": 0}
+
+    def add(self, **counts: int):
+        with self._lock:
+            for key, value in counts.items():
+                self.counters[key] += value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        consultas = max(counters["consultas"], 1)
+        skipped = counters["tier1_omitidos"] + counters["tier2_omitidos"]
+        searched1 = max(counters["consultas"] - counters["tier1_omitidos"], 1)
+        searched2 = max(counters["consultas"] - counters["tier2_omitidos"], 1)
+        return {**counters, "activo": TIER_PLANNER_ENABLED,
+                "niveles_por_consulta": round(2 - skipped / consultas, 2),
+                "k_medio_tier1": round(counters["fragmentos_tier1"] / searched1, 1),
+                "k_medio_tier2": round(counters["fragmentos_tier2"] / searched2, 1)}
+
+
+planner_stats = PlannerStats()
+
+
+def known_org_ids(shards: Dict[str, Any], doc_index=None, bm25=None) -> Optional[set]:
+    """org_id con documentos en el índice (None = no se sabe, no se omite nada)"""
+    if shards:
+        return set(shards) - {"GLOBAL"}
+    store = doc_index.documents if doc_index is not None else (bm25.chunks if bm25 is not None else None)
+    if store is not None and "org_id" in store.values:
+        return set(store.values["org_id"]) - {"GLOBAL"}
+    return None
@@ -11,6 +11,8 @@ const ChatInterface = ({ selectedOrg, onClose }) => {
     const [messages, setMessages] = useState([]);
     const [inputMessage, setInputMessage] = useState('');
     const [isLoading, setIsLoading] = useState(false);
+    // Sesión del backend: permite preguntas de seguimiento ("¿y sus metas?")
+    const [sessionId, setSessionId] = useState(null);
 
     const sendMessage = async () => {
         if (!inputMessage.trim()) return;
@@ -28,12 +30,15 @@ const ChatInterface = ({ selectedOrg, onClose }) => {
                 },
                 body: JSON.stringify({
                     organizacion: selectedOrg.nombre,
-                    mensaje: inputMessage
+                    mensaje: inputMessage,
+                    session_id: sessionId
                 }),
             });
 
             const data = await response.json();
-            const botMessage = { role: 'assistant', content: data.respuesta };
+            if (data.session_id) setSessionId(data.session_id);
+            // 429/503 (servidor saturado) traen el aviso en `detail`
+            const botMessage = { role: 'assistant', content: data.respuesta ?? data.detail };
             setMessages(prev => [...prev, botMessage]);
         } catch (error) {
             console.error('Error en chat:', error);